@@ -2,6 +2,7 @@ import cPickle as pickle
 import numpy
 import glob, os, stat, time, datetime, sys
 import re
+import jobcache
 import tspl_utils
 import math
 import logging, multiprocessing
@@ -16,6 +17,8 @@ class TSPLBase:
 
     if job_stats:
       self.j = job_stats
+    elif jobcache.is_job_cache(file):
+      self.j=jobcache.load(file)
     else:
       self.f=open(file)
       try:
@@ -13,6 +13,7 @@ import masterplot as mp
 import plotkey, tspl, lariat_utils
 import job_stats as data
 import MetaData
+import jobcache
 import cPickle as pickle 
 import time
    
@@ -181,9 +182,13 @@ def get_data(pk):
         data = cache.get(pk)
     else:
         job = Job.objects.get(pk = pk)
-        with open(job.path,'rb') as f:
-            data = pickle.load(f)
+        if jobcache.is_job_cache(job.path):
+            data = jobcache.load(job.path, mmap=False)
             cache.set(job.id, data)
+        else:
+            with open(job.path,'rb') as f:
+                data = pickle.load(f)
+                cache.set(job.id, data)
     return data
 
 def master_plot(request, pk):
@@ -3,6 +3,7 @@ from datetime import datetime
 import pytz
 import cPickle as pickle
 import job_stats
+import jobcache
 import lariat_utils
 import analyze_conf
 
@@ -67,9 +68,12 @@ class MetaData():
             if pickle_file in self.json: continue
             try:
                 pickle_path = os.path.join(self.pickle_dir,pickle_file) 
-                with open(pickle_path, 'rb') as fh:
-                    data = pickle.load(fh)
-                    self.add_job(data, pickle_path)
+                if jobcache.is_job_cache(pickle_path):
+                    self.add_job(jobcache.load(pickle_path), pickle_path)
+                else:
+                    with open(pickle_path, 'rb') as fh:
+                        data = pickle.load(fh)
+                        self.add_job(data, pickle_path)
                 ctr = ctr + 1
             except: 
                 if os.path.join(self.pickle_dir,pickle_file) == self.meta_path: pass
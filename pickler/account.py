@@ -8,11 +8,16 @@ import sys
 import time
 import logging
 import getopt
+from collections import OrderedDict
 from summarize import SUMMARY_VERSION
-from scripthelpers import setuplogger
+from scripthelpers import setuplogger, prefetch
 
 VERSION_NUMBER = 1
 
+# Number of decoded accounting records that are read ahead of the summarizer
+# when the records are streamed
+PREFETCH_RECORDS = 1000
+
 class DbInterface:
     def __init__(self, dbname, tablename, mydefaults):
 
@@ -69,24 +74,67 @@ class DbInterface:
         cur.execute(query, data)
         return cur.fetchone()[0]
 
+# Number of jobs and the number of seconds after which the logged process
+# versions are written
+LOG_BATCH_SIZE = 100
+LOG_BATCH_SECONDS = 30
+
 class DbLogger(object):
-    def __init__(self, dbname, tablename, mydefaults):
+    """ Records the process version of the summarized jobs. The updates are
+        buffered and written in a single transaction once batchsize jobs have
+        been logged or the oldest has waited batchseconds. flush() must be
+        called before exiting. """
+    def __init__(self, dbname, tablename, mydefaults, batchsize=LOG_BATCH_SIZE, batchseconds=LOG_BATCH_SECONDS):
         self.con = mdb.connect(db=dbname, read_default_file=mydefaults)
         self.tablename = tablename
+        self.batchsize = batchsize
+        self.batchseconds = batchseconds
+        self.pending = OrderedDict()
+        self.pendingsince = None
 
     def logprocessed(self, acct, resource_id, version):
 
-        query = "UPDATE " + self.tablename + " SET process_version = %s, summary_version = %s WHERE resource_id = %s AND local_job_id = %s AND job_array_index = %s AND end_time_ts = %s"
         local_jobid = acct['local_jobid'] if 'local_jobid' in acct else acct['id']
         job_array_index = acct['job_array_index'] if 'job_array_index' in acct else -1
-        data = ( version, SUMMARY_VERSION, resource_id, local_jobid, job_array_index, acct['end_time'] )
+
+        if not self.pending:
+            self.pendingsince = time.time()
+        # A job that is logged twice keeps the last version
+        key = ( resource_id, local_jobid, job_array_index, acct['end_time'] )
+        self.pending.pop(key, None)
+        self.pending[key] = version
+
+        if len(self.pending) >= self.batchsize or time.time() - self.pendingsince >= self.batchseconds:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered process versions """
+        if not self.pending:
+            return
+
+        # One statement per job with equality predicates so that every
+        # update uses the index. MySQL before 5.7.3 cannot use it for a row
+        # constructor IN list.
+        query = "UPDATE " + self.tablename + " SET process_version = %s, summary_version = %s WHERE resource_id = %s AND local_job_id = %s AND job_array_index = %s AND end_time_ts = %s"
+        data = [ (version, SUMMARY_VERSION, resource_id, local_jobid, job_array_index, end_time)
+                 for (resource_id, local_jobid, job_array_index, end_time), version in self.pending.iteritems() ]
 
         cur = self.con.cursor()
-        cur.execute(query, data)
+        cur.executemany(query, data)
         self.con.commit()
 
+        self.pending.clear()
+
 class DbAcct(object):
-    def __init__(self, resource_id, dbconf, process_version, totalprocs = None, procid = None, local_jobid = None):
+    def __init__(self, resource_id, dbconf, process_version, totalprocs = None, procid = None, local_jobid = None, recompute = False):
+        """ If recompute is set then the reader returns the jobs that have
+            been processed with process_version but have an older summary
+            version instead of the jobs that have not been processed. If the
+            stream_page_size setting of the database is set the jobs are read
+            in pages of that many records and decoded by a background thread.
+            The work queue (see workqueue) reads all of the records of a
+            resource up front to order them by cost, so paging only bounds the
+            memory of the workers that read the database themselves. """
         self.con = mdb.connect(db=dbconf['dbname'], read_default_file=dbconf['defaultsfile'])
         self.tablename = dbconf['tablename']
         self.process_version = process_version
@@ -94,6 +142,8 @@ class DbAcct(object):
         self.local_jobid = local_jobid
         self.totalprocs = totalprocs
         self.procid = procid
+        self.recompute = recompute
+        self.pagesize = dbconf.get('stream_page_size')
 
     def jobidreader(self, local_jobid):
         query = "SELECT UNCOMPRESS(record) FROM " + self.tablename + " WHERE resource_id = %s AND local_job_id = %s"
@@ -111,8 +161,12 @@ class DbAcct(object):
             yield r
 
     def timereader(self,start_time=None, end_time=None, seek=0):
-        query = "SELECT UNCOMPRESS(record) FROM " + self.tablename + " WHERE resource_id = %s AND process_version != %s "
-        data = ( self.resource_id, self.process_version )
+        if self.recompute:
+            query = " WHERE resource_id = %s AND process_version = %s AND summary_version != %s "
+            data = ( self.resource_id, self.process_version, SUMMARY_VERSION )
+        else:
+            query = " WHERE resource_id = %s AND process_version != %s "
+            data = ( self.resource_id, self.process_version )
         if start_time != None:
             query += " AND end_time_ts >= %s "
             data = data + ( start_time, )
@@ -122,7 +176,13 @@ class DbAcct(object):
         if self.totalprocs != None and self.procid != None:
             query += " AND (CRC32(local_job_id) %% %s) = %s"
             data = data + ( self.totalprocs, self.procid )
-        query += " ORDER BY end_time_ts ASC"
+
+        if self.pagesize:
+            for r in prefetch(self.pagereader(query, data), PREFETCH_RECORDS):
+                yield r
+            return
+
+        query = "SELECT UNCOMPRESS(record) FROM " + self.tablename + query + " ORDER BY end_time_ts ASC"
 
         cur = self.con.cursor()
         cur.execute(query, data)
@@ -131,6 +191,38 @@ class DbAcct(object):
             r = json.loads(record[0])
             yield r
 
+    def pagereader(self, where, data):
+        """ Yield the records that match the where clause a page at a time.
+            Each page starts after the last job of the previous one, so the
+            jobs that are logged as processed meanwhile do not shift the
+            pages. A page is read in full and its cursor closed before its
+            records are handed out so that no query is left open while the
+            jobs are summarized. """
+        query = "SELECT end_time_ts, local_job_id, job_array_index, UNCOMPRESS(record) FROM " + self.tablename + where
+        last = None
+        while True:
+            if last == None:
+                pagequery = query
+                pagedata = data
+            else:
+                pagequery = query + " AND (end_time_ts > %s OR (end_time_ts = %s AND (local_job_id > %s OR (local_job_id = %s AND job_array_index > %s))))"
+                pagedata = data + ( last[0], last[0], last[1], last[1], last[2] )
+            pagequery += " ORDER BY end_time_ts ASC, local_job_id ASC, job_array_index ASC LIMIT %s"
+
+            cur = self.con.cursor()
+            try:
+                cur.execute(pagequery, pagedata + ( self.pagesize, ))
+                page = cur.fetchall()
+            finally:
+                cur.close()
+
+            for record in page:
+                yield json.loads(record[3])
+
+            if len(page) < self.pagesize:
+                return
+            last = page[-1][:3]
+
     def reader(self,start_time=None, end_time=None, seek=0):
         """ seek parameter is unused. It is present for API compatibilty with file batch acct class """
         if self.local_jobid:
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+""" Persistent cache of parsed tacc_stats raw archive files.
+
+    Each archive file is parsed once into numpy arrays, one (rows x n) block of
+    values per (type, dev) together with the index of the stats record that
+    each row came from. The non-data lines (timestamps, marks, procdumps) are
+    kept as text so that Host can replay them through its usual state machine
+    for each job and then slice the records inside the job window out of the
+    arrays.
+
+    The cache files are stored as CACHE_DIR/HOSTDIR/FILENAME.npz and record the
+    size and modification time of the archive file. A cache file is rebuilt if
+    the archive file has changed since it was written. """
+import gzip
+import io
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import numpy
+import blockparser
+import job_stats
+
+CACHE_VERSION = 1
+
+class ParsedArchive(object):
+    """ The contents of one raw archive file.
+
+        header    - the lines read by Host.read_stats_file_header()
+        events    - list of (fileline, line, block) for the body of the file.
+                    line is None for a stats record's data lines, in which case
+                    block is the index of the record's data.
+        malformed - per data block list of (fileline, line) that could not be
+                    parsed and need to be passed to Host.processdata()
+        keys      - list of (type_name, dev_name)
+        values    - per key (rows x n) uint64 array
+        blocks    - per key vector of the data block index of each row
+        error     - (fileline, message) if reading the file failed part way """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = []
+        self.events = []
+        self.malformed = []
+        self.keys = []
+        self.values = []
+        self.blocks = []
+        self.error = None
+
+    @property
+    def nblocks(self):
+        return len(self.malformed)
+
+    def devices(self):
+        return zip(self.keys, self.values, self.blocks)
+
+
+def _recordlines(fp, lines):
+    for line in fp:
+        lines.append(line)
+        yield line
+
+class _ArchiveBuilder(object):
+    """ Accumulates the data lines of an archive file into per device rows """
+
+    def __init__(self, archive, schemas):
+        self.archive = archive
+        self.schemas = schemas
+        self.parser = blockparser.BlockParser(schemas)
+        self.rows = {}
+
+    def addrow(self, type_name, dev_name, block, vals):
+        rows = self.rows.get((type_name, dev_name))
+        if rows is None:
+            rows = self.rows[(type_name, dev_name)] = ([], [])
+            self.archive.keys.append((type_name, dev_name))
+        rows[0].append(block)
+        rows[1].append(vals)
+
+    def addblock(self, lines):
+        block = len(self.archive.malformed)
+        malformed = []
+        remaining = lines
+        parsed = self.parser.parse([line for _, line in lines])
+        if parsed is not None:
+            layout, values = parsed
+            for type_name, dev_name, offset, n in layout.devices:
+                self.addrow(type_name, dev_name, block, values[offset:offset + n])
+            remaining = []
+
+        for fileline, line in remaining:
+            # Same checks as Host.processdata(). Anything that would be
+            # reported as an error is kept as text.
+            try:
+                type_name, dev_name, rest = line.split(None, 2)
+                schema = self.schemas.get(type_name)
+                if schema:
+                    if type_name == 'proc':
+                        dev_name, vals = job_stats.Host.processproc(schema, dev_name, rest)
+                    else:
+                        vals = numpy.fromstring(rest, dtype=numpy.uint64, sep=' ')
+                    if vals.shape[0] == len(schema):
+                        self.addrow(type_name, dev_name, block, vals)
+                        continue
+            except Exception:
+                pass
+            malformed.append((fileline, line))
+
+        self.archive.malformed.append(malformed)
+        self.archive.events.append((lines[0][0], None, block))
+
+    def finish(self):
+        # Keep the devices of each type together so that they can be
+        # stored as one array per type
+        order = dict((type_name, i) for i, (type_name, _) in reversed(list(enumerate(self.archive.keys))))
+        self.archive.keys.sort(key=lambda k: order[k[0]])
+        for type_name, dev_name in self.archive.keys:
+            blocks, vals = self.rows[(type_name, dev_name)]
+            self.archive.blocks.append(numpy.array(blocks, dtype=numpy.int64))
+            self.archive.values.append(numpy.array(vals, dtype=numpy.uint64))
+        self.rows = {}
+
+
+def parse_archive(path):
+    """ Parse the raw archive file at path into a ParsedArchive """
+    archive = ParsedArchive(path)
+
+    # The header is read with the Host code so that the cache holds
+    # exactly the lines that it consumes.
+    job = job_stats.Job({ 'id': None, 'start_time': 0, 'end_time': 0 }, None, None, None)
+    host = job_stats.Host(job, None, None, "")
+    host.filename = path
+    host.fileline = 0
+
+    with gzip.open(path) as file:
+        fp = io.BufferedReader(file)
+        schemas = host.read_stats_file_header(_recordlines(fp, archive.header))
+        if not schemas:
+            return archive
+
+        builder = _ArchiveBuilder(archive, schemas)
+        fileline = host.fileline
+        try:
+            block = []
+            for line in fp:
+                fileline += 1
+                line = line.strip()
+                if line[:1].isalpha():
+                    block.append((fileline, line))
+                    continue
+                if block:
+                    builder.addblock(block)
+                    block = []
+                if line:
+                    archive.events.append((fileline, line, None))
+            if block:
+                builder.addblock(block)
+        except Exception as e:
+            # Host.read_stats_file() stops at the first read error
+            archive.error = (fileline, str(e))
+        builder.finish()
+
+    return archive
+
+
+def _pack(strings):
+    lengths = numpy.array([len(s) for s in strings], dtype=numpy.int64)
+    return numpy.array(bytearray(''.join(strings)), dtype=numpy.uint8), lengths
+
+def _unpack(blob, lengths):
+    text = blob.tostring()
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths))).tolist()
+    return [text[offsets[i]:offsets[i+1]] for i in xrange(len(lengths))]
+
+def cache_path(cache_dir, path):
+    """ Return the name of the cache file for the archive file at path """
+    return os.path.join(cache_dir, os.path.basename(os.path.dirname(path)), os.path.basename(path) + ".npz")
+
+def write_cache(filename, archive, st):
+    """ Save archive to the cache file filename. st is the os.stat() of the
+        archive file when it was parsed. """
+    arrays = {}
+    types = []
+    for type_name, dev_name in archive.keys:
+        if not types or types[-1] != type_name:
+            types.append(type_name)
+
+    arrays['meta'] = numpy.array([CACHE_VERSION, st.st_size, len(types)], dtype=numpy.int64)
+    arrays['mtime'] = numpy.array([st.st_mtime], dtype=numpy.float64)
+    arrays['header'], arrays['header_len'] = _pack(archive.header)
+
+    arrays['event_line'] = numpy.array([e[0] for e in archive.events], dtype=numpy.int64)
+    arrays['event_block'] = numpy.array([-1 if e[2] is None else e[2] for e in archive.events], dtype=numpy.int64)
+    arrays['event_text'], arrays['event_len'] = _pack([e[1] for e in archive.events if e[1] is not None])
+
+    arrays['malformed_block'] = numpy.array([b for b, lines in enumerate(archive.malformed) for _ in lines], dtype=numpy.int64)
+    arrays['malformed_line'] = numpy.array([l[0] for lines in archive.malformed for l in lines], dtype=numpy.int64)
+    arrays['malformed_text'], arrays['malformed_len'] = _pack([l[1] for lines in archive.malformed for l in lines])
+    arrays['nblocks'] = numpy.array([archive.nblocks], dtype=numpy.int64)
+
+    if archive.error:
+        arrays['error_line'] = numpy.array([archive.error[0]], dtype=numpy.int64)
+        arrays['error_text'], arrays['error_len'] = _pack([archive.error[1]])
+
+    arrays['key_type'], arrays['key_type_len'] = _pack([k[0] for k in archive.keys])
+    arrays['key_dev'], arrays['key_dev_len'] = _pack([k[1] for k in archive.keys])
+    arrays['key_rows'] = numpy.array([len(b) for b in archive.blocks], dtype=numpy.int64)
+    # The rows for all of the devices of a type are concatenated since
+    # there is a significant overhead for each array in the cache file
+    for i, type_name in enumerate(types):
+        indices = [k for k, key in enumerate(archive.keys) if key[0] == type_name]
+        arrays['values%d' % i] = numpy.concatenate([archive.values[k] for k in indices])
+        arrays['blocks%d' % i] = numpy.concatenate([archive.blocks[k] for k in indices])
+
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Created by another process
+            if not os.path.isdir(dirname):
+                raise
+
+    # Write to a temporary file and rename so that concurrent readers never
+    # see a partially written cache file.
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            numpy.savez_compressed(fp, **arrays)
+        os.rename(tmpname, filename)
+    except:
+        os.unlink(tmpname)
+        raise
+
+def read_cache(filename, path, st):
+    """ Return the ParsedArchive from the cache file filename or None if the
+        cache file does not exist or does not match the archive file """
+    if not os.path.exists(filename):
+        return None
+
+    with numpy.load(filename) as data:
+        version, size, ntypes = data['meta'].tolist()
+        if version != CACHE_VERSION or size != st.st_size or data['mtime'][0] != st.st_mtime:
+            return None
+
+        archive = ParsedArchive(path)
+        archive.header = _unpack(data['header'], data['header_len'])
+
+        text = iter(_unpack(data['event_text'], data['event_len']))
+        archive.events = [(fileline, None, block) if block >= 0 else (fileline, next(text), None)
+                          for fileline, block in zip(data['event_line'].tolist(), data['event_block'].tolist())]
+
+        archive.malformed = [[] for _ in xrange(data['nblocks'][0])]
+        for block, fileline, line in zip(data['malformed_block'].tolist(), data['malformed_line'].tolist(),
+                                         _unpack(data['malformed_text'], data['malformed_len'])):
+            archive.malformed[block].append((fileline, line))
+
+        if 'error_line' in data.files:
+            archive.error = (int(data['error_line'][0]), _unpack(data['error_text'], data['error_len'])[0])
+
+        archive.keys = zip(_unpack(data['key_type'], data['key_type_len']),
+                           _unpack(data['key_dev'], data['key_dev_len']))
+        offsets = numpy.concatenate(([0], numpy.cumsum(data['key_rows']))).tolist()
+        k = 0
+        for i in xrange(ntypes):
+            values = data['values%d' % i]
+            blocks = data['blocks%d' % i]
+            start = offsets[k]
+            type_name = archive.keys[k][0]
+            while k < len(archive.keys) and archive.keys[k][0] == type_name:
+                archive.values.append(values[offsets[k] - start:offsets[k+1] - start])
+                archive.blocks.append(blocks[offsets[k] - start:offsets[k+1] - start])
+                k += 1
+
+    return archive
+
+def load(cache_dir, path):
+    """ Return the ParsedArchive for the archive file at path. The cached copy
+        in cache_dir is used if it is up to date, otherwise the archive file
+        is parsed and the cache updated. """
+    st = os.stat(path)
+    filename = cache_path(cache_dir, path)
+
+    try:
+        archive = read_cache(filename, path, st)
+        if archive is not None:
+            return archive
+    except Exception as exc:
+        logging.warning("discarding unreadable cache file %s: %s", filename, exc)
+
+    archive = parse_archive(path)
+    try:
+        write_cache(filename, archive, st)
+    except (IOError, OSError) as exc:
+        logging.warning("unable to write cache file %s: %s", filename, exc)
+
+    return archive
+
+def load_archive(args):
+    """ Worker function for ArchiveSet.preload(). Returns the ParsedArchive
+        for the (cache_dir, path) of an archive file or None if it cannot be
+        read, the error is then reported when the job reads the file. """
+    cache_dir, path = args
+    try:
+        if cache_dir:
+            return load(cache_dir, path)
+        return parse_archive(path)
+    except (IOError, OSError):
+        return None
+
+class ArchiveSet(object):
+    """ The ParsedArchives that are shared by a batch of jobs. An archive file
+        is parsed (or loaded from cache_dir) the first time that it is needed
+        and kept in memory until every job that referenced it has released it. """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.archives = {}
+        self.refs = {}
+
+    def addref(self, path):
+        self.refs[path] = self.refs.get(path, 0) + 1
+
+    def release(self, path):
+        refs = self.refs.get(path, 0) - 1
+        if refs > 0:
+            self.refs[path] = refs
+        else:
+            self.refs.pop(path, None)
+            self.archives.pop(path, None)
+
+    def preload(self, paths, pool):
+        """ Parse the archive files in paths that are referenced but not yet
+            loaded with the processes of the multiprocessing pool """
+        missing = sorted(set(path for path in paths if path in self.refs and path not in self.archives))
+        tasks = [ (self.cache_dir, path) for path in missing ]
+        for path, archive in itertools.izip(missing, pool.imap(load_archive, tasks)):
+            if archive is not None:
+                self.archives[path] = archive
+
+    def get(self, path):
+        archive = self.archives.get(path)
+        if archive is None:
+            if self.cache_dir:
+                archive = load(self.cache_dir, path)
+            else:
+                archive = parse_archive(path)
+            if path in self.refs:
+                self.archives[path] = archive
+        return archive
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "usage: {0} CACHE_DIR ARCHIVE_FILE...".format(os.path.basename(sys.argv[0]))
+        sys.exit(1)
+    for path in sys.argv[2:]:
+        load(sys.argv[1], path)
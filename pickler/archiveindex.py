@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+""" Lookup of the raw archive files for a host from the archive index that is
+    populated by indexarchives.py. This avoids listing the archive directory
+    of every host for every job. The index can be read directly from the
+    archive database or from a local SQLite copy of it created with this
+    script. """
+
+import logging
+import os
+import sqlite3
+import sys
+from getopt import getopt
+import MySQLdb as mdb
+
+import job_stats
+
+from config import Config
+
+class ArchiveIndex(object):
+    """ Base class for the archive index lookup. Subclasses provide the
+        database connection and the query """
+
+    def __init__(self, con, query, resource_id):
+        self.con = con
+        self.query = query
+        self.resource_id = resource_id
+
+    def get_stats_paths(self, hostname, start, end, max_duration):
+        """ Return the list of (filename, start_time_ts) for the archive files
+            for hostname that may contain records between start and end,
+            sorted by start time. The end time in the index is not used on its
+            own since the index may have been built while the file was still
+            being written. """
+        cur = self.con.cursor()
+        cur.execute(self.query, (hostname, self.resource_id, end, max_duration, start))
+        path_list = [(filename, long(start_time_ts)) for filename, start_time_ts in cur]
+        cur.close()
+        return path_list
+
+class DbArchiveIndex(ArchiveIndex):
+    """ Archive index in the MySQL archive database """
+
+    def __init__(self, resource_id, dbconf):
+        con = mdb.connect(db=dbconf['dbname'], read_default_file=dbconf['defaultsfile'])
+        query = """SELECT a.filename, a.start_time_ts FROM archive a, hosts h
+                   WHERE a.hostid = h.id AND h.hostname = %s AND a.resource_id = %s
+                   AND a.start_time_ts <= %s AND GREATEST(a.end_time_ts, a.start_time_ts + %s) >= %s
+                   ORDER BY a.start_time_ts ASC"""
+        super(DbArchiveIndex, self).__init__(con, query, resource_id)
+
+SQLITE_SCHEMA = ["""CREATE TABLE IF NOT EXISTS archive (
+                        resource_id INTEGER NOT NULL,
+                        hostname TEXT NOT NULL,
+                        filename TEXT NOT NULL,
+                        start_time_ts INTEGER NOT NULL,
+                        end_time_ts INTEGER NOT NULL,
+                        PRIMARY KEY (resource_id, filename))""",
+                 "CREATE INDEX IF NOT EXISTS archive_host_time ON archive (resource_id, hostname, start_time_ts)"]
+
+class SqliteArchiveIndex(ArchiveIndex):
+    """ Local SQLite copy of the archive index """
+
+    def __init__(self, resource_id, filename):
+        con = sqlite3.connect(filename)
+        con.text_factory = str
+        query = """SELECT filename, start_time_ts FROM archive
+                   WHERE hostname = ? AND resource_id = ?
+                   AND start_time_ts <= ? AND MAX(end_time_ts, start_time_ts + ?) >= ?
+                   ORDER BY start_time_ts ASC"""
+        super(SqliteArchiveIndex, self).__init__(con, query, resource_id)
+
+def factory(config, settings):
+    """ Return the archive index for a resource or None if the resource is not
+        configured to use one. The archive_index setting is either
+        "archivedatabase" to use the archive database or the path to a SQLite
+        copy of the index. """
+    index = settings.get('archive_index')
+    if not index:
+        return None
+    if index == "archivedatabase":
+        return DbArchiveIndex(settings['resource_id'], config['archivedatabase'])
+    return SqliteArchiveIndex(settings['resource_id'], index)
+
+def export(resource_id, dbconf, filename, host_name_ext):
+    """ Copy the archive index for a resource from the archive database to
+        the SQLite file filename. The hostnames are normalized with
+        job_stats.archive_host_name() since older versions of indexarchives.py
+        stored the fully qualified names. """
+    mycon = mdb.connect(db=dbconf['dbname'], read_default_file=dbconf['defaultsfile'])
+    mycur = mycon.cursor()
+    mycur.execute("""SELECT h.hostname, a.filename, a.start_time_ts, a.end_time_ts FROM archive a, hosts h
+                     WHERE a.hostid = h.id AND a.resource_id = %s""", (resource_id, ))
+
+    con = sqlite3.connect(filename)
+    for statement in SQLITE_SCHEMA:
+        con.execute(statement)
+    con.execute("DELETE FROM archive WHERE resource_id = ?", (resource_id, ))
+    con.executemany("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?)",
+                    ((resource_id, job_stats.archive_host_name(hostname, host_name_ext), afile, start, end) for hostname, afile, start, end in mycur))
+    con.commit()
+    con.close()
+    mycon.close()
+
+def usage():
+    """ print usage """
+    print "usage: {0} [OPTS] SQLITE_FILE".format(os.path.basename(__file__))
+    print "  Copy the archive index from the archive database to a SQLite file"
+    print "  -r --resource=RES    export only the specified resource,"
+    print "                       if absent then all resources are exported"
+    print "  -c --config=PATH     specify the path to the configuration directory"
+    print "  -d --debug           set log level to debug"
+    print "  -h --help            print this help message"
+
+def main():
+    """ main script entry point """
+    opts, args = getopt(sys.argv[1:], "r:c:dh", ["resource=", "config=", "debug", "help"])
+
+    resource = None
+    confpath = None
+    loglevel = logging.INFO
+    for opt in opts:
+        if opt[0] in ("-r", "--resource"):
+            resource = opt[1]
+        elif opt[0] in ("-c", "--config"):
+            confpath = opt[1]
+        elif opt[0] in ("-d", "--debug"):
+            loglevel = logging.DEBUG
+        elif opt[0] in ("-h", "--help"):
+            usage()
+            sys.exit(0)
+
+    if len(args) != 1:
+        usage()
+        sys.exit(1)
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%dT%H:%M:%S', level=loglevel)
+
+    config = Config(confpath)
+    for resourcename, resconf in config.resourceconfigs():
+        if resource in (None, resourcename, str(resconf['resource_id'])):
+            logging.info("exporting archive index for %s", resourcename)
+            export(resconf['resource_id'], config.getsection("archivedatabase"), args[0], resconf['host_name_ext'])
+
+if __name__ == "__main__":
+    main()
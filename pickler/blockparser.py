@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+""" Block parser for the data lines in tacc_stats raw archive files.
+
+    All of the data lines of a stats record are split with one str method
+    call per line and the values of the whole record are converted to numbers
+    with a single numpy call. The records of a file normally list the same
+    devices in the same order, so the (type, dev) layout of a record is
+    looked up in a cache and the values come back as one flat vector. The
+    caller can keep the vectors of the records that share a layout and split
+    them into per device arrays once instead of appending every device of
+    every record.
+
+    Records that cannot be handled in bulk (proc data, unknown types,
+    repeated devices or lines that do not hold exactly one value per schema
+    entry separated by single spaces) are left to the line by line parser,
+    which reports the errors. """
+import gzip
+import io
+import itertools
+import os
+import sys
+import time
+import numpy
+
+class Layout(object):
+    """ The devices of a stats record. devices is the list of
+        (type_name, dev_name, offset, n) for each line, where offset is the
+        position of the n values of the line in the vector of the record. """
+
+    def __init__(self, devices, size):
+        self.devices = devices
+        self.spaces = [n - 1 for _, _, _, n in devices]
+        self.size = size
+
+class BlockParser(object):
+    """ Parses the data lines of the stats records of a file with the schemas
+        read from the header of the file. """
+
+    def __init__(self, schemas):
+        self.schemas = schemas
+        self.layouts = {}
+
+    def layout(self, types, devs):
+        key = (types, devs)
+        if key not in self.layouts:
+            self.layouts[key] = self.makelayout(types, devs)
+        return self.layouts[key]
+
+    def makelayout(self, types, devs):
+        """ Return the Layout for the lines of a record or None if they cannot
+            be parsed in bulk """
+        devices = []
+        offset = 0
+        for type_name, dev_name in zip(types, devs):
+            schema = self.schemas.get(type_name)
+            if not schema or type_name == 'proc' or not dev_name:
+                return None
+            devices.append((type_name, dev_name, offset, len(schema)))
+            offset += len(schema)
+        if len(set(zip(types, devs))) != len(devices):
+            return None
+        return Layout(devices, offset)
+
+    def parse(self, lines):
+        """ Parse the data lines of one stats record. Returns (layout, values)
+            where values is the uint64 vector of the values of all of the
+            lines, or None if the lines need to be parsed one at a time. """
+        columns = zip(*[line.split(' ', 2) for line in lines])
+        if len(columns) != 3 or len(columns[2]) != len(lines):
+            return None
+        types, devs, rests = columns
+
+        layout = self.layout(types, devs)
+        if layout is None:
+            return None
+
+        # One value per schema entry on every line. numpy also splits on
+        # other whitespace, which could move values between lines, while
+        # leading, trailing or repeated spaces leave the vector short.
+        if map(str.count, rests, itertools.repeat(' ', len(rests))) != layout.spaces:
+            return None
+        text = ' '.join(rests)
+        if '\t' in text or '\r' in text or '\x0b' in text or '\x0c' in text:
+            return None
+
+        try:
+            values = numpy.fromstring(text, dtype=numpy.uint64, sep=' ')
+        except ValueError:
+            return None
+        if values.shape[0] != layout.size:
+            # Empty or malformed values
+            return None
+
+        return layout, values
+
+def benchmark(paths):
+    """ Report the rate at which the archive files are parsed with and
+        without the block parser """
+    import job_stats
+
+    nlines = 0
+    for path in paths:
+        with gzip.open(path) as fp:
+            nlines += sum(1 for _ in io.BufferedReader(fp))
+
+    acct = { 'id': 'benchmark', 'start_time': 0, 'end_time': 2**62 }
+
+    for blockparse in (False, True):
+        job_stats.USE_BLOCK_PARSER = blockparse
+        elapsed = 0.0
+        for path in paths:
+            job = job_stats.Job(acct, None, None, None)
+            host = job_stats.Host(job, os.path.basename(os.path.dirname(path)), None, "")
+            start = time.time()
+            with gzip.open(path) as fp:
+                host.read_stats_file(io.BufferedReader(fp))
+            elapsed += time.time() - start
+        print "{0:>12} {1} lines in {2:.3f} s ({3:.0f} lines/sec)".format(
+            "block" if blockparse else "line-by-line", nlines, elapsed, nlines / elapsed if elapsed > 0 else float('inf'))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "usage: {0} ARCHIVE_FILE...".format(os.path.basename(sys.argv[0]))
+        sys.exit(1)
+    benchmark(sys.argv[1:])
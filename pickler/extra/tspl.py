@@ -2,6 +2,7 @@ import cPickle as pickle
 import numpy
 import os, sys
 import re
+import jobcache
 import math
 import job_stats
 import logging
@@ -17,6 +18,8 @@ class TSPLBase:
 
     if job_data:
       self.j = job_data
+    elif jobcache.is_job_cache(file):
+      self.j=jobcache.load(file)
     else:
       self.f=open(file)
       try:
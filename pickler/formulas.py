@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+""" Compiled formulas for the derived timeseries metrics.
+
+    A derived metric is defined as a python expression over the list of
+    interface values a and delta_t, the time between the samples. Each
+    expression is compiled into a function the first time it is used and the
+    function is kept for the rest of the run. The expressions only use numpy
+    operations that work along the last axis, so the values of many hosts or
+    devices can be evaluated in one call with each a[i] a (rows x times)
+    array. """
+import numpy
+
+MEGA = 1024.0 * 1024.0
+GIGA = MEGA * 1024.0
+
+_namespace = { "numpy": numpy, "MEGA": MEGA, "GIGA": GIGA }
+_compiled = {}
+
+def compile_formula(expression):
+    """ Return the function f(a, delta_t=None) that evaluates expression """
+    func = _compiled.get(expression)
+    if func is None:
+        code = compile("lambda a, delta_t=None: " + expression, "<formula>", "eval")
+        func = _compiled[expression] = eval(code, _namespace)
+    return func
+
+def evaluate(expression, a, delta_t=None):
+    """ Evaluate expression for the interface values a """
+    return compile_formula(expression)(a, delta_t)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+""" Record index for gzipped tacc_stats archive files.
+
+    The index is stored in a sidecar file (FILE.gz.idx) next to the archive
+    or, when INDEX_DIR is set, under INDEX_DIR at the absolute path of the
+    archive. It holds the timestamp, uncompressed byte offset and line
+    number of every stats record in the file along with the job ids in the
+    record's timestamp line and begin/end marks. Host.read_stats_file() uses it to skip
+    over the records before the start of a job without parsing them. The
+    size and modification time of the archive file are saved in the index so
+    that a stale index is rebuilt.
+
+    The sidecars next to the archives are written by indexarchives.py.
+    Reading an archive only builds a missing index when INDEX_DIR is set, so
+    the archive tree is never written to by the readers. """
+import gzip
+import logging
+import os
+import re
+import stat
+import sys
+import tempfile
+import numpy
+
+INDEX_VERSION = 1
+
+# Directory for the sidecar files, None to keep them next to the archives
+INDEX_DIR = None
+
+# Bytes of uncompressed archive data scanned at a time when building an index
+BUILD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Timestamp lines are the only lines that start with a digit. The job ids
+# from the begin and end marks are added to the record's job list.
+_recordline = re.compile(r"^(?:(\d+(?:\.\d*)?)[ \t]*(\S*)|[%^][ \t]*(?:begin|end)[ \t]+(\S+))", re.M)
+
+class GzIndex(object):
+    """ The timestamp, uncompressed offset, line number and the job ids
+        mentioned in each record """
+    __slots__ = ('timestamps', 'offsets', 'filelines', 'jobs')
+
+    def __init__(self, timestamps, offsets, filelines, jobs):
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.filelines = filelines
+        self.jobs = jobs
+
+    def seek_point(self, timestamp, jobid):
+        """ Return the (offset, fileline) of the last record with a timestamp
+            at or before timestamp, or None if there is no such record. The
+            point is moved back to the first record that mentions jobid if
+            that is earlier. The fileline is the number of the line before
+            the record. """
+        i = numpy.searchsorted(self.timestamps, timestamp, side='right') - 1
+        for j in xrange(i):
+            if jobid in self.jobs[j].split(","):
+                i = j
+                break
+        if i < 0:
+            return None
+        return int(self.offsets[i]), int(self.filelines[i])
+
+def index_path(path):
+    if INDEX_DIR:
+        return os.path.join(INDEX_DIR, os.path.abspath(path).lstrip(os.sep) + ".idx")
+    return path + ".idx"
+
+def build_index(path):
+    """ Return the GzIndex for the archive file at path """
+    timestamps = []
+    offsets = []
+    filelines = []
+    jobs = []
+    fileline = 0
+    # The file is scanned a chunk at a time, the data after the last newline
+    # of a chunk is carried over to the next one so only whole lines are
+    # matched. base is the offset of data in the uncompressed file.
+    base = 0
+    data = ""
+    with gzip.open(path) as fp:
+        while True:
+            chunk = fp.read(BUILD_CHUNK_SIZE)
+            data += chunk
+            end = data.rfind("\n") + 1 if chunk else len(data)
+            pos = 0
+            for match in _recordline.finditer(data, 0, end):
+                if match.group(1) is None:
+                    # begin or end mark
+                    if jobs:
+                        jobs[-1] += "," + match.group(3)
+                    continue
+                fileline += data.count("\n", pos, match.start())
+                pos = match.start()
+                timestamps.append(float(match.group(1)))
+                offsets.append(base + pos)
+                filelines.append(fileline)
+                jobs.append(match.group(2))
+            fileline += data.count("\n", pos, end)
+            base += end
+            data = data[end:]
+            if not chunk:
+                break
+
+    return GzIndex(numpy.array(timestamps, dtype=numpy.float64),
+                   numpy.array(offsets, dtype=numpy.int64),
+                   numpy.array(filelines, dtype=numpy.int64), jobs)
+
+def write_index(path, index, st):
+    """ Save index as the sidecar of the archive file at path. st is the
+        os.stat() of the archive file when the index was built. The sidecar
+        gets the permissions of the archive file. """
+    filename = index_path(path)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            numpy.savez(fp, meta=numpy.array([INDEX_VERSION, st.st_size], dtype=numpy.int64),
+                        mtime=numpy.array([st.st_mtime], dtype=numpy.float64),
+                        timestamps=index.timestamps, offsets=index.offsets, filelines=index.filelines,
+                        jobs=numpy.array(bytearray("\n".join(index.jobs)), dtype=numpy.uint8))
+        os.chmod(tmpname, stat.S_IMODE(st.st_mode))
+        os.rename(tmpname, filename)
+    except:
+        exc_info = sys.exc_info()
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+def read_index(path, st):
+    """ Return the GzIndex from the sidecar of the archive file at path or
+        None if there is no sidecar or it is out of date """
+    filename = index_path(path)
+    if not os.path.exists(filename):
+        return None
+    with numpy.load(filename) as data:
+        version, size = data['meta'].tolist()
+        if version != INDEX_VERSION or size != st.st_size or data['mtime'][0] != st.st_mtime:
+            return None
+        return GzIndex(data['timestamps'], data['offsets'], data['filelines'],
+                       data['jobs'].tostring().split("\n"))
+
+def get_index(path, create=None):
+    """ Return the GzIndex for the archive file at path. If there is no up to
+        date sidecar and create is set then the index is built and saved if
+        the index directory is writable. create defaults to whether INDEX_DIR
+        is set. Returns None if no index is available. """
+    if create is None:
+        create = bool(INDEX_DIR)
+    try:
+        st = os.stat(path)
+        index = read_index(path, st)
+        if index is not None or not create:
+            return index
+        dirname = os.path.dirname(index_path(path))
+        if INDEX_DIR and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if not os.access(dirname, os.W_OK):
+            return None
+        index = build_index(path)
+        write_index(path, index, st)
+        return index
+    except Exception as exc:
+        logging.debug("no record index for %s: %s", path, exc)
+        return None
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "usage: {0} ARCHIVE_FILE...".format(os.path.basename(sys.argv[0]))
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        get_index(path, create=True)
@@ -12,6 +12,9 @@ import re
 import gzip
 import MySQLdb as mdb
 
+import gzindex
+import job_stats
+
 from config import Config
 
 class DbArchiveCache(object):
@@ -151,6 +154,7 @@ class TaccStatsArchiveProcessor(object):
     def __init__(self, config, resconf):
         self.resource_id = resconf['resource_id']
         self.hostnameext = resconf['host_name_ext']
+        gzindex.INDEX_DIR = resconf.get('archive_index_dir')
         self.dbac = DbArchiveCache(self.resource_id, config)
 
     def processarchive(self, archive):
@@ -161,12 +165,13 @@ class TaccStatsArchiveProcessor(object):
             data = BasicTaccArchiveParser(archive)
             data.parse()
 
-            hostname = data.hostname
-            if self.hostnameext != "" and (not hostname.endswith(self.hostnameext)):
-                hostname += "." + self.hostnameext
+            # Stored under the same name that the jobs look the host up by
+            hostname = job_stats.archive_host_name(data.hostname, self.hostnameext)
 
             if data.firsttimestamp != None:
                 self.dbac.insert(hostname, archive, data.firsttimestamp, data.lasttimestamp, data.tacc_version)
+                # Write the record index sidecar used to skip to the start of a job
+                gzindex.get_index(archive, create=True)
             else:
                 logging.warning("corrupt archive %s", archive)
 
@@ -1,16 +1,18 @@
 #!/usr/bin/env python
-import datetime, numpy, os, sys, gzip
+import copy, datetime, functools, numpy, os, sys, gzip, io, itertools, multiprocessing, operator
 import amd64_pmc, intel_process
 import phys_cores_process
 import re
 import procdump
+import blockparser
+import archivecache
+import gzindex
 import string
 import math
 
 import logging
 
 if sys.version.startswith("3"):
-    import io
     io_method = io.BytesIO
 else:
     import cStringIO
@@ -55,6 +57,25 @@ SF_MARK_CHAR = '%'
 
 KEEP_EDITS = False
 
+# Parse the data lines of each stats record in bulk with blockparser. Files
+# are then read BLOCK_READ_SIZE bytes at a time.
+USE_BLOCK_PARSER = True
+BLOCK_READ_SIZE = 1 << 20
+
+# First character of a line, '' for an empty line
+_first_char = operator.itemgetter(slice(0, 1))
+
+# Skip the records before the start of the job with the gzindex sidecar.
+# Only existing sidecars are used unless gzindex.INDEX_DIR is set.
+USE_SEEK_INDEX = True
+
+# Jobs with fewer hosts than this are always gathered serially since
+# starting the worker pool costs more than it saves
+PARALLEL_GATHER_MIN_HOSTS = 8
+
+# Store the processed stats of a type as uint32 when all of its values fit
+COMPACT_STATS = True
+
 def schema_fixup(type_name, desc):
     """ This function implements a workaround for a known issue with incorrect schema """
     """ definitions for irq, block and sched tacc_stats metrics. """
@@ -237,6 +258,234 @@ class Schema(dict):
 #    return None
 
 
+def align_times(rawtimes, times):
+    """ Return the indices of the entries in rawtimes that have the closest
+        timestamp to each entry in times. Ties are resolved to the later record
+        to match the original scan over the raw records. """
+    rawtimes = numpy.asarray(rawtimes, dtype=numpy.float64)
+    times = numpy.asarray(times, dtype=numpy.float64)
+    n = len(rawtimes)
+
+    if n > 1 and numpy.any(rawtimes[1:] < rawtimes[:-1]):
+        # Out of order records - fall back to a linear scan
+        idx = numpy.zeros(len(times), dtype=numpy.intp)
+        k = 0
+        for i, t in enumerate(times):
+            while k + 1 < n and abs(rawtimes[k + 1] - t) <= abs(rawtimes[k] - t):
+                k += 1
+            idx[i] = k
+        return idx
+
+    right = numpy.searchsorted(rawtimes, times, side='right')
+    left = right - 1
+    rclip = numpy.minimum(right, n - 1)
+    lclip = numpy.maximum(left, 0)
+    useright = (right < n) & ((left < 0) | (numpy.abs(rawtimes[rclip] - times) <= numpy.abs(rawtimes[lclip] - times)))
+    # Skip to the last of any records with duplicate timestamps
+    idx = numpy.where(useright, numpy.searchsorted(rawtimes, rawtimes[rclip], side='right') - 1, lclip)
+    return idx
+
+def rolled_over_half(diff, widths):
+    """ Return the mask of the entries of the (k x n) uint64 array diff, the
+        differences between consecutive counter values, that are more than
+        half of the range of the counter widths (one per column). This
+        reproduces the original per-sample test (v - p) % 2**width >
+        2**(width-1) on numpy scalars: up to 62 bits both the remainder and
+        the comparison are done in float64, a 63 bit remainder is exact but
+        compared in float64 and 64 bit counters are compared exactly. """
+    result = numpy.empty(diff.shape, dtype=bool)
+    small = widths <= 62
+    if small.any():
+        w = widths[small].astype(numpy.float64)
+        result[:, small] = numpy.remainder(diff[:, small].astype(numpy.float64), 2.0**w) > 2.0**(w - 1)
+    wide = widths == 63
+    if wide.any():
+        rem = diff[:, wide] & numpy.uint64(0x7FFFFFFFFFFFFFFF)
+        result[:, wide] = rem.astype(numpy.float64) > 2.0**62
+    full = widths >= 64
+    if full.any():
+        result[:, full] = diff[:, full] > numpy.uint64(1 << 63)
+    return result
+
+class TimeAlignment(object):
+    """ Mapping from the job times to the closest raw records on a host """
+    __slots__ = ('rawtimes', 'index', 'times', 'rmsjitter', 'logrotates')
+
+    def __init__(self, rawtimes, times, rotatetimes):
+        self.rawtimes = rawtimes
+        self.index = align_times(rawtimes, times)
+        aligned = rawtimes[self.index]
+        self.times = aligned.tolist()
+        m = len(times)
+        if m > 0:
+            self.rmsjitter = math.sqrt(numpy.sum((aligned - times)**2)) / m
+        else:
+            self.rmsjitter = 0.0
+        if rotatetimes:
+            self.logrotates = numpy.nonzero(numpy.in1d(aligned, rotatetimes))[0].tolist()
+        else:
+            self.logrotates = []
+
+    def matches(self, rawtimes):
+        return numpy.array_equal(self.rawtimes, rawtimes)
+
+
+class RawDevStats(object):
+    """ Growable columnar store of the raw records for one device. The values
+        are held in a preallocated (capacity x n) uint64 block with a parallel
+        vector of timestamps. The capacity is doubled when the block is full. """
+    __slots__ = ('times', 'values', 'count')
+
+    INITIAL_CAPACITY = 32
+
+    def __init__(self, n, capacity=INITIAL_CAPACITY):
+        self.times = numpy.empty(capacity, dtype=numpy.float64)
+        self.values = numpy.empty((capacity, n), dtype=numpy.uint64)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, vals):
+        if self.count == len(self.times):
+            capacity = 2 * len(self.times)
+            self.times.resize(capacity, refcheck=False)
+            self.values.resize((capacity, self.values.shape[1]), refcheck=False)
+        self.times[self.count] = timestamp
+        self.values[self.count] = vals
+        self.count += 1
+
+    def extend(self, times, values):
+        """ Append a (k x n) block of records """
+        count = self.count + len(times)
+        if count > len(self.times):
+            capacity = max(count, 2 * len(self.times))
+            self.times.resize(capacity, refcheck=False)
+            self.values.resize((capacity, self.values.shape[1]), refcheck=False)
+        self.times[self.count:count] = times
+        self.values[self.count:count] = values
+        self.count = count
+
+    def gettimes(self):
+        """ Return the timestamps of the records as a contiguous array """
+        return self.times[:self.count]
+
+    def getvalues(self):
+        """ Return the records as a contiguous (count x n) array """
+        return self.values[:self.count]
+
+
+def compact_type_stats(type_stats):
+    """ Return the processed (dev_name: array) stats of a type with the arrays
+        narrowed to uint32 if none of the values need more than 32 bits. The
+        narrowing is exact. Only types whose arrays are all uint64 are
+        changed and all of the devices of a type keep the same dtype. """
+    arrays = type_stats.values()
+    if not COMPACT_STATS or len(arrays) == 0:
+        return type_stats
+    if not all(isinstance(a, numpy.ndarray) and a.dtype == numpy.uint64 for a in arrays):
+        return type_stats
+    if any(a.size > 0 and a.max() > numpy.iinfo(numpy.uint32).max for a in arrays):
+        return type_stats
+    return dict((dev_name, a.astype(numpy.uint32)) for dev_name, a in type_stats.iteritems())
+
+
+class LazyTypeStats(dict):
+    """ The processed stats of a host keyed by type name. The types added with
+        add_pending() are listed as keys straight away but are only processed
+        by process(type_name, pending) when their stats are first read, so
+        types that are never used cost nothing. Pickles as a plain dict. """
+
+    def __init__(self, process):
+        dict.__init__(self)
+        self.process = process
+        self.pending = {}
+
+    def add_pending(self, type_name, pending):
+        dict.__setitem__(self, type_name, None)
+        self.pending[type_name] = pending
+
+    def materialize(self, type_name):
+        pending = self.pending.pop(type_name, None)
+        if pending is not None:
+            dict.__setitem__(self, type_name, self.process(type_name, pending))
+
+    def materialize_all(self):
+        for type_name in self.pending.keys():
+            self.materialize(type_name)
+
+    def __getitem__(self, type_name):
+        if type_name in self.pending:
+            self.materialize(type_name)
+        return dict.__getitem__(self, type_name)
+
+    def __setitem__(self, type_name, value):
+        self.pending.pop(type_name, None)
+        dict.__setitem__(self, type_name, value)
+
+    def __delitem__(self, type_name):
+        self.pending.pop(type_name, None)
+        dict.__delitem__(self, type_name)
+
+    def __reduce__(self):
+        return (dict, (dict(self.iteritems()),))
+
+    def get(self, type_name, d=None):
+        return self[type_name] if type_name in self else d
+
+    def setdefault(self, type_name, d=None):
+        if type_name not in self:
+            self[type_name] = d
+        return self[type_name]
+
+    def pop(self, type_name, *d):
+        if type_name not in self:
+            return dict.pop(self, type_name, *d)
+        value = self[type_name]
+        del self[type_name]
+        return value
+
+    def popitem(self):
+        self.materialize_all()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        for type_name, value in dict(*args, **kwargs).iteritems():
+            self[type_name] = value
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def values(self):
+        self.materialize_all()
+        return dict.values(self)
+
+    def itervalues(self):
+        self.materialize_all()
+        return dict.itervalues(self)
+
+    def items(self):
+        self.materialize_all()
+        return dict.items(self)
+
+    def iteritems(self):
+        self.materialize_all()
+        return dict.iteritems(self)
+
+
+def archive_host_name(hostname, name_ext):
+    """ Return the name that the archive files of a host are listed under in
+        the archive index: the hostname up to the first dot followed by the
+        host name extension. indexarchives.py indexes the files by the
+        hostname in their header, which may be fully qualified, and the jobs
+        look them up by the hostnames of the accounting records, so both go
+        through here. """
+    name = hostname.split(".", 1)[0]
+    ext = name_ext.lstrip(".")
+    if ext:
+        return name + "." + ext
+    return name
+
 def stats_file_discard_record(file):
     for line in file:
         if line.isspace():
@@ -263,6 +512,14 @@ class Host(object):
         self.raw_stats = {}
         self.marks = {}
         self.rotatetimes = []
+        self.alignment = None
+        self.cachedblocks = []
+
+        # Records parsed by processblock() that have not been moved to
+        # raw_stats yet, see flushblocks()
+        self.blocklayout = None
+        self.blocktimes = []
+        self.blockvalues = []
 
         self.state = PENDING_FIRST_RECORD
         self.timestamp = None
@@ -272,6 +529,16 @@ class Host(object):
 
         self.mismatch_schemas = {}
 
+        # Sums over the devices of each type, see get_totals()
+        self.totals = {}
+
+        # The survey of a streamed job only reads the record times, marks
+        # and schemas and notes whether the host has any stats. The archive
+        # files are kept so that they are not looked up again.
+        self.times_only = False
+        self.has_stats = False
+        self.path_list = None
+
     def trace(self, fmt, *args):
         logging.debug( fmt % args )
 
@@ -282,6 +549,20 @@ class Host(object):
         raw_host_stats_dir = os.path.join(self.raw_stats_dir, self.name+self.name_ext)
         job_start = self.job.start_time - RAW_STATS_TIME_PAD
         job_end = self.job.end_time + RAW_STATS_TIME_PAD
+
+        if self.job.archive_index is not None:
+            # Select the files from the archive index by interval overlap
+            # rather than listing the directory. The directory is still
+            # listed if the host is not in the index.
+            try:
+                path_list = self.job.archive_index.get_stats_paths(archive_host_name(self.name, self.name_ext), job_start, job_end, 2*RAW_STATS_TIME_MAX)
+                for full_path, ent_start in path_list:
+                    self.trace("path `%s', start %d", full_path, ent_start)
+                if path_list:
+                    return path_list
+            except Exception as exc:
+                logging.error("get_stats_paths job %s archive index lookup failed. %s", self.job.id, exc)
+
         path_list = []
         try:
             for ent in os.listdir(raw_host_stats_dir):
@@ -320,7 +601,7 @@ class Host(object):
                     else:
                         self.mismatch_schemas[type_name] = 1
                         self.error("file `%s', type `%s', schema mismatch desc `%s'",
-                                   fp.name, type_name, schema_desc)
+                                   self.filename, type_name, schema_desc)
                 elif c == SF_PROPERTY_CHAR:
                     if line.startswith("$tacc_stats"):
                         self.tacc_version = line.split(" ")[1].strip()
@@ -331,7 +612,7 @@ class Host(object):
                     break
             except Exception as exc:
                 self.error("file `%s', caught `%s' discarding line `%s'",
-                           fp.name, exc, line)
+                           self.filename, exc, line)
                 break
         return file_schemas
 
@@ -349,15 +630,198 @@ class Host(object):
             self.error("file `%s' bad header on line %s", self.filename, self.fileline)
             return
 
+        if USE_SEEK_INDEX and self.state == PENDING_FIRST_RECORD:
+            self.seek_to_job_start(fp)
+
         try:
-            for line in fp:
-                self.fileline += 1
-                self.parse(line.strip())
+            # Files opened with open() read ahead when they are iterated, so
+            # the header and the blocks could not be read from the same file
+            if USE_BLOCK_PARSER and isinstance(fp, io.BufferedIOBase):
+                self.read_stats_blocks(fp)
+            else:
+                for line in fp:
+                    self.fileline += 1
+                    self.parse(line.strip())
+                    if self.state == DONE:
+                        break
+        except Exception as e:
+            self.error("file `%s' exception %s on line %s", self.filename, str(e), self.fileline)
+        self.flushblocks()
+
+    def read_stats_blocks(self, fp):
+        """Host.read_stats_blocks(fp)
+        The body of read_stats_file() with the block parser. The file is read
+        in large chunks and the data lines between the other lines of each
+        record are handed to processblock() together. The other lines go
+        through parse() as usual.
+        """
+        parser = blockparser.BlockParser(self.file_schemas)
+        # lines[-1] is the partial last line of the chunks read so far and
+        # fileline is the number of the line before lines[0]
+        lines = ['']
+        fileline = self.fileline
+        while True:
+            chunk = fp.read(BLOCK_READ_SIZE)
+            if chunk:
+                chunk = chunk.split('\n')
+                chunk[0] = lines[-1] + chunk[0]
+                lines[-1:] = chunk
+                end = len(lines) - 1
+            else:
+                end = len(lines) if lines[-1] else len(lines) - 1
+
+            isdata = map(str.isalpha, map(_first_char, itertools.islice(lines, end)))
+            start = 0
+            for i in itertools.compress(xrange(end), itertools.imap(operator.not_, isdata)):
+                if i > start:
+                    self.processblock(parser, lines[start:i], fileline + start)
+                self.fileline = fileline + i + 1
+                line = lines[i].strip()
+                if line[:1].isalpha():
+                    # Indented data line, keep the records of its device in order
+                    self.flushblocks()
+                self.parse(line)
                 if self.state == DONE:
-                    break
+                    return
+                start = i + 1
+
+            if not chunk:
+                if end > start:
+                    self.processblock(parser, lines[start:end], fileline + start)
+                    self.fileline = fileline + end
+                return
+
+            # The data lines of the last record can continue in the next chunk
+            fileline += start
+            del lines[:start]
+
+    def processblock(self, parser, lines, fileline):
+        """Host.processblock(parser, lines, fileline)
+        Process the data lines of a stats record, fileline is the number of
+        the line before the first one. The parsed records are kept until the
+        layout of the records changes and then moved to raw_stats together.
+        The survey of a streamed job only checks the lines with processdata().
+        """
+        if self.state != ACTIVE and self.state != LAST_RECORD:
+            return
+
+        parsed = None if self.times_only else parser.parse(lines)
+        if parsed is None:
+            self.flushblocks()
+            for i, line in enumerate(lines):
+                self.fileline = fileline + i + 1
+                self.processdata(line.strip())
+            return
+
+        layout, values = parsed
+        if layout is not self.blocklayout:
+            self.flushblocks()
+            self.blocklayout = layout
+        self.blocktimes.append(self.timestamp)
+        self.blockvalues.append(values)
+
+    def flushblocks(self):
+        """Host.flushblocks()
+        Append the records kept by processblock() to the RawDevStats buffers
+        of their devices.
+        """
+        if not self.blockvalues:
+            self.blocklayout = None
+            return
+
+        times = numpy.array(self.blocktimes, dtype=numpy.float64)
+        values = numpy.array(self.blockvalues)
+        for type_name, dev_name, offset, n in self.blocklayout.devices:
+            type_stats = self.raw_stats.setdefault(type_name, {})
+            dev_stats = type_stats.get(dev_name)
+            if dev_stats is None:
+                dev_stats = type_stats[dev_name] = RawDevStats(n)
+            dev_stats.extend(times, values[:, offset:offset + n])
+
+        self.blocklayout = None
+        self.blocktimes = []
+        self.blockvalues = []
+
+
+    def seek_to_job_start(self, fp):
+        """Host.seek_to_job_start(fp)
+        Skip over the records in fp that are too early to be part of the job.
+        The records are found with the gzindex sidecar of the file so the
+        skipped records are decompressed but not parsed.
+        """
+        index = gzindex.get_index(self.filename)
+        if index is None:
+            return
+        point = index.seek_point(self.job.start_time - RAW_STATS_TIME_PAD, self.job.id)
+        if point is None:
+            return
+        offset, fileline = point
+        if offset > fp.tell():
+            self.trace("skip to line %d of %s", fileline + 1, self.filename)
+            fp.seek(offset)
+            self.fileline = fileline
+
+    def read_cached_archive(self, archive):
+        """Host.read_cached_archive(archive)
+        Equivalent of read_stats_file() for an archivecache.ParsedArchive. The
+        non-data lines are replayed through the usual state machine and the
+        records that are accepted for the job are then sliced out of the
+        cached arrays in one go.
+        """
+        if self.state == DONE:
+            return
+
+        self.filename = archive.path
+        self.fileline = 0
+
+        self.file_schemas = self.read_stats_file_header(iter(archive.header))
+        if not self.file_schemas:
+            self.error("file `%s' bad header on line %s", self.filename, self.fileline)
+            return
+
+        self.cachedblocks = []
+        try:
+            for self.fileline, line, block in archive.events:
+                if line is not None:
+                    self.parse(line)
+                    if self.state == DONE:
+                        break
+                elif self.state == ACTIVE or self.state == LAST_RECORD:
+                    self.cachedblocks.append((block, self.timestamp))
+                    for self.fileline, line in archive.malformed[block]:
+                        self.processdata(line)
+            else:
+                if archive.error:
+                    self.fileline, msg = archive.error
+                    self.error("file `%s' exception %s on line %s", self.filename, msg, self.fileline)
         except Exception as e:
             self.error("file `%s' exception %s on line %s", self.filename, str(e), self.fileline)
 
+        if not self.cachedblocks:
+            return
+
+        blocks, times = zip(*self.cachedblocks)
+        self.cachedblocks = []
+        lookup = numpy.empty(archive.nblocks, dtype=numpy.intp)
+        lookup.fill(-1)
+        lookup[list(blocks)] = numpy.arange(len(blocks))
+        times = numpy.array(times, dtype=numpy.float64)
+
+        for (type_name, dev_name), values, rowblocks in archive.devices():
+            if type_name not in self.file_schemas:
+                continue
+            rows = lookup[rowblocks]
+            keep = rows >= 0
+            if not keep.any():
+                continue
+            if self.times_only:
+                self.has_stats = True
+                break
+            type_stats = self.raw_stats.setdefault(type_name, {})
+            dev_stats = type_stats.get(dev_name)
+            if dev_stats is None:
+                dev_stats = type_stats[dev_name] = RawDevStats(values.shape[1])
+            dev_stats.extend(times[rows[keep]], values[keep])
 
     def parse(self, line):
         if len(line) < 1:
@@ -445,6 +909,10 @@ class Host(object):
                         self.filename, type_name, self.fileline)
                 return
 
+            if self.times_only:
+                self.has_stats = True
+                return
+
             if type_name == 'proc':
                 dev_name, vals = self.processproc(schema, dev_name, rest)
             else:
@@ -456,8 +924,10 @@ class Host(object):
                 return
 
             type_stats = self.raw_stats.setdefault(type_name, {})
-            dev_stats = type_stats.setdefault(dev_name, [])
-            dev_stats.append((self.timestamp, vals))
+            dev_stats = type_stats.get(dev_name)
+            if dev_stats is None:
+                dev_stats = type_stats[dev_name] = RawDevStats(len(schema))
+            dev_stats.append(self.timestamp, vals)
 
     def processschema(self,line):
         print "processschema"
@@ -496,6 +966,10 @@ class Host(object):
                     if len(self.times) > 1:
                         self.trace("BEGIN_IN_MIDDLE {} {} line {} @ {} discard {} previous".format(self.name, self.filename, self.fileline, self.timestamp, len(self.times)-1 ) )
                         self.raw_stats = {}
+                        self.blocktimes = []
+                        self.blockvalues = []
+                        self.has_stats = False
+                        self.cachedblocks = []
                         self.times = [ self.timestamp ]
                         self.rotatetimes = []
                 else:
@@ -517,24 +991,78 @@ class Host(object):
                 self.procdump.parse(line)
         pass
 
-    def gather_stats(self):
-        path_list = self.get_stats_paths()
+    def gather_stats(self, path_list=None):
+        if path_list is None:
+            path_list = self.get_stats_paths()
+        self.path_list = path_list
         if len(path_list) == 0:
             self.error("no stats files overlapping job")
             return False
 
         # read_stats_file() and parse_stats() append stats records
-        # into lists of tuples in self.raw_stats.  The lists will be
-        # converted into numpy arrays below.
+        # into the RawDevStats buffers in self.raw_stats. With an archive
+        # cache, or when the job is part of a batch, the parsed files are
+        # loaded from the cache or shared with the other jobs instead.
         for path, start_time in path_list:
             try:
-                with gzip.open(path) as file:
-                    self.read_stats_file(file)
-            except IOError as ioe:
+                if self.job.archives is not None:
+                    self.read_cached_archive(self.job.archives.get(path))
+                elif self.job.archive_cache:
+                    self.read_cached_archive(archivecache.load(self.job.archive_cache, path))
+                else:
+                    with gzip.open(path) as file:
+                        self.read_stats_file(io.BufferedReader(file))
+            except (IOError, OSError) as ioe:
                 self.error("read error for file %s", path)
 
+        if self.times_only:
+            return self.has_stats
         return self.raw_stats
 
+    def get_gathered(self):
+        """Host.get_gathered()
+        Return the state collected by gather_stats() as plain lists and arrays
+        for sending back from a gather worker. Devices with identical record
+        times share a single times vector.
+        """
+        rawtimes = []
+        devices = []
+        for type_name, type_stats in self.raw_stats.iteritems():
+            for dev_name, dev_stats in type_stats.iteritems():
+                times = dev_stats.gettimes()
+                for tidx, t in enumerate(rawtimes):
+                    if numpy.array_equal(t, times):
+                        break
+                else:
+                    tidx = len(rawtimes)
+                    rawtimes.append(times.copy())
+                devices.append((type_name, dev_name, tidx, dev_stats.getvalues().copy()))
+        uidprocs = self.procdump.uidprocs if self.procdump != None else None
+        return (self.times, self.rotatetimes, self.marks, self.tacc_version, uidprocs, rawtimes, devices)
+
+    def set_gathered(self, gathered):
+        """Host.set_gathered(gathered)
+        Restore the state returned by get_gathered() in a gather worker.
+        """
+        self.times, self.rotatetimes, self.marks, self.tacc_version, uidprocs, rawtimes, devices = gathered
+        if uidprocs != None and self.procdump != None:
+            self.procdump.uidprocs = uidprocs
+        self.raw_stats = {}
+        for type_name, dev_name, tidx, values in devices:
+            dev_stats = RawDevStats(values.shape[1], 0)
+            dev_stats.extend(rawtimes[tidx], values)
+            self.raw_stats.setdefault(type_name, {})[dev_name] = dev_stats
+
+    def get_alignment(self, rawtimes, times):
+        """Host.get_alignment(rawtimes, times)
+        Return the TimeAlignment of the raw record times onto the job times. All
+        devices on a host normally share the same record times so the alignment
+        is only recomputed if the record times differ from the previous call.
+        """
+        if self.alignment is None or not self.alignment.matches(rawtimes):
+            self.alignment = TimeAlignment(rawtimes, times, self.rotatetimes)
+        return self.alignment
+
     def get_stats(self, type_name, dev_name, key_name):
         """Host.get_stats(type_name, dev_name, key_name)
         Return the vector of stats for the given type, dev, and key.
@@ -543,13 +1071,52 @@ class Host(object):
         index = schema[key_name].index
         return self.stats[type_name][dev_name][:, index]
 
+    def get_totals(self, type_name):
+        """Host.get_totals(type_name)
+        Return (totals, alltotals) for the stats of the given type, where
+        totals is the sum of the stats over the devices and alltotals is the
+        sum of totals over the keys for each record. The sums are computed for
+        all of the keys at once and kept until the stats are released.
+        """
+        sums = self.totals.get(type_name)
+        if sums is None:
+            devstats = numpy.array(self.stats[type_name].values())
+            totals = numpy.sum(devstats, axis=0)
+            alltotals = numpy.sum(numpy.sum(devstats, axis=2), axis=0)
+            sums = self.totals[type_name] = (totals, alltotals)
+        return sums
+
+
+def create_gather_pool(workers):
+    """ Return the multiprocessing pool of workers processes to gather the
+        hosts of large jobs with (see from_accts()), or None if workers is 1
+        or less. The pool is meant to be created once, before the caller
+        starts any threads, since the workers are forked from the caller. """
+    if workers <= 1:
+        return None
+    return multiprocessing.Pool(workers)
+
+def gather_host(args):
+    """ Worker function for the Job.gather_stats() pool. Gathers the stats for
+        one host with a stand-in Job and returns the result as plain data so
+        that no Host or Job objects are pickled. """
+    acct, stats_home, name_ext, archive_cache, host_name, path_list, genproc = args
+    job = Job(acct, stats_home, None, None, archive_cache)
+    host = Host(job, host_name, stats_home + '/archive', name_ext, genproc)
+    ok = bool(host.gather_stats(path_list))
+    descs = [(type_name, schema.desc) for type_name, schema in job.schemas.iteritems()]
+    return ok, host.get_gathered(), descs, list(job.errors)
+
 
 class Job(object):
     # TODO errors/comments
     __slots__ = ('id', 'start_time', 'end_time', 'acct', 'schemas', 'hosts',
-    'times','stats_home', 'host_list_dir', 'batch_acct', 'edit_flags', 'errors', 'overflows')
+    'times','stats_home', 'host_list_dir', 'batch_acct', 'edit_flags', 'errors', 'overflows',
+    'archive_cache', 'archives', 'archive_index', 'gather_pool', 'stream_min_hosts', 'streaming',
+    'raw_schemas', 'types')
 
-    def __init__(self, acct, stats_home, host_list_dir, batch_acct):
+    def __init__(self, acct, stats_home, host_list_dir, batch_acct, archive_cache=None, archives=None, archive_index=None,
+                 gather_pool=None, stream_min_hosts=0, types=None):
         self.id = acct['id']
         self.start_time = acct['start_time']
         self.end_time = acct['end_time']
@@ -563,6 +1130,14 @@ class Job(object):
         self.edit_flags = []
         self.errors = set()
         self.overflows = dict()
+        self.archive_cache = archive_cache
+        self.archives = archives
+        self.archive_index = archive_index
+        self.gather_pool = gather_pool
+        self.stream_min_hosts = stream_min_hosts
+        self.streaming = False
+        self.raw_schemas = None
+        self.types = types
 
     def trace(self, fmt, *args):
         trace('%s: ' + fmt, self.id, *args)
@@ -582,7 +1157,11 @@ class Job(object):
             schema = self.schemas[type_name] = Schema(desc)
         return schema
 
-    def gather_stats(self):
+    def get_host_list(self):
+        """Job.get_host_list()
+        Return the list of names of the hosts that the job ran on, or None
+        if the host list could not be read.
+        """
         if "host_list" in self.acct:
             host_list = self.acct['host_list']
             if host_list == ["None assigned"]:
@@ -593,29 +1172,96 @@ class Job(object):
                 if self.end_time - self.start_time > 0:
                     # Only care about missing hosts if the job actually ran!
                     self.error("no host list found in dir " + self.host_list_dir)
-                return False
+                return None
             try:
                 with open(path) as file:
                     host_list = [host for line in file for host in line.split() if line != "None assigned"]
             except IOError as (err, str):
                 self.error("cannot open host list `%s': %s", path, str)
+                return None
+        short_names = []
+        for host_name in host_list:
+            # TODO Keep bad_hosts.
+            try: host_name = host_name.split('.')[0]
+            except: pass
+            short_names.append(host_name)
+        return short_names
+
+    def create_host(self, host_name, genproc=False):
+        return Host(self, host_name, self.stats_home + '/archive', self.batch_acct.name_ext, genproc)
+
+    def gather_stats(self, host_list=None, path_lists=None):
+        """Job.gather_stats(host_list=None, path_lists=None)
+        Gather the raw stats of the hosts in host_list, by default the hosts
+        of the job. path_lists maps the host names to the archive files from
+        Host.get_stats_paths() if they have already been looked up.
+        """
+        if path_lists is None:
+            path_lists = {}
+        if host_list is None:
+            host_list = self.get_host_list()
+            if host_list is None:
                 return False
         if len(host_list) == 0 and self.end_time - self.start_time > 0:
             self.error("empty host list")
             return False
-        for hidx, host_name in enumerate(host_list):
-            # TODO Keep bad_hosts.
-            try: host_name = host_name.split('.')[0]
-            except: pass
-            
-            host = Host(self, host_name, self.stats_home + '/archive',self.batch_acct.name_ext, hidx == 0 )
-            if host.gather_stats():
-                self.hosts[host_name] = host
+        self.streaming = self.stream_min_hosts > 0 and len(host_list) >= self.stream_min_hosts
+        if self.streaming:
+            # Only the record times are read for now, the stats of each
+            # host are read when it is summarized.
+            for hidx, host_name in enumerate(host_list):
+                host = self.create_host(host_name, hidx == 0)
+                host.times_only = True
+                if host.gather_stats(path_lists.get(host_name)):
+                    host.raw_stats = None
+                    host.stats = None
+                    self.hosts[host_name] = host
+        elif self.gather_pool is not None and self.archives is None and len(host_list) >= PARALLEL_GATHER_MIN_HOSTS:
+            self.gather_hosts_parallel(host_list, path_lists)
+        else:
+            for hidx, host_name in enumerate(host_list):
+                host = self.create_host(host_name, hidx == 0)
+                if host.gather_stats(path_lists.get(host_name)):
+                    self.hosts[host_name] = host
         if not self.hosts:
             self.error("no good hosts")
             return False
         return True
 
+    def gather_hosts_parallel(self, host_list, path_lists):
+        """Job.gather_hosts_parallel(host_list, path_lists)
+        Gather the hosts with the gather_pool processes. The archive files are
+        located here and the workers return the raw stats as arrays. Schemas
+        that differ from those of earlier hosts are discarded per host rather
+        than per file. The records are aligned later by process_stats() since
+        the job times are those of the host with the median number of
+        records, which is only known once every host has been gathered.
+        """
+        tasks = []
+        for hidx, host_name in enumerate(host_list):
+            path_list = path_lists.get(host_name)
+            if path_list is None:
+                path_list = self.create_host(host_name).get_stats_paths()
+            tasks.append((self.acct, self.stats_home, self.batch_acct.name_ext, self.archive_cache,
+                          host_name, path_list, hidx == 0))
+
+        for task, result in itertools.izip(tasks, self.gather_pool.imap(gather_host, tasks)):
+            ok, gathered, descs, errors = result
+            self.errors.update(errors)
+            if not ok:
+                continue
+            host = self.create_host(task[4], task[6])
+            host.set_gathered(gathered)
+            for type_name, desc in descs:
+                schema = self.schemas.get(type_name)
+                if schema is None:
+                    self.schemas[type_name] = Schema(desc)
+                elif schema.desc != desc:
+                    host.error("type `%s', schema mismatch desc `%s'", type_name, desc)
+                    host.raw_stats.pop(type_name, None)
+            if host.raw_stats:
+                self.hosts[host.name] = host
+
     def munge_times(self):
         times_lis = []
         for host in self.hosts.itervalues():
@@ -651,104 +1297,161 @@ class Job(object):
             self.errors.add( "Number of records differs between hosts (min {}, max {})".format(len(times_lis[0]), len(times_lis[-1]) ) )
         return True
     
-    def process_dev_stats(self, host, type_name, schema, dev_name, raw):
-        def trace(fmt, *args):
-            return self.trace("host `%s', type `%s', dev `%s': " + fmt,
-                              host.name, type_name, dev_name, *args)
-        def error(fmt, *args):
-            return self.error("host `%s', type `%s', dev `%s': " + fmt,
-                              host.name, type_name, dev_name, *args)
-        # raw is a list of pairs with car the timestamp and cdr a 1d
-        # numpy array of values.
-        m = len(self.times)
-        n = len(schema)
-        A = numpy.zeros((m, n), dtype=numpy.uint64) # Output.
+    def align_dev_stats(self, host, type_name, raw):
+        """ Return the TimeAlignment of the records of the RawDevStats raw onto
+            the job times and set the host times from it """
+        # len(raw) may not be equal to m, so the values are filled out by
+        # choosing the records with the closest timestamps.
+        alignment = host.get_alignment(raw.gettimes(), self.times)
 
-        k = 0
-        # len(raw) may not be equal to m, so we fill out A by choosing values
-        # with the closest timestamps.
         # TODO sort out host times
-        host.times = []
-        rmsjitter = 0.0
-        logrotates = []
-        for i in xrange(0, m):
-            t = self.times[i]
-            while k + 1 < len(raw) and abs(raw[k + 1][0] - t) <= abs(raw[k][0] - t):
-                k += 1
-            rmsjitter += (raw[k][0] - t)**2
-            A[i] = raw[k][1]
-            if raw[k][0] in host.rotatetimes:
-                logrotates.append(i)
-            host.times.append(raw[k][0])
+        host.times = alignment.times
+        if alignment.rmsjitter > 60:
+            self.errors.add("HRJ {} {}".format(host.name, type_name))
+        return alignment
 
-        if m > 0:
-            rmsjitter = math.sqrt(rmsjitter) / m
-            if rmsjitter > 60:
-                self.errors.add("HRJ {} {}".format(host.name, type_name))
+    def process_dev_stats(self, host, type_name, schema, dev_name, raw, alignment):
+        # raw is a RawDevStats with the timestamps and values of the
+        # records for the device.
+        A = raw.getvalues()[alignment.index] # Output.
 
         # OK, we fit the raw values into A.  Now fixup rollover and
         # convert units.
-        for e in schema.itervalues():
-            j = e.index
-            if e.is_event:
-                p = r = A[0, j] # Previous raw, rollover/baseline.
-                # Rebase, check for rollover.
-                for i in range(0, m):
-                    v = A[i, j]
-
-                    if i in logrotates and host.tacc_version == "2.2.1" and type_name.startswith('intel_') and i > 0:
-                        r = numpy.uint64(v) - A[i-1,j] 
-                        if i > 1:
-                            linear_interp = numpy.uint64(numpy.uint64(A[i-1, j] - A[i-2,j]) * numpy.uint64(host.times[i] - host.times[i-1]) ) / numpy.uint64(host.times[i-1] - host.times[i-2])
-                            r -= linear_interp
-                        fudged = True
-                    elif v < p:
-                        fudged = False
-                        # Looks like rollover.
-                        if e.width and e.width < 64:
-                            trace("time %d, counter `%s', rollover prev %d, curr %d\n",
-                                  self.times[i], e.key, p, v)
-                            r -= numpy.uint64(1L << e.width)
-                        elif v == 0:
-                            # Spurious reset
-                            # This happens with the IB counters.
-                            # Ignore this value, use previous instead.
-                            # TODO Interpolate or something.
-                            trace("time %d, counter `%s', suspicious zero, prev %d\n",
-                                  self.times[i], e.key, p)
-                            v = p # Ugh.
-                        elif (type_name == 'ib_ext' or type_name == 'ib_sw') or (type_name == 'cpu' and e.key == 'iowait'):
-                            # We will assume a spurious reset, 
-                            # and the reset happened at the start of the counting period.
-                            # This happens with IB ext counters.
-                            #   A[i,j] = v + A[i-1,j] 
-                            # and
-                            #   A[i,j] = v - r
-                            # Therefore
-                            #   A[i-1,j] = -r 
-                            # or
-                            #          r = - A[i-1,j]
-                            r = numpy.uint64(0) - A[i-1,j] 
-                            if KEEP_EDITS:
-                                self.edit_flags.append("(time %d, host `%s', type `%s', dev `%s', key `%s')" %
-                                                   (self.times[i],host.name,type_name,dev_name,e.key))
-                            fudged = True
-                        elif type_name == 'net' and (dev_name == 'mic0' or dev_name == 'mic1') and i == (len(self.times)-1):
-                            # mic counters are reset at the end of a job ignore the last datapoint
-                            v = p
-                            fudged = True
-
-                        if type_name not in ['ib', 'ib_ext'] and (fudged == False):
-                            width = e.width if e.width else 64
-                            if ( v - p ) % (2**width) > 2**(width-1):
-                                # This counter rolled more than half of its range
-                                self.logoverflow(host.name, type_name, dev_name, e.key)
-
-                    A[i, j] = v - r
+        logrotates = alignment.logrotates
+        if host.tacc_version != "2.2.1" or not type_name.startswith('intel_'):
+            logrotates = []
+        return self.rebase_dev_stats(host, type_name, schema, dev_name, A, logrotates, alignment.times)
+
+    def process_type_stats(self, host, type_name, pending, compact=False):
+        """ Return the processed stats of a type from the (schema, devices)
+            saved by process_stats(), devices being a list of (dev_name, raw,
+            alignment). If compact is set the arrays are narrowed with
+            compact_type_stats(). """
+        schema, devices = pending
+        stats = dict((dev_name, self.process_dev_stats(host, type_name, schema, dev_name, raw, alignment))
+                     for dev_name, raw, alignment in devices)
+        if compact:
+            stats = compact_type_stats(stats)
+        return stats
+
+    def rebase_dev_stats(self, host, type_name, schema, dev_name, A, logrotates, times):
+        """ Rebase the event counters in the (m x n) array A in place, fixing up
+            counter rollover, spurious resets and logrotate discontinuities and
+            then apply the unit multipliers. All of the samples between two
+            logrotate records are processed with whole-array operations.
+            times are the record times of the host. """
+        def trace(fmt, *args):
+            return self.trace("host `%s', type `%s', dev `%s': " + fmt,
+                              host.name, type_name, dev_name, *args)
+        m = A.shape[0]
+        entries = schema.values()
+
+        if m > 0 and any(e.is_event for e in entries):
+            isevent = numpy.array([e.is_event for e in entries], dtype=bool)
+            widths = numpy.array([e.width if e.width else 64 for e in entries], dtype=numpy.uint64)
+
+            # Counters with a known width are unwrapped. Full width counters
+            # that go backwards are either spurious zeros, resets or overflows.
+            wrap = isevent & (widths < 64)
+            zerofill = isevent & ~wrap
+            if type_name == 'ib_ext' or type_name == 'ib_sw':
+                reset = zerofill
+            elif type_name == 'cpu':
+                reset = zerofill & numpy.array([e.key == 'iowait' for e in entries], dtype=bool)
+            else:
+                reset = numpy.zeros(len(entries), dtype=bool)
+            if type_name == 'net' and (dev_name == 'mic0' or dev_name == 'mic1'):
+                # mic counters are reset at the end of a job ignore the last datapoint
+                micreset = zerofill & ~reset
+            else:
+                micreset = None
+            if type_name not in ['ib', 'ib_ext']:
+                checkoverflow = isevent & ~reset
+            else:
+                checkoverflow = numpy.zeros(len(entries), dtype=bool)
+
+            wrapstep = numpy.where(wrap, numpy.left_shift(numpy.uint64(1), widths % 64), 0).astype(numpy.uint64)
+
+            cols = numpy.nonzero(isevent)[0]
+            zfcols = numpy.nonzero(zerofill[cols])[0]
+            overflowed = numpy.zeros(len(cols), dtype=bool)
+            edits = []
+
+            p = A[0, cols].copy() # Previous raw
+            r = A[0, cols].copy() # Rollover/baseline
+
+            bounds = sorted(set(i for i in logrotates if i > 0))
+            for s, e in zip([0] + bounds, bounds + [m]):
+                if s > 0:
+                    # Counters were reset by a logrotate, carry on from the
+                    # previous value plus a linear extrapolation of the rate.
+                    v = A[s, cols].copy()
+                    r = v - A[s-1, cols]
+                    if s > 1:
+                        r -= (A[s-1, cols] - A[s-2, cols]) * numpy.uint64(times[s] - times[s-1]) // numpy.uint64(times[s-1] - times[s-2])
+                    A[s, cols] = v - r
                     p = v
-            if e.mult:
-                for i in range(0, m):
-                    A[i, j] *= e.mult
+                    s += 1
+                    if s == e:
+                        continue
+
+                V = A[s:e, cols]
+                eff = V.copy()
+                if len(zfcols) > 0:
+                    # Spurious zeros (seen with the IB counters) are replaced
+                    # with the previous value.
+                    Z = numpy.vstack((p[zfcols], V[:, zfcols]))
+                    idx = numpy.where(Z != 0, numpy.arange(Z.shape[0])[:, numpy.newaxis], 0)
+                    numpy.maximum.accumulate(idx, axis=0, out=idx)
+                    eff[:, zfcols] = Z[idx[1:], numpy.arange(len(zfcols))]
+
+                prev = numpy.vstack((p, eff[:-1]))
+                backwards = eff < prev
+
+                if micreset is not None and e == m:
+                    fixed = backwards[-1] & micreset[cols]
+                    eff[-1, fixed] = prev[-1, fixed]
+                    backwards[-1, fixed] = False
+
+                overflowed |= numpy.any(backwards & checkoverflow[cols] &
+                                        rolled_over_half(eff - prev, widths[cols]), axis=0)
+
+                rolled = backwards & wrap[cols]
+                resets = backwards & reset[cols]
+                step = numpy.where(rolled, wrapstep[cols], numpy.uint64(0))
+                step[resets] = prev[resets]
+                numpy.cumsum(step, axis=0, out=step)
+
+                A[s:e, cols] = eff - r + step
+                r = r - step[-1]
+                p = eff[-1]
+
+                if verbose:
+                    for i, c in zip(*numpy.nonzero(rolled)):
+                        trace("time %d, counter `%s', rollover prev %d, curr %d\n",
+                              self.times[s+i], entries[cols[c]].key, prev[i, c], eff[i, c])
+                    spurious = (V == 0) & (prev > 0)
+                    spurious[:, ~zerofill[cols]] = False
+                    for i, c in zip(*numpy.nonzero(spurious)):
+                        trace("time %d, counter `%s', suspicious zero, prev %d\n",
+                              self.times[s+i], entries[cols[c]].key, prev[i, c])
+                if KEEP_EDITS:
+                    # We assume a spurious reset happened at the start of the counting period.
+                    edits.extend((c, s+i) for i, c in zip(*numpy.nonzero(resets)))
+
+            # The edits are flagged counter by counter, as they were by the
+            # per-sample loop
+            for c, i in sorted(edits):
+                self.edit_flags.append("(time %d, host `%s', type `%s', dev `%s', key `%s')" %
+                                       (self.times[i], host.name, type_name, dev_name, entries[cols[c]].key))
+
+            for c in numpy.nonzero(overflowed)[0]:
+                # This counter rolled more than half of its range
+                self.logoverflow(host.name, type_name, dev_name, entries[cols[c]].key)
+
+        mults = [e.mult if e.mult else 1 for e in entries]
+        if any(mult != 1 for mult in mults):
+            A *= numpy.array(mults, dtype=numpy.uint64)
         return A
 
     def logoverflow(self, host_name, type_name, dev_name, key_name):
@@ -762,18 +1465,41 @@ class Job(object):
         self.overflows[type_name][dev_name][key_name].add(host_name)
 
     def process_stats(self):
+        if self.streaming:
+            # The schemas of the processed stats are those of the first host
+            # that loads, the other hosts are processed as they are streamed.
+            self.raw_schemas = self.schemas
+            self.schemas = {}
+            for host in self.hosts.itervalues():
+                if self.load_host(host):
+                    break
+            return True
         for host in self.hosts.itervalues():
-            host.stats = {}
+            # The records are aligned now but each type is only rebased when
+            # its stats are first read. The schemas are copied as the width
+            # and mult of the job schemas are cleared below.
+            host.stats = LazyTypeStats(functools.partial(self.process_type_stats, host))
             for type_name, raw_type_stats in host.raw_stats.iteritems():
-                stats = host.stats[type_name] = {}
-                schema = self.schemas[type_name]
-                for dev_name, raw_dev_stats in raw_type_stats.iteritems():
-                    stats[dev_name] = self.process_dev_stats(host, type_name, schema,
-                                                             dev_name, raw_dev_stats)
+                devices = [ (dev_name, raw_dev_stats, self.align_dev_stats(host, type_name, raw_dev_stats))
+                            for dev_name, raw_dev_stats in raw_type_stats.iteritems() ]
+                if self.types is None or type_name in self.types:
+                    host.stats.add_pending(type_name, (Schema(self.schemas[type_name].desc), devices))
             del host.raw_stats
+            host.alignment = None
+        if self.types is not None:
+            for type_name in self.schemas.keys():
+                if type_name not in self.types:
+                    del self.schemas[type_name]
         amd64_pmc.process_job(self)
         intel_process.process_job(self)
         phys_cores_process.process_job(self)
+        # The post processing above works on the uint64 arrays, the types it
+        # has read are compacted now and the others when they are read.
+        for host in self.hosts.itervalues():
+            host.stats.process = functools.partial(self.process_type_stats, host, compact=True)
+            for type_name in host.stats.keys():
+                if type_name not in host.stats.pending:
+                    host.stats[type_name] = compact_type_stats(host.stats[type_name])
         # Clear mult, width from schemas. XXX
         for schema in self.schemas.itervalues():
             for e in schema.itervalues():
@@ -781,6 +1507,62 @@ class Job(object):
                 e.mult = None
         return True
     
+    def view(self, hosts):
+        """Job.view(hosts)
+        Return a shallow copy of the job that only has the given hosts. The
+        copy shares the schemas, errors and overflows of the job.
+        """
+        job = copy.copy(self)
+        job.hosts = OrderedDict((host.name, host) for host in hosts)
+        return job
+
+    def load_host(self, host):
+        """Job.load_host(host)
+        Gather and process the stats of one host of a streaming job. The
+        archive files found by the survey are read with the schemas of the
+        raw stats and the host is processed on its own, job level post
+        processing included. Types whose processed schema differs from that
+        of the job are dropped from the host. Returns False if no stats could
+        be loaded.
+        """
+        job = self.view([])
+        job.streaming = False
+        job.schemas = dict((type_name, Schema(schema.desc)) for type_name, schema in self.raw_schemas.iteritems())
+        loaded = job.create_host(host.name)
+        if not loaded.gather_stats(host.path_list):
+            return False
+        job.hosts[host.name] = loaded
+        job.process_stats()
+        for type_name, schema in job.schemas.iteritems():
+            if type_name not in self.schemas:
+                self.schemas[type_name] = schema
+            elif schema.desc != self.schemas[type_name].desc and type_name in loaded.stats:
+                host.error("type `%s', schema mismatch desc `%s'", type_name, schema.desc)
+                del loaded.stats[type_name]
+        host.stats = loaded.stats
+        host.times = loaded.times
+        host.totals = {}
+        return True
+
+    def release_host(self, host):
+        """Job.release_host(host)
+        Release the stats loaded by load_host().
+        """
+        host.stats = None
+        host.totals = {}
+
+    def stream_hosts(self):
+        """Job.stream_hosts()
+        Generator that yields the hosts of a streaming job one at a time with
+        their stats loaded. The stats of a host are released before the next
+        host is loaded so that only one host is held in memory.
+        """
+        for host in self.hosts.values():
+            if host.stats is None and not self.load_host(host):
+                continue
+            yield host
+            self.release_host(host)
+
     def aggregate_stats(self, type_name, host_names=None, dev_names=None):
         """Job.aggregate_stats(type_name, host_names=None, dev_names=None)
         """
@@ -822,15 +1604,69 @@ class Job(object):
         return host_stats
 
 
-def from_acct(acct, stats_home, host_list_dir, batch_acct):
-    """from_acct(acct, stats_home)
+def from_acct(acct, stats_home, host_list_dir, batch_acct, archive_cache=None, archive_index=None, gather_pool=None,
+              stream_min_hosts=0, types=None):
+    """from_acct(acct, stats_home, host_list_dir, batch_acct, archive_cache=None, archive_index=None, gather_pool=None,
+              stream_min_hosts=0, types=None)
     Return a Job object constructed from the appropriate accounting data acct using
-    stats_home as the base directory, running all required processing.
+    stats_home as the base directory, running all required processing. If
+    archive_cache is set the parsed archive files are cached in that directory.
+    If archive_index is set the archive files are found with the index
+    instead of listing the archive directories. If gather_pool is set the
+    hosts of large jobs are gathered by that pool, see create_gather_pool(). Jobs
+    with at least stream_min_hosts hosts (if set) are streamed: their hosts
+    are only loaded one at a time by Job.stream_hosts(). If types is set only
+    the stats types in that list (as named in the stats files) are kept. The
+    stats of each type are only processed when they are first read.
     """
-    job = Job(acct, stats_home, host_list_dir, batch_acct)
+    job = Job(acct, stats_home, host_list_dir, batch_acct, archive_cache, archive_index=archive_index,
+              gather_pool=gather_pool, stream_min_hosts=stream_min_hosts, types=types)
     job.gather_stats() and job.munge_times() and job.process_stats()
     return job
 
+def from_accts(accts, stats_home, host_list_dir, batch_acct, archive_cache=None, batch_size=1, archive_index=None,
+               gather_pool=None, stream_min_hosts=0, types=None):
+    """from_accts(accts, stats_home, host_list_dir, batch_acct, archive_cache=None, batch_size=1, archive_index=None,
+               gather_pool=None, stream_min_hosts=0, types=None)
+    Generator that yields the Job object for each accounting record in accts.
+    The records are processed batch_size at a time and each archive file is
+    only read once per batch, no matter how many jobs in the batch use it.
+    With a gather_pool the archive files of each job in a batch are parsed
+    by the pool and the hosts are read from the shared parsed files.
+    """
+    accts = iter(accts)
+    while True:
+        batch = list(itertools.islice(accts, batch_size))
+        if not batch:
+            break
+        if len(batch) == 1:
+            yield from_acct(batch[0], stats_home, host_list_dir, batch_acct, archive_cache, archive_index, gather_pool,
+                            stream_min_hosts, types)
+            continue
+
+        archives = archivecache.ArchiveSet(archive_cache)
+        jobs = []
+        for acct in batch:
+            job = Job(acct, stats_home, host_list_dir, batch_acct, archive_cache, archives, archive_index, gather_pool,
+                      stream_min_hosts, types)
+            host_list = job.get_host_list()
+            # The archive files are looked up once and passed on to gather_stats()
+            path_lists = dict((host_name, job.create_host(host_name).get_stats_paths()) for host_name in host_list or [])
+            paths = [ path for path_list in path_lists.itervalues() for path, start_time in path_list ]
+            for path in paths:
+                archives.addref(path)
+            jobs.append((job, host_list, path_lists, paths))
+
+        for job, host_list, path_lists, paths in jobs:
+            if host_list is not None:
+                if gather_pool is not None:
+                    archives.preload(paths, gather_pool)
+                job.gather_stats(host_list, path_lists) and job.munge_times() and job.process_stats()
+            # Free the archives that are not needed by the rest of the batch
+            for path in paths:
+                archives.release(path)
+            yield job
+
 
 def from_id(id, **kwargs):
     """from_id(id, acct_file=None, acct_path=sge_acct_path, use_awk=True)
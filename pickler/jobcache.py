@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+""" Columnar on-disk cache of processed jobs.
+
+    A job is stored as a directory with a JSON header and one .npy file for
+    each type of each host:
+
+        JOBDIR/header.json      - version, acct, schemas, errors, overflows,
+                                  the host, type and device names and the
+                                  host attributes that summarize reads
+        JOBDIR/times.npy        - job times
+        JOBDIR/HOSTIDX/times.npy
+        JOBDIR/HOSTIDX/TYPE.npy - (keys x devices x records) stats
+
+    The stats are stored key by key so that reading one key of a type only
+    touches that part of the file. The arrays are memory mapped when the
+    job is loaded, so a job can be opened without reading all of its stats.
+    Unlike a pickled Job the cache does not depend on the job_stats class
+    layout.
+
+    process.py saves every job it gathers, apart from streamed jobs, in the
+    job_cache_dir of the resource when that setting is present, and reads
+    them back when it recomputes sections of existing summaries. The jobs
+    are removed by prune() once they are older than job_cache_max_age, if
+    that is set. The analysis readers (TSPLBase, MetaData and the site
+    views) load a path as a job cache when is_job_cache() is true and as a
+    pickled Job otherwise, so existing pickles keep working. """
+import cPickle as pickle
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+import job_stats
+
+CACHE_VERSION = 2
+HEADER_FILE = "header.json"
+
+# Default number of seconds after which a job that has not been saved or
+# loaded is removed from the cache by prune()
+MAX_AGE = 7 * 24 * 3600
+
+def _tostr(obj):
+    """ Convert the unicode strings from the json module back to str """
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [_tostr(x) for x in obj]
+    if isinstance(obj, dict):
+        return dict((_tostr(k), _tostr(v)) for k, v in obj.iteritems())
+    return obj
+
+def cache_path(cache_dir, acct):
+    """ Return the name of the cache directory for the job with accounting
+        record acct """
+    return os.path.join(cache_dir, "%s-%s" % (acct['id'], acct['end_time']))
+
+def is_job_cache(path):
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+def save(job, path):
+    """ Save the processed job to the cache directory path """
+    header = {
+        "version": CACHE_VERSION,
+        "acct": job.acct,
+        "schemas": dict((type_name, schema.desc) for type_name, schema in job.schemas.iteritems()),
+        "errors": sorted(job.errors),
+        "edit_flags": job.edit_flags,
+        "overflows": dict((type_name, dict((dev_name, dict((key_name, sorted(hosts))
+                                                           for key_name, hosts in keys.iteritems()))
+                                           for dev_name, keys in devs.iteritems()))
+                          for type_name, devs in job.overflows.iteritems()),
+        "hosts": []
+    }
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    # Written to a temporary directory and renamed so that readers never see
+    # a partially written job
+    tmpdir = tempfile.mkdtemp(dir=dirname, suffix=".tmp")
+    try:
+        numpy.save(os.path.join(tmpdir, "times.npy"), numpy.asarray(job.times))
+        for hostidx, host in enumerate(job.hosts.itervalues()):
+            hostdir = os.path.join(tmpdir, str(hostidx))
+            os.mkdir(hostdir)
+            numpy.save(os.path.join(hostdir, "times.npy"), numpy.asarray(host.times))
+            types = {}
+            for type_name, devs in host.stats.iteritems():
+                dev_names = devs.keys()
+                if len(dev_names) == 0:
+                    continue
+                values = numpy.array([ devs[dev_name] for dev_name in dev_names ])
+                numpy.save(os.path.join(hostdir, type_name + ".npy"), numpy.ascontiguousarray(values.transpose(2, 0, 1)))
+                types[type_name] = dev_names
+            header["hosts"].append({ "name": host.name, "types": types, "marks": sorted(host.marks.keys()),
+                                     "tacc_version": host.tacc_version, "complete": host.complete })
+
+        with open(os.path.join(tmpdir, HEADER_FILE), "w") as fp:
+            json.dump(header, fp)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmpdir, path)
+    except:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+def load(path, mmap=True):
+    """ Return the job_stats.Job from the cache directory path. The stats are
+        memory mapped read only views of the cache files if mmap is set. """
+    with open(os.path.join(path, HEADER_FILE)) as fp:
+        header = _tostr(json.load(fp))
+
+    if header["version"] != CACHE_VERSION:
+        raise ValueError("unsupported job cache version %s in %s" % (header["version"], path))
+
+    mmap_mode = 'r' if mmap else None
+    job = job_stats.Job(header["acct"], None, None, None)
+    job.schemas = dict((type_name, job_stats.Schema(desc)) for type_name, desc in header["schemas"].iteritems())
+    job.errors = set(header["errors"])
+    job.edit_flags = header["edit_flags"]
+    job.overflows = dict((type_name, dict((dev_name, dict((key_name, set(hosts))
+                                                          for key_name, hosts in keys.iteritems()))
+                                          for dev_name, keys in devs.iteritems()))
+                         for type_name, devs in header["overflows"].iteritems())
+    job.times = numpy.load(os.path.join(path, "times.npy"))
+
+    for hostidx, hostinfo in enumerate(header["hosts"]):
+        hostdir = os.path.join(path, str(hostidx))
+        host = job_stats.Host(job, hostinfo["name"], None, "")
+        host.times = numpy.load(os.path.join(hostdir, "times.npy"))
+        host.marks = dict((mark, True) for mark in hostinfo["marks"])
+        host.tacc_version = hostinfo["tacc_version"]
+        host.complete = hostinfo["complete"]
+        host.stats = {}
+        for type_name, dev_names in hostinfo["types"].iteritems():
+            values = numpy.load(os.path.join(hostdir, type_name + ".npy"), mmap_mode=mmap_mode)
+            host.stats[type_name] = dict((dev_name, values[:, devidx, :].T) for devidx, dev_name in enumerate(dev_names))
+        job.hosts[host.name] = host
+
+    return job
+
+def read_key(path, type_name, key_name, mmap=True):
+    """ Return a dict keyed by host name of dicts keyed by device name of the
+        values of one key from the cache directory path. Only the header and
+        the data for that key are read. """
+    with open(os.path.join(path, HEADER_FILE)) as fp:
+        header = _tostr(json.load(fp))
+
+    index = job_stats.Schema(header["schemas"][type_name])[key_name].index
+    result = {}
+    for hostidx, hostinfo in enumerate(header["hosts"]):
+        dev_names = hostinfo["types"].get(type_name)
+        if dev_names is None:
+            continue
+        values = numpy.load(os.path.join(path, str(hostidx), type_name + ".npy"), mmap_mode='r' if mmap else None)
+        result[hostinfo["name"]] = dict((dev_name, values[index, devidx]) for devidx, dev_name in enumerate(dev_names))
+
+    return result
+
+def from_accts(cache_dir, accts, gather, batch_size=1):
+    """ Yield the jobs for the accounting records accts. Jobs in the cache in
+        cache_dir are loaded from it, the rest are passed to gather() in
+        batches of batch_size records. Loading a job marks it as used, see
+        prune(). """
+    missing = []
+    for acct in accts:
+        path = cache_path(cache_dir, acct)
+        if is_job_cache(path):
+            try:
+                job = load(path)
+                os.utime(path, None)
+                yield job
+                continue
+            except Exception as exc:
+                logging.warning("unable to read job cache %s: %s", path, exc)
+        missing.append(acct)
+        if len(missing) >= batch_size:
+            for job in gather(iter(missing)):
+                yield job
+            missing = []
+
+    if missing:
+        for job in gather(iter(missing)):
+            yield job
+
+def prune(cache_dir, max_age=MAX_AGE, now=None):
+    """ Remove the jobs from the cache in cache_dir that have not been saved
+        or loaded in the last max_age seconds. Returns the number removed. """
+    if now is None:
+        now = time.time()
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return 0
+
+    removed = 0
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        try:
+            if now - os.path.getmtime(path) <= max_age:
+                continue
+        except OSError:
+            continue
+        if is_job_cache(path) or path.endswith(".tmp"):
+            # Other processes may prune the same cache
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def convert(pickle_path, path):
+    """ Convert a pickled job to a cache directory """
+    with open(pickle_path, 'rb') as fp:
+        job = pickle.load(fp)
+    save(job, path)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "usage: {0} OUTPUT_DIR PICKLE_FILE...".format(os.path.basename(sys.argv[0]))
+        print "  Convert pickled jobs to job cache directories in OUTPUT_DIR"
+        sys.exit(1)
+    for pickle_path in sys.argv[2:]:
+        convert(pickle_path, os.path.join(sys.argv[1], os.path.basename(pickle_path)))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+""" Job index for the daily lariat json files.
+
+    A lariat file is a single json object that maps each job id to a list of
+    lariat records. The index holds the byte offset and length in the file of
+    the record list of each job so that LariatManager only has to parse the
+    records of the jobs that it looks up. The index is stored in a sidecar
+    file (FILE.idx) next to the lariat file or, when INDEX_DIR is set, under
+    INDEX_DIR at the absolute path of the lariat file, if the directory is
+    writable. The size and modification time of the lariat file are saved
+    with it so that a stale index is rebuilt. """
+import bisect
+import json
+import logging
+import os
+import stat
+import sys
+import tempfile
+import numpy
+
+INDEX_VERSION = 1
+
+# Directory for the sidecar files, None to keep them next to the lariat files
+INDEX_DIR = None
+
+_whitespace = " \t\n\r"
+
+class LariatIndex(object):
+    """ The offset and length of the record list of each job in a lariat file """
+    __slots__ = ('jobids', 'offsets', 'lengths', 'lookup')
+
+    def __init__(self, jobids, offsets, lengths):
+        self.jobids = jobids
+        self.offsets = offsets
+        self.lengths = lengths
+        self.lookup = dict((jobid, i) for i, jobid in enumerate(jobids))
+
+    def __contains__(self, jobid):
+        return jobid in self.lookup
+
+    def span(self, jobid):
+        """ Return the (offset, length) of the record list of the job. If a job
+            is listed more than once the last one is used, as json.loads() does. """
+        i = self.lookup[jobid]
+        return int(self.offsets[i]), int(self.lengths[i])
+
+def fixup(content):
+    """ Unfortunately, the lariat data is not in valid json. This workaround
+        converts the illegal \\' into valid quotes """
+    return content.replace("\\'", "'")
+
+def index_path(path):
+    if INDEX_DIR:
+        return os.path.join(INDEX_DIR, os.path.abspath(path).lstrip(os.sep) + ".idx")
+    return path + ".idx"
+
+def _skip(content, idx):
+    while idx < len(content) and content[idx] in _whitespace:
+        idx += 1
+    return idx
+
+def build_index(path):
+    """ Return the LariatIndex for the lariat file at path """
+    with open(path, "rb") as fp:
+        raw = fp.read()
+
+    # The offsets are found in the fixed up content and then mapped back to
+    # the raw file, each fixup before an offset moves it on by one byte
+    content = fixup(raw)
+    fixups = []
+    pos = raw.find("\\'")
+    while pos != -1:
+        fixups.append(pos - len(fixups))
+        pos = raw.find("\\'", pos + 2)
+
+    def rawoffset(offset):
+        return offset + bisect.bisect_left(fixups, offset)
+
+    decoder = json.JSONDecoder()
+    jobids = []
+    offsets = []
+    lengths = []
+
+    idx = _skip(content, 0)
+    if content[idx:idx + 1] != "{":
+        raise ValueError("lariat file {} is not a json object".format(path))
+    idx = _skip(content, idx + 1)
+    while content[idx:idx + 1] != "}":
+        if content[idx:idx + 1] != '"':
+            raise ValueError("expected a job id at offset {} of {}".format(idx, path))
+        jobid, idx = json.decoder.scanstring(content, idx + 1)
+        idx = _skip(content, idx)
+        if content[idx:idx + 1] != ":":
+            raise ValueError("expected ':' at offset {} of {}".format(idx, path))
+        start = _skip(content, idx + 1)
+        _, end = decoder.raw_decode(content, start)
+
+        jobids.append(jobid.encode("utf-8"))
+        offsets.append(rawoffset(start))
+        lengths.append(rawoffset(end) - rawoffset(start))
+
+        idx = _skip(content, end)
+        if content[idx:idx + 1] == ",":
+            idx = _skip(content, idx + 1)
+        elif content[idx:idx + 1] != "}":
+            raise ValueError("expected ',' or '}}' at offset {} of {}".format(idx, path))
+
+    return LariatIndex(jobids, numpy.array(offsets, dtype=numpy.int64), numpy.array(lengths, dtype=numpy.int64))
+
+def write_index(path, index, st):
+    """ Save index as the sidecar of the lariat file at path. st is the
+        os.stat() of the lariat file when the index was built. The sidecar
+        gets the permissions of the lariat file. """
+    filename = index_path(path)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            numpy.savez(fp, meta=numpy.array([INDEX_VERSION, st.st_size], dtype=numpy.int64),
+                        mtime=numpy.array([st.st_mtime], dtype=numpy.float64),
+                        offsets=index.offsets, lengths=index.lengths,
+                        jobids=numpy.array(bytearray("\n".join(index.jobids)), dtype=numpy.uint8))
+        os.chmod(tmpname, stat.S_IMODE(st.st_mode))
+        os.rename(tmpname, filename)
+    except:
+        exc_info = sys.exc_info()
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+def read_index(path, st):
+    """ Return the LariatIndex from the sidecar of the lariat file at path or
+        None if there is no sidecar or it is out of date """
+    filename = index_path(path)
+    if not os.path.exists(filename):
+        return None
+    with numpy.load(filename) as data:
+        version, size = data['meta'].tolist()
+        if version != INDEX_VERSION or size != st.st_size or data['mtime'][0] != st.st_mtime:
+            return None
+        jobids = data['jobids'].tostring()
+        return LariatIndex(jobids.split("\n") if jobids else [], data['offsets'], data['lengths'])
+
+def get_index(path):
+    """ Return the LariatIndex for the lariat file at path. If there is no up
+        to date sidecar the index is built and it is saved if the directory
+        is writable. Raises an exception if the file cannot be read. """
+    st = os.stat(path)
+    index = read_index(path, st)
+    if index is not None:
+        return index
+    index = build_index(path)
+    try:
+        dirname = os.path.dirname(index_path(path))
+        if INDEX_DIR and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if os.access(dirname, os.W_OK):
+            write_index(path, index, st)
+    except Exception as exc:
+        logging.debug("unable to save lariat index for %s: %s", path, exc)
+    return index
+
+def read_records(path, index, jobid, object_hook=None):
+    """ Return the list of lariat records of jobid from the lariat file at
+        path. Only the part of the file that holds the job's records is read. """
+    offset, length = index.span(jobid)
+    with open(path, "rb") as fp:
+        fp.seek(offset)
+        return json.loads(fixup(fp.read(length)), object_hook=object_hook)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "usage: {0} LARIAT_FILE...".format(os.path.basename(sys.argv[0]))
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        get_index(path)
@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 import job_stats
+import archiveindex
+import gzindex
+import lariatindex
 import batch_acct
 import account
 import summarize
+import workqueue
 import sys
 import time
 import datetime
+import signal
+import functools
 import socket
 from getopt import getopt
 import logging
@@ -61,7 +67,39 @@ class RateCalculator:
     def rate(self):
         return self.rate
 
-def createsummary(options, totalprocs, procid):
+def getaccts(options, settings, dbconf, totalprocs, procid):
+    """ Return the accounting records of the jobs to summarize """
+    if options['start'] == None:
+        dbreader = account.DbAcct( settings['resource_id'], dbconf, PROCESS_VERSION, totalprocs, procid, options['localjobid'])
+    else:
+        # Choose a process version that doesn't exist so that all jobs are selected
+        selectedProcVersion = PROCESS_VERSION + 1
+        if options['ignoreprocessed']:
+            selectedProcVersion = PROCESS_VERSION
+
+        dbreader = account.DbAcct( settings['resource_id'], dbconf, selectedProcVersion, totalprocs, procid, None)
+
+    return dbreader.reader(options['start'], options['end'])
+
+def loginsert(dbwriter, resource_id, acct, end_time, incomplete, processtimes, ratecalc, insertOk):
+    """ Log the processed status of a job once its summary has been written """
+    if incomplete:
+        # Do not mark incomplete jobs as done unless they are older than the
+        # reference time (which defaults to 7 days ago)
+        dbwriter.logprocessed(acct, resource_id, ERROR_INCOMPLETE)
+        return
+
+    if insertOk:
+        dbwriter.logprocessed( acct, resource_id, PROCESS_VERSION )
+        processtimes['mintime'] = min( processtimes['mintime'], end_time )
+        processtimes['maxtime'] = max( processtimes['maxtime'], end_time )
+        ratecalc.increment()
+    else:
+        # Mark as negative process version to indicate that it has been processed
+        # but no summary was output
+        dbwriter.logprocessed( acct, resource_id, 0 - PROCESS_VERSION )
+
+def createsummary(options, totalprocs, procid, jobqueue=None):
 
     procidstr = "%s of %s " % (procid, totalprocs) if totalprocs != None else ""
 
@@ -77,6 +115,10 @@ def createsummary(options, totalprocs, procid):
     ratecalc = RateCalculator(procid)
     timewindows = dict()
 
+    if any(settings.get('gather_workers', 1) > 1 for settings in config['resources'].itervalues()):
+        # Forking an MPI process is not safe
+        logging.warning("gather_workers is not supported with MPI, the hosts are gathered serially")
+
     for resourcename, settings in config['resources'].iteritems():
 
         if 'enabled' in settings:
@@ -88,17 +130,14 @@ def createsummary(options, totalprocs, procid):
 
         processtimes = { "mintime": 2**64, "maxtime": 0 }
 
-        if options['start'] == None:
-            dbreader = account.DbAcct( settings['resource_id'], dbconf, PROCESS_VERSION, totalprocs, procid, options['localjobid'])
+        if jobqueue != None:
+            accts = jobqueue.accts(resourcename)
         else:
-            # Choose a process version that doesn't exist so that all jobs are selected
-            selectedProcVersion = PROCESS_VERSION + 1
-            if options['ignoreprocessed']:
-                selectedProcVersion = PROCESS_VERSION
-
-            dbreader = account.DbAcct( settings['resource_id'], dbconf, selectedProcVersion, totalprocs, procid, None)
+            accts = getaccts(options, settings, dbconf, totalprocs, procid)
 
         bacct = batch_acct.factory(settings['batch_system'], settings['acct_path'], settings['host_name_ext'] )
+        gzindex.INDEX_DIR = settings.get('archive_index_dir')
+        lariatindex.INDEX_DIR = settings.get('lariat_index_dir')
 
         if settings['lariat_path'] != "":
             lariat = summarize.LariatManager(settings['lariat_path'])
@@ -107,28 +146,29 @@ def createsummary(options, totalprocs, procid):
 
         dbwriter = account.DbLogger( dbconf["dbname"], dbconf["tablename"], dbconf["defaultsfile"] )
 
-        for acct in dbreader.reader(options['start'], options['end']):
-            logging.debug("%s local_job_id = %s", resourcename, acct['id'])
-            job = job_stats.from_acct( acct, settings['tacc_stats_home'], settings['host_list_dir'], bacct )
-            summary,timeseries = summarize.summarize(job, lariat)
-
-            insertOk = outdb.insert(resourcename, summary, timeseries)
-
-            if summary['complete'] == False and summary["acct"]['end_time'] > referencetime:
-                # Do not mark incomplete jobs as done unless they are older than the
-                # reference time (which defaults to 7 days ago)
-                dbwriter.logprocessed(acct, settings['resource_id'], ERROR_INCOMPLETE)
-                continue
-            
-            if insertOk:
-                dbwriter.logprocessed( acct, settings['resource_id'], PROCESS_VERSION )
-                processtimes['mintime'] = min( processtimes['mintime'], summary["acct"]['end_time'] )
-                processtimes['maxtime'] = max( processtimes['maxtime'], summary["acct"]['end_time'] )
-                ratecalc.increment()
-            else:
-                # Mark as negative process version to indicate that it has been processed
-                # but no summary was output
-                dbwriter.logprocessed( acct, settings['resource_id'], 0 - PROCESS_VERSION )
+        jobs = job_stats.from_accts( accts, settings['tacc_stats_home'], settings['host_list_dir'], bacct,
+                                     settings.get('archive_cache_dir'), options['batch'],
+                                     archiveindex.factory(config, settings), None,
+                                     settings.get('stream_min_hosts', 0) )
+        if jobqueue != None:
+            jobs = jobqueue.completing(jobs)
+
+        try:
+            for job in jobs:
+                acct = job.acct
+                logging.debug("%s local_job_id = %s", resourcename, acct['id'])
+                summary,timeseries = summarize.summarize(job, lariat)
+
+                incomplete = summary['complete'] == False and summary["acct"]['end_time'] > referencetime
+
+                # The processed status is logged once the output is written
+                outdb.insert(resourcename, summary, timeseries,
+                             functools.partial(loginsert, dbwriter, settings['resource_id'], acct, summary["acct"]['end_time'],
+                                               incomplete, processtimes, ratecalc))
+        finally:
+            # The summaries are written before their process versions are logged
+            outdb.flush()
+            dbwriter.flush()
 
         if processtimes['maxtime'] != 0:
             timewindows[resourcename] = processtimes
@@ -160,6 +200,8 @@ def usage():
     print "  -l --localjobid=JOBID process only the job with the specified id"
     print "                        this option requires the resource to be specified"
     print "  -c --config=PATH      specify the path to the configuration directory"
+    print "  -b --batch=N          summarize the jobs N at a time, reading each archive"
+    print "                        file only once per batch (default 1)"
     print "  -s --start TIME       process all jobs that ended after the provided start"
     print "                        time (an end time must also be specified)"
     print "  -e --end TIME         process all jobs that ended before the provided end"
@@ -178,10 +220,11 @@ def getoptions():
         "config": None,
         "ignoreprocessed": False,
         "start": None,
-        "end": None
+        "end": None,
+        "batch": 1
     }
 
-    opts, args = getopt(sys.argv[1:], "r:l:c:s:e:idqh", ["resource=", "localjobid=", "config=", "start=", "end=", "ignore-processed", "debug", "quiet", "help"])
+    opts, args = getopt(sys.argv[1:], "r:l:c:b:s:e:idqh", ["resource=", "localjobid=", "config=", "batch=", "start=", "end=", "ignore-processed", "debug", "quiet", "help"])
 
     for opt in opts:
         if opt[0] in ("-r", "--resource"):
@@ -194,6 +237,8 @@ def getoptions():
             retdata['log'] = logging.ERROR
         elif opt[0] in ("-c", "--config"):
             retdata['config'] = opt[1]
+        elif opt[0] in ("-b", "--batch"):
+            retdata['batch'] = max(1, int(opt[1]))
         elif opt[0] in ("-s", "--start"):
             retdata['start'] = (parsetime(opt[1]) - datetime.datetime(1970, 1, 1)).total_seconds()
         elif opt[0] in ("-e", "--end"):
@@ -214,15 +259,37 @@ def getoptions():
 
     return retdata
 
+def terminate(signum, _):
+    """ Exit on SIGTERM through the finally blocks so that the buffered
+        output is written """
+    sys.exit(128 + signum)
+
 def main():
 
+    signal.signal(signal.SIGTERM, terminate)
+
     comm = MPI.COMM_WORLD
 
     options = getoptions()
 
     setuplogger(logging.ERROR, "./logs/summary_" + str(comm.Get_rank()) + ".log", options['log'])
 
-    createsummary(options, comm.Get_size(), comm.Get_rank())
+    if comm.Get_size() == 1 or options['localjobid'] != None:
+        createsummary(options, comm.Get_size(), comm.Get_rank())
+    elif comm.Get_rank() == 0:
+        # Rank 0 leases the jobs to the other ranks
+        config = account.getconfig(options['config'])
+
+        def loader(resourcename):
+            return getaccts(options, config['resources'][resourcename], config['accountdatabase'], None, None)
+
+        workqueue.serve_mpi(workqueue.Coordinator(workqueue.WorkQueue(loader)), comm)
+    else:
+        client = workqueue.MPIClient(comm)
+        try:
+            createsummary(options, comm.Get_size() - 1, comm.Get_rank() - 1, client)
+        finally:
+            client.close()
 
 if __name__ == '__main__': 
     main()
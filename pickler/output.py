@@ -2,8 +2,33 @@
 """ job summary output """
 import json
 import logging
-from pymongo import MongoClient
-from pymongo.errors import InvalidDocument
+import time
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError, InvalidDocument
+
+# Number of jobs and the number of seconds after which the buffered
+# documents are written
+WRITE_BATCH_SIZE = 50
+WRITE_BATCH_SECONDS = 30
+
+def patchupdate(summary, sections):
+    """ Return the update that replaces the listed sections of a summary
+        document with those in summary. Sections that are not in summary are
+        removed from the document. """
+    setfields = { "summary_version": summary["summary_version"] }
+    unsetfields = {}
+    for section in sections:
+        if section == "timeseries":
+            continue
+        if section in summary:
+            setfields[section] = summary[section]
+        else:
+            unsetfields[section] = ""
+
+    update = { "$set": setfields }
+    if len(unsetfields) > 0:
+        update["$unset"] = unsetfields
+    return update
 
 def factory(dbconfig):
     if dbconfig['dbtype'] == 'stdout':
@@ -15,31 +40,105 @@ class StdoutOutput(object):
     def __init__(self, _):
         pass
 
-    def insert(self, resourcename, summary, timeseries):
+    def insert(self, resourcename, summary, timeseries, callback):
         print resourcename
         print json.dumps(summary, indent=4, default=str)
         print json.dumps(timeseries, indent=4, default=str)
+        callback(True)
+
+    def flush(self):
+        pass
+
+    def exists(self, resourcename, docid):
+        return True
+
+    def patch(self, resourcename, summary, timeseries, sections):
+        print resourcename
+        print json.dumps(patchupdate(summary, sections), indent=4, default=str)
+        if "timeseries" in sections:
+            print json.dumps(timeseries, indent=4, default=str)
         return True
 
     def logreport(self, report):
         print report
 
 class MongoOutput(object):
+    """ Writes the summary and timeseries documents to MongoDB. Inserted
+        documents are buffered and written with one unordered bulk write per
+        collection once write_batch_size jobs are waiting or the oldest has
+        waited write_batch_seconds. """
     def __init__(self, dbconfig):
         self.client = MongoClient(dbconfig['uri'])
         self.db = self.client[dbconfig['dbname']]
+        self.batchsize = dbconfig.get('write_batch_size', WRITE_BATCH_SIZE)
+        self.batchseconds = dbconfig.get('write_batch_seconds', WRITE_BATCH_SECONDS)
+        self.pending = []
+        self.pendingsince = None
 
-    def insert(self, resourcename, summary, timeseries):
-        summaryOk = False
+    def insert(self, resourcename, summary, timeseries, callback):
+        """ Queue the documents to be written. callback is called with True
+            once both have been written or False if either failed. """
+        if not self.pending:
+            self.pendingsince = time.time()
+        self.pending.append((resourcename, summary, timeseries, callback))
+
+        if len(self.pending) >= self.batchsize or time.time() - self.pendingsince >= self.batchseconds:
+            self.flush()
+
+    def flush(self):
+        """ Write the queued documents and call their callbacks """
+        pending = self.pending
+        self.pending = []
+
+        requests = {}
+        for resourcename, summary, timeseries, _ in pending:
+            requests.setdefault(resourcename, []).append(summary)
+            if timeseries != None:
+                requests.setdefault("timeseries-" + resourcename, []).append(timeseries)
+
+        written = set()
+        for collection, docs in requests.iteritems():
+            written.update((collection, docid) for docid in self.bulkreplace(collection, docs))
+
+        for resourcename, summary, timeseries, callback in pending:
+            ok = (resourcename, summary["_id"]) in written
+            if timeseries != None:
+                # If the timeseries data is present then it must got into the db
+                ok = ok and ("timeseries-" + resourcename, timeseries["_id"]) in written
+            callback(ok)
+
+    def bulkreplace(self, collection, docs):
+        """ Upsert docs into the collection and return the ids of the documents
+            that were written """
         try:
-            self.db[resourcename].update( {"_id": summary["_id"]}, summary, upsert=True )
+            result = self.db[collection].bulk_write([ ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs ], ordered=False)
+        except InvalidDocument:
+            # The whole batch is rejected if a document cannot be encoded so
+            # write them one at a time to find the bad ones
+            return [ doc["_id"] for doc in docs if self.replace(collection, doc) ]
+        except BulkWriteError as exc:
+            failed = set(error['index'] for error in exc.details.get('writeErrors', []))
+            for error in exc.details.get('writeErrors', []):
+                logging.error("inserting document %s %s. %s", collection, docs[error['index']]["_id"], error.get('errmsg'))
+            return [ doc["_id"] for i, doc in enumerate(docs) if i not in failed ]
 
-            if self.db[resourcename].find_one( {"_id": summary["_id"], "summary_version": summary["summary_version"] }, { "_id":1 } ) != None:
-                summaryOk = True
+        if not result.acknowledged:
+            # The write concern does not report the outcome so read back
+            # which of the documents are there
+            found = self.db[collection].find({"_id": {"$in": [ doc["_id"] for doc in docs ]}}, {"_id": 1})
+            return [ doc["_id"] for doc in found ]
+
+        return [ doc["_id"] for doc in docs ]
+
+    def replace(self, collection, doc):
+        try:
+            self.db[collection].replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            return True
         except InvalidDocument as exc:
-            logging.error("inserting summary document %s %s. %s",
-                          resourcename, summary["_id"], str(exc))
+            logging.error("inserting document %s %s. %s", collection, doc["_id"], str(exc))
+            return False
 
+    def inserttimeseries(self, resourcename, timeseries):
         timeseriesOk = False
         if timeseries != None:
             # If the timeseries data is present then it must got into the db
@@ -54,6 +153,29 @@ class MongoOutput(object):
         else:
             timeseriesOk = True
 
+        return timeseriesOk
+
+    def exists(self, resourcename, docid):
+        return self.db[resourcename].find_one( {"_id": docid}, { "_id":1 } ) != None
+
+    def patch(self, resourcename, summary, timeseries, sections):
+        """ Replace the listed sections of the existing summary document with
+            those from summary. The timeseries document is replaced if
+            "timeseries" is one of the sections. """
+        summaryOk = False
+        try:
+            self.db[resourcename].update( {"_id": summary["_id"]}, patchupdate(summary, sections) )
+
+            if self.db[resourcename].find_one( {"_id": summary["_id"], "summary_version": summary["summary_version"] }, { "_id":1 } ) != None:
+                summaryOk = True
+        except InvalidDocument as exc:
+            logging.error("updating summary document %s %s. %s",
+                          resourcename, summary["_id"], str(exc))
+
+        timeseriesOk = True
+        if "timeseries" in sections:
+            timeseriesOk = self.inserttimeseries(resourcename, timeseries)
+
         return summaryOk and timeseriesOk
 
     def logreport(self, report):
@@ -7,6 +7,11 @@ import re
 import operator
 from linuxhelpers import parsecpusallowed
 
+# Maximum number of entries kept by the proc classifier caches
+CLASSIFIER_CACHE_SIZE = 100000
+
+CPULIST_CHARS = "0123456789,-"
+
 class ProcFilter:
     def __init__(self):
         self.knownprocesses = set(['wnck-applet',
@@ -33,14 +38,19 @@ class ProcFilter:
         
         self.procfilter = re.compile('^/user/[a-z0-9]+/\.vnc/xstartup|^/var\/spool\/slurmd.+|.*pmi_proxy$')
 
+        # The filter decision for each command that has been checked
+        self.decisions = dict()
+
     def filter(self, command):
         """ returns true if the command should be filtered (ie it is a known non-HPC application) """
-        if command in self.knownprocesses:
-            return True
-        if self.procfilter.search(command):
-            return True
-    
-        return False
+        decision = self.decisions.get(command)
+        if decision == None:
+            decision = command in self.knownprocesses or self.procfilter.search(command) != None
+            if len(self.decisions) >= CLASSIFIER_CACHE_SIZE:
+                self.decisions.clear()
+            self.decisions[command] = decision
+
+        return decision
 
     def allow(self, command):
         return not self.filter(command)
@@ -50,7 +60,9 @@ class TaccProcDump:
     def __init__(self):
         self.procfilter = ProcFilter()
         self.commandre_v1 = re.compile("(.*)/([0-9]*)$")
-        self.commandre_v2 = re.compile("(.*)/([0-9]+)/([0-9,-]+)/([0-9,-]+)$")
+
+        # The classification of each (command, cpus allowed) seen in v2 proc entries
+        self.entries = dict()
 
     def getproclist(self, job, uid=None):
         if job.get_schema('proc') == None:
@@ -61,6 +73,33 @@ class TaccProcDump:
         else:
             return self.getproc_v2(job, uid)
 
+    def classify_v2(self, procstr):
+        """ Return (command, cpus allowed) for a v2 proc entry
+            "command/pid/cpus_allowed/mems_allowed" or None if the entry does
+            not parse or the command is filtered. This is the same as matching
+            "(.*)/([0-9]+)/([0-9,-]+)/([0-9,-]+)$" but the result only depends
+            on the command and the cpus allowed, not on the pid, so it is
+            cached on those and the cost scales with the number of distinct
+            commands rather than the number of processes on all of the
+            hosts. """
+        fields = procstr.rsplit("/", 3)
+        if len(fields) != 4:
+            return None
+        command, pid, cpus, mems = fields
+        if not pid.isdigit() or cpus == "" or cpus.strip(CPULIST_CHARS) != "" or mems == "" or mems.strip(CPULIST_CHARS) != "":
+            return None
+
+        key = (command, cpus)
+        if key not in self.entries:
+            if len(self.entries) >= CLASSIFIER_CACHE_SIZE:
+                self.entries.clear()
+            if self.procfilter.allow(command):
+                self.entries[key] = (command, parsecpusallowed(cpus))
+            else:
+                self.entries[key] = None
+
+        return self.entries[key]
+
     def getproc_v2(self, job, uid):
         outprocs = dict()
 
@@ -68,15 +107,14 @@ class TaccProcDump:
             if "proc" in host.stats.keys():
                 for procstr, data in host.stats['proc'].iteritems():
 
-                    m = self.commandre_v2.search(procstr)
-                    if m == None:
+                    entry = self.classify_v2(procstr)
+                    if entry == None:
                         continue
-                    command = m.group(1)
+                    command, cpusallowed = entry
 
-                    if self.procfilter.allow(command):
-                        procuid = data[0, job.get_schema('proc')['Uid'].index]
-                        if uid == None or uid == procuid:
-                            outprocs[command] = parsecpusallowed(m.group(3))
+                    procuid = data[0, job.get_schema('proc')['Uid'].index]
+                    if uid == None or uid == procuid:
+                        outprocs[command] = cpusallowed
 
             if len(outprocs) > 0:
                 break
@@ -1,25 +1,40 @@
 #!/usr/bin/env python
 import warnings
 import job_stats
+import archiveindex
+import gzindex
+import lariatindex
 import batch_acct
 import account
 import summarize
+import jobcache
+import workqueue
 import sys
 import time
 import datetime
-from multiprocessing import Process
+import signal
+import functools
+from multiprocessing import Process, Queue
 import socket
 from getopt import getopt
 import logging
 import output
 import os
 
-from scripthelpers import setuplogger
+from scripthelpers import setuplogger, prefetch, Writer
 from journal import Journal
 
 PROCESS_VERSION = 4
 ERROR_INCOMPLETE = -1001
 
+def savejobcache(job, jobcachedir):
+    """ Save the processed job in the job cache. Failures are logged but
+        do not stop the job being summarized """
+    try:
+        jobcache.save(job, jobcache.cache_path(jobcachedir, job.acct))
+    except Exception as exc:
+        logging.warning("%s: unable to save the job cache: %s", job.id, exc)
+
 class RateCalculator:
     def __init__(self, procid):
         self.count_good = 0
@@ -47,7 +62,40 @@ class RateCalculator:
     def rate(self):
         return self.rate
 
-def createsummary(options, totalprocs, procid):
+def getdbreader(options, settings, dbconf, totalprocs, procid):
+    return account.DbAcct( settings['resource_id'], dbconf, PROCESS_VERSION, totalprocs, procid, options['localjobid'], options['sections'] != None)
+
+def loginsert(dbwriter, resource_id, acct, end_time, incomplete, processtimes, ratecalc, insertOk):
+    """ Log the processed status of a job once its summary has been written """
+    if incomplete:
+        # Do not mark incomplete jobs as done unless they are older than the
+        # reference time (which defaults to 7 days ago)
+        dbwriter.logprocessed(acct, resource_id, ERROR_INCOMPLETE)
+        ratecalc.increment(False)
+        return
+
+    if insertOk:
+        dbwriter.logprocessed( acct, resource_id, PROCESS_VERSION )
+        processtimes['mintime'] = min( processtimes['mintime'], end_time )
+        processtimes['maxtime'] = max( processtimes['maxtime'], end_time )
+        ratecalc.increment(True)
+    else:
+        # Mark as negative process version to indicate that it has been processed
+        # but no summary was output
+        dbwriter.logprocessed( acct, resource_id, 0 - PROCESS_VERSION )
+        ratecalc.increment(False)
+
+def patchsummary(outdb, dbwriter, resourcename, summary, timeseries, sections, resource_id, acct, processtimes, ratecalc):
+    """ Replace the sections of an existing summary and log the job as processed """
+    if outdb.patch(resourcename, summary, timeseries, sections):
+        dbwriter.logprocessed( acct, resource_id, PROCESS_VERSION )
+        processtimes['mintime'] = min( processtimes['mintime'], summary["acct"]['end_time'] )
+        processtimes['maxtime'] = max( processtimes['maxtime'], summary["acct"]['end_time'] )
+        ratecalc.increment(True)
+    else:
+        ratecalc.increment(False)
+
+def createsummary(options, totalprocs, procid, jobqueue=None):
 
     procidstr = "%s of %s " % (procid, totalprocs) if totalprocs != None else ""
 
@@ -58,6 +106,11 @@ def createsummary(options, totalprocs, procid):
     config = account.getconfig(options['config'])
     dbconf = config['accountdatabase']
 
+    # The gather workers are forked before any threads are started (the
+    # output database client and the pipeline stages run their own) and
+    # shared by the resources that have gather_workers set
+    gatherpool = job_stats.create_gather_pool(max([ settings.get('gather_workers', 1) for settings in config['resources'].itervalues() ] + [1]))
+
     outdb = output.factory(config['outputdatabase'])
 
     ratecalc = RateCalculator(procid)
@@ -74,9 +127,14 @@ def createsummary(options, totalprocs, procid):
 
         processtimes = { "mintime": 2**64, "maxtime": 0 }
 
-        dbreader = account.DbAcct( settings['resource_id'], dbconf, PROCESS_VERSION, totalprocs, procid, options['localjobid'])
+        if jobqueue != None:
+            accts = jobqueue.accts(resourcename)
+        else:
+            accts = getdbreader(options, settings, dbconf, totalprocs, procid).reader()
 
         bacct = batch_acct.factory(settings['batch_system'], settings['acct_path'], settings['host_name_ext'] )
+        gzindex.INDEX_DIR = settings.get('archive_index_dir')
+        lariatindex.INDEX_DIR = settings.get('lariat_index_dir')
 
         if settings['lariat_path'] != "":
             lariat = summarize.LariatManager(settings['lariat_path'])
@@ -85,34 +143,80 @@ def createsummary(options, totalprocs, procid):
 
         dbwriter = account.DbLogger( dbconf["dbname"], dbconf["tablename"], dbconf["defaultsfile"] )
 
-        for acct in dbreader.reader():
-            logging.debug("%s local_job_id = %s", resourcename, acct['id'])
-            job = job_stats.from_acct( acct, settings['tacc_stats_home'], settings['host_list_dir'], bacct )
-            summary,timeseries = summarize.summarize(job, lariat)
-
-            insertOk = outdb.insert(resourcename, summary, timeseries)
-
-            if summary['complete'] == False and summary["acct"]['end_time'] > referencetime:
-                # Do not mark incomplete jobs as done unless they are older than the
-                # reference time (which defaults to 7 days ago)
-                dbwriter.logprocessed(acct, settings['resource_id'], ERROR_INCOMPLETE)
-                ratecalc.increment(False)
-                continue
-            
-            if insertOk:
-                dbwriter.logprocessed( acct, settings['resource_id'], PROCESS_VERSION )
-                processtimes['mintime'] = min( processtimes['mintime'], summary["acct"]['end_time'] )
-                processtimes['maxtime'] = max( processtimes['maxtime'], summary["acct"]['end_time'] )
-                ratecalc.increment(True)
+        if options['sections'] == ['lariat']:
+            # The lariat data only depends on the accounting record so there
+            # is no need to read the host stats
+            jobs = ( job_stats.Job(acct, settings['tacc_stats_home'], settings['host_list_dir'], bacct) for acct in accts )
+        else:
+            # Every job that is gathered is saved in the job cache if one is
+            # configured. The cache is only read when sections of existing
+            # summaries are recomputed, since the jobs of a regular run have
+            # not been processed before or were incomplete.
+            jobcachedir = settings.get('job_cache_dir')
+
+            def gather(accts):
+                for job in job_stats.from_accts( accts, settings['tacc_stats_home'], settings['host_list_dir'], bacct,
+                                                 settings.get('archive_cache_dir'), options['batch'],
+                                                 archiveindex.factory(config, settings),
+                                                 gatherpool if settings.get('gather_workers', 1) > 1 else None,
+                                                 settings.get('stream_min_hosts', 0) ):
+                    if jobcachedir and not job.streaming:
+                        savejobcache(job, jobcachedir)
+                    yield job
+
+            if jobcachedir and settings.get('job_cache_max_age') != None:
+                jobcache.prune(jobcachedir, settings['job_cache_max_age'])
+
+            if jobcachedir and options['sections'] != None:
+                # The jobs that are not in the cache are gathered a batch at a
+                # time, so a worker only leases a batch of them ahead
+                jobs = jobcache.from_accts(jobcachedir, accts, gather, options['batch'])
             else:
-                # Mark as negative process version to indicate that it has been processed
-                # but no summary was output
-                dbwriter.logprocessed( acct, settings['resource_id'], 0 - PROCESS_VERSION )
-                ratecalc.increment(False)
+                jobs = gather(accts)
+
+        pipelinedepth = settings.get('pipeline_depth', 0)
+        if pipelinedepth > 0:
+            # The next jobs are gathered while this one is summarized
+            jobs = prefetch(jobs, pipelinedepth)
+        writer = Writer(pipelinedepth)
+
+        if jobqueue != None:
+            jobs = jobqueue.completing(jobs)
+
+        try:
+            for job in jobs:
+                acct = job.acct
+                logging.debug("%s local_job_id = %s", resourcename, acct['id'])
+
+                if options['sections'] != None and outdb.exists(resourcename, summarize.summaryid(acct)):
+                    # Only regenerate the requested sections of the existing summary
+                    summary,timeseries = summarize.summarize(job, lariat, options['sections'])
+                    writer.submit(patchsummary, outdb, dbwriter, resourcename, summary, timeseries, options['sections'],
+                                  settings['resource_id'], acct, processtimes, ratecalc)
+                    continue
+
+                summary,timeseries = summarize.summarize(job, lariat)
+
+                incomplete = summary['complete'] == False and summary["acct"]['end_time'] > referencetime
+
+                # The processed status is logged once the output is written
+                writer.submit(outdb.insert, resourcename, summary, timeseries,
+                              functools.partial(loginsert, dbwriter, settings['resource_id'], acct, summary["acct"]['end_time'],
+                                                incomplete, processtimes, ratecalc))
+        finally:
+            # The summaries are written before their process versions are logged
+            writer.close()
+            outdb.flush()
+            dbwriter.flush()
 
         if processtimes['maxtime'] != 0:
             timewindows[resourcename] = processtimes
 
+    # The pool is terminated at exit if an exception is raised above
+    if gatherpool != None:
+        gatherpool.close()
+        gatherpool.join()
+
     logging.info("Processor " + procidstr + "exiting. Processed %s", ratecalc.count)
 
     if ratecalc.count == 0:
@@ -136,6 +240,46 @@ def createsummary(options, totalprocs, procid):
     journal = Journal(config)
     journal.logreport(report)
 
+def runworker(options, totalprocs, procid, client):
+    """ Run createsummary() with the jobs leased from the work queue """
+    try:
+        createsummary(options, totalprocs, procid, client)
+    finally:
+        client.close()
+
+def runqueue(options, total_procs, start_offset):
+    """ Summarize the jobs with nprocs worker processes that lease them from
+        a work queue run by this process. Multiple instances still split the
+        jobs between them by job id. """
+    config = account.getconfig(options['config'])
+    dbconf = config['accountdatabase']
+    if options['total_instances'] > 1:
+        sharding = (options['total_instances'], options['instance_id'])
+    else:
+        sharding = (None, None)
+
+    def loader(resourcename):
+        return getdbreader(options, config['resources'][resourcename], dbconf, *sharding).reader()
+
+    coordinator = workqueue.Coordinator(workqueue.WorkQueue(loader))
+    requests = Queue()
+    replies = [ Queue() for _ in xrange(options['nprocs']) ]
+
+    proclist = []
+    for procid in xrange(options['nprocs']):
+        client = workqueue.ProcessClient(procid, requests, replies[procid])
+        p = Process( target=runworker, args=(options, total_procs, start_offset + procid, client) )
+        p.start()
+        proclist.append(p)
+
+    workqueue.serve_processes(coordinator, requests, replies, proclist)
+
+    exit_code = 0
+    for proc in proclist:
+        proc.join()
+        exit_code += proc.exitcode
+    return exit_code
+
 def usage():
     """ print usage """
     print "usage: {0} [OPTS] [N SUBPROCESSES] [TOTAL INSTANCES] [INSTANCE ID]".format(os.path.basename(__file__))
@@ -144,6 +288,13 @@ def usage():
     print "  -l --localjobid=JOBID process only the job with the specified id"
     print "                        this option requires the resource to be specified"
     print "  -c --config=PATH      specify the path to the configuration directory"
+    print "  -b --batch=N          summarize the jobs N at a time, reading each archive"
+    print "                        file only once per batch (default 1)"
+    print "  -s --sections=LIST    regenerate only the comma separated list of top level"
+    print "                        sections (such as a metric, analysis, lariat, procDump"
+    print "                        or timeseries) of the existing summaries that have an"
+    print "                        older summary version. The jobs that earlier runs saved"
+    print "                        in the job_cache_dir of the resource are read from it"
     print "  -d --debug            set log level to debug"
     print "  -q --quiet            only log errors"
     print "  -h --help             print this help message"
@@ -156,10 +307,12 @@ def getoptions():
         "logfile": None,
         "resource": None,
         "localjobid": None,
-        "config": None
+        "config": None,
+        "batch": 1,
+        "sections": None
     }
 
-    opts, args = getopt(sys.argv[1:], "r:l:c:dqh", ["resource=", "logfile=", "localjobid=", "config=", "debug", "quiet", "help"])
+    opts, args = getopt(sys.argv[1:], "r:l:c:b:s:dqh", ["resource=", "logfile=", "localjobid=", "config=", "batch=", "sections=", "debug", "quiet", "help"])
 
     for opt in opts:
         if opt[0] in ("-r", "--resource"):
@@ -174,6 +327,10 @@ def getoptions():
             retdata['log'] = logging.ERROR
         elif opt[0] in ("-c", "--config"):
             retdata['config'] = opt[1]
+        elif opt[0] in ("-b", "--batch"):
+            retdata['batch'] = max(1, int(opt[1]))
+        elif opt[0] in ("-s", "--sections"):
+            retdata['sections'] = [ section for section in opt[1].split(",") if section ]
         elif opt[0] in ("-h", "--help"):
             usage()
             sys.exit(0)
@@ -184,8 +341,15 @@ def getoptions():
 
     return retdata
 
+def terminate(signum, _):
+    """ Exit on SIGTERM through the finally blocks so that the buffered
+        output is written """
+    sys.exit(128 + signum)
+
 def main():
 
+    signal.signal(signal.SIGTERM, terminate)
+
     warnings.filterwarnings("ignore", "Degrees of freedom <= 0 for slice", RuntimeWarning)
 
     options = getoptions()
@@ -199,7 +363,7 @@ def main():
 
     if options['nprocs'] == 1:
         createsummary(options, None, None)
-    else:
+    elif options['localjobid'] != None:
         proclist = []
         for procid in xrange(options['nprocs']):
             p = Process( target=createsummary, args=(options, total_procs, start_offset + procid) )
@@ -209,6 +373,8 @@ def main():
         for proc in proclist:
             proc.join()
             exit_code += proc.exitcode
+    else:
+        exit_code = runqueue(options, total_procs, start_offset)
 
     sys.exit(exit_code)
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+""" Resampling of the host data of a job onto a common time grid.
+
+    The hosts of a job record their stats at slightly different times so the
+    data of each host is linearly interpolated onto the job's time grid before
+    the hosts are combined. The interpolation weights only depend on the
+    sample times of the host, so they are computed once per host and applied
+    to every column of every metric. The results are the same as calling
+    numpy.interp() on each column. """
+import numpy
+
+class HostGrid(object):
+    """ Interpolation weights from the sample times of a host onto a grid """
+    __slots__ = ('nsamples', 'lower', 'offset', 'width', 'first', 'last', 'exact')
+
+    def __init__(self, hosttimes, grid):
+        xp = numpy.asarray(hosttimes, dtype=numpy.float64)
+        x = numpy.asarray(grid, dtype=numpy.float64)
+        self.nsamples = len(xp)
+
+        # Index of the last sample at or before each grid point
+        j = numpy.searchsorted(xp, x, side='right') - 1
+        self.first = j < 0
+        self.last = j >= len(xp) - 1
+        self.lower = numpy.clip(j, 0, max(len(xp) - 2, 0))
+
+        if len(xp) > 1:
+            self.offset = x - xp[self.lower]
+            self.width = xp[self.lower + 1] - xp[self.lower]
+        else:
+            self.offset = numpy.zeros(len(x))
+            self.width = numpy.ones(len(x))
+        self.exact = self.offset == 0
+
+    def interp(self, values):
+        """ Return the (grid x columns) values interpolated from the
+            (samples x columns) array values """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if self.nsamples < 2:
+            return numpy.repeat(values[:1], len(self.lower), axis=0)
+
+        lower = values[self.lower]
+        slope = (values[self.lower + 1] - lower) / self.width[:, numpy.newaxis]
+        result = slope * self.offset[:, numpy.newaxis] + lower
+
+        result[self.exact] = lower[self.exact]
+        result[self.first] = values[0]
+        result[self.last] = values[-1]
+        return result
+
+def hostcolumns(host, metric, indices, computed=()):
+    """ Return the (samples x columns) totals over the devices of metric for
+        a host. The columns are the interfaces of the metric followed by the
+        sum over all interfaces and then the result of each of the computed
+        (formula, interfaces) functions of the interface totals. """
+    totals, alltotals = host.get_totals(metric)
+    ncols = totals.shape[1]
+    values = numpy.empty( (totals.shape[0], ncols + 1 + len(computed)) )
+    values[:, :ncols] = totals
+    values[:, ncols] = alltotals
+    for k, (func, interfaces) in enumerate(computed):
+        values[:, ncols + 1 + k] = func([ totals[:, indices[interface]] for interface in interfaces ])
+
+    return values
+
+class JobGrid(object):
+    """ The data of a list of hosts resampled onto the time grid. The
+        resampled data for a metric is held as a (hosts x columns x grid)
+        array, see hostcolumns() for the columns. """
+
+    def __init__(self, hosts, grid):
+        self.hosts = hosts
+        self.grid = grid
+        self.hostgrids = [ None ] * len(hosts)
+        self.cubes = {}
+
+    def hostgrid(self, hostidx):
+        if self.hostgrids[hostidx] is None:
+            self.hostgrids[hostidx] = HostGrid(self.hosts[hostidx].times, self.grid)
+        return self.hostgrids[hostidx]
+
+    def cube(self, metric, indices, computed=()):
+        """ Return (hostidx, columns, data) for metric. hostidx is the list of
+            the indices of the hosts that have the metric, data is their
+            resampled data and columns is the dict of the column in data of
+            each interface, "all" and each computed metric. computed is a
+            list of (name, function, interfaces). """
+        key = (metric, tuple(name for name, _, _ in computed))
+        if key in self.cubes:
+            return self.cubes[key]
+
+        hostidx = [ i for i, host in enumerate(self.hosts) if metric in host.stats ]
+        funcs = [ (func, interfaces) for _, func, interfaces in computed ]
+        data = None
+        for row, i in enumerate(hostidx):
+            values = self.hostgrid(i).interp(hostcolumns(self.hosts[i], metric, indices[metric], funcs))
+            if data is None:
+                data = numpy.empty( (len(hostidx), values.shape[1], len(self.grid)) )
+            data[row] = values.T
+
+        if data is None:
+            data = numpy.empty( (0, len(indices[metric]) + 1 + len(computed), len(self.grid)) )
+
+        ncols = data.shape[1] - 1 - len(computed)
+        columns = dict(indices[metric])
+        columns["all"] = ncols
+        for k, (name, _, _) in enumerate(computed):
+            columns[name] = ncols + 1 + k
+
+        self.cubes[key] = (hostidx, columns, data)
+        return self.cubes[key]
+
+    def devices(self, hostidx, metric):
+        """ Return the dict of (columns x grid) resampled data for each device
+            of metric on a host. The last column is the sum over all
+            interfaces. """
+        hostgrid = self.hostgrid(hostidx)
+        result = {}
+        for devname, devstats in self.hosts[hostidx].stats[metric].iteritems():
+            values = numpy.empty( (devstats.shape[0], devstats.shape[1] + 1) )
+            values[:, :-1] = devstats
+            values[:, -1] = numpy.sum(devstats, axis = 1)
+            result[devname] = hostgrid.interp(values).T
+        return result
@@ -1,5 +1,15 @@
 """ Utility functions that are used from more than one place """
 import logging
+import Queue
+import sys
+import threading
+
+_DONE = object()
+
+# Number of seconds that the main thread waits on a queue or thread at a time.
+# A signal handler only runs once the wait times out since the blocking calls
+# of Python 2 are not interrupted
+POLL_SECONDS = 1
 
 def setuplogger(consolelevel, filename=None, filelevel=None):
     """ setup the python root logger to log to the console with defined log
@@ -27,3 +37,106 @@ def setuplogger(consolelevel, filename=None, filelevel=None):
     consolehandler.setLevel(consolelevel)
     consolehandler.setFormatter(formatter)
     rootlogger.addHandler(consolehandler)
+
+def prefetch(items, size):
+    """ Generator that yields the items of the iterable items, which are read
+        ahead by a background thread that keeps up to size of them. An
+        exception raised while reading the items is raised by the generator.
+        The thread stops reading when the generator is closed. """
+    queue = Queue.Queue(size)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=POLL_SECONDS)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+            put((True, _DONE))
+        except:
+            put((False, sys.exc_info()))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            try:
+                ok, item = queue.get(timeout=POLL_SECONDS)
+            except Queue.Empty:
+                continue
+            if not ok:
+                raise item[0], item[1], item[2]
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+class Writer(object):
+    """ Runs the functions passed to submit() in order on a background thread
+        that is fed through a queue of up to size functions. With size 0 the
+        functions are run by submit(). An exception raised by a function
+        stops the thread and is raised by the next submit() or by close(). """
+    def __init__(self, size=0):
+        self.error = None
+        self.queue = None
+        if size > 0:
+            self.queue = Queue.Queue(size)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _DONE:
+                return
+            try:
+                entry[0](*entry[1])
+            except:
+                self.error = sys.exc_info()
+                # Drain the queue so that submit() does not block
+                while self.queue.get() is not _DONE:
+                    pass
+                return
+
+    def raiseerror(self):
+        if self.error != None:
+            error = self.error
+            self.error = None
+            raise error[0], error[1], error[2]
+
+    def submit(self, func, *args):
+        if self.queue == None:
+            func(*args)
+            return
+        self.raiseerror()
+        self.put((func, args))
+
+    def put(self, entry):
+        while True:
+            try:
+                self.queue.put(entry, timeout=POLL_SECONDS)
+                return
+            except Queue.Full:
+                pass
+
+    def close(self):
+        """ Wait for the submitted functions to finish """
+        if self.queue == None:
+            return
+        self.put(_DONE)
+        while self.thread.is_alive():
+            self.thread.join(POLL_SECONDS)
+        self.queue = None
+        self.raiseerror()
@@ -5,18 +5,21 @@ import job_stats
 import math
 import numpy
 import os
-import scipy
+import random
 import sys
 import json
 import traceback
-from scipy import stats
 from extra.catastrophe import Catastrophe
 from procdump import TaccProcDump
+import formulas
 import logging
+import resample
+import lariatindex
+from collections import OrderedDict
 
 from timeseriessummary import TimeSeriesSummary
 
-SUMMARY_VERSION = "0.9.37"
+SUMMARY_VERSION = "0.9.38"
 
 VERBOSE = False
 
@@ -34,6 +37,20 @@ numpy.seterr(all='ignore')
 
 TOO_FEW_DATAPOINTS = 1
 
+# Number of hosts that are resampled together by gentimedata()
+TIMEDATA_GRID_HOSTS = 64
+
+# Number of values kept for each statistic of a streamed job. Beyond this the
+# moments are accumulated and the median is estimated from a reservoir sample.
+STREAMING_RESERVOIR_SIZE = 10000
+
+# Number of lariat records and lariat file indexes kept by LariatManager
+LARIAT_CACHE_RECORDS = 10000
+LARIAT_CACHE_FILES = 8
+
+# Shared by all of the jobs so that the proc classifier caches are kept
+TACCPROC = TaccProcDump()
+
 def removeDotKey(obj):
 
     for key in obj.keys():
@@ -71,259 +88,531 @@ def compute_sum(stats, indices, a, b, out, hostwalltime):
         insidx = indices[b]
         out.append( (1.0 * stats[-1,cidx] + 1.0 * stats[-1, insidx])/ hostwalltime )
 
+def compute_flops(stats, indices, isevent, out, hostwalltime):
+    if 'ERROR' not in indices and 'SIMD_DOUBLE_256' in indices and isevent['SIMD_DOUBLE_256']:
+        simd = stats[-1, indices['SIMD_DOUBLE_256']] / hostwalltime
+        if 'SSE_DOUBLE_ALL' in indices and isevent['SSE_DOUBLE_ALL']:
+            out['SSE_DOUBLE_ALL'].append( 4.0 * simd + 2.0 * (stats[-1, indices['SSE_DOUBLE_ALL']] / hostwalltime) )
+        if 'SSE_DOUBLE_PACKED' in indices and 'SSE_DOUBLE_SCALAR' in indices and isevent['SSE_DOUBLE_PACKED'] and isevent['SSE_DOUBLE_SCALAR']:
+            out['SSE_DOUBLE_PACKED'].append( 4.0 * simd + 2.0 * (stats[-1, indices['SSE_DOUBLE_PACKED']] / hostwalltime) + \
+                                             stats[-1, indices['SSE_DOUBLE_SCALAR']] / hostwalltime )
+
+def accumulator(data):
+    """ Return a copy of data to add the data of the other hosts to. Stats
+        that were compacted to uint32 are widened so that the sum does not
+        overflow. """
+    if data.dtype == numpy.uint32:
+        return data.astype(numpy.uint64)
+    return numpy.array(data)
+
 def addtoseries(interface, series, enties, data):
     if interface not in series:
-        series[interface] = numpy.array(data)
+        series[interface] = accumulator(data)
         enties[interface] = 1
     else:
         series[interface] += data
         enties[interface] += 1
 
-def gentimedata(j, indices, ignorelist, isevent):
-
-    # Do the special derived metrics:
-    derived = { 
-            "intel_snb": { 
-                "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
-                "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "LOAD_L1D_ALL" ],
-                "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1])", "SIMD_DOUBLE_256", "SSE_DOUBLE_ALL" ],
-                "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1]) + numpy.diff(a[2])", "SIMD_DOUBLE_256", "SSE_DOUBLE_PACKED", "SSE_DOUBLE_SCALAR" ] 
+class TimeData(object):
+    """ Accumulates the job timeseries data for gentimedata() one host at a time """
+
+    def __init__(self, j, indices, ignorelist, isevent):
+        # Do the special derived metrics:
+        self.derived = { 
+                "intel_snb": { 
+                    "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
+                    "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "LOAD_L1D_ALL" ],
+                    "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1])", "SIMD_DOUBLE_256", "SSE_DOUBLE_ALL" ],
+                    "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1]) + numpy.diff(a[2])", "SIMD_DOUBLE_256", "SSE_DOUBLE_PACKED", "SSE_DOUBLE_SCALAR" ] 
+                },
+                "intel_hsw": { 
+                    "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
+                    "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "LOAD_L1D_ALL" ],
+                    "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1])", "SIMD_DOUBLE_256", "SSE_DOUBLE_ALL" ],
+                    "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1]) + numpy.diff(a[2])", "SIMD_DOUBLE_256", "SSE_DOUBLE_PACKED", "SSE_DOUBLE_SCALAR" ] 
+                },
+                "intel_ivb": {
+                    "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
+                    "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "LOAD_L1D_ALL" ]
+                },
+            "intel_knl": {
+                "meancpiref":  ["numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED"]
+            },
+            "intel_skx": {
+                "meancpiref":  ["numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED"],
+                "flops": ["8.0*numpy.diff(a[0]) + 4.0*numpy.diff(a[1]) + 2.0*numpy.diff(a[2]) + numpy.diff(a[3])",
+                          "FP_ARITH_INST_RETIRED_512B_PACKED_DOUBLE",
+                          "FP_ARITH_INST_RETIRED_256B_PACKED_DOUBLE",
+                          "FP_ARITH_INST_RETIRED_128B_PACKED_DOUBLE",
+                          "FP_ARITH_INST_RETIRED_SCALAR_DOUBLE"]
             },
-            "intel_hsw": { 
-                "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
-                "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "LOAD_L1D_ALL" ],
-                "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1])", "SIMD_DOUBLE_256", "SSE_DOUBLE_ALL" ],
-                "flops":   [ "4.0*numpy.diff(a[0]) + 2.0*numpy.diff(a[1]) + numpy.diff(a[2])", "SIMD_DOUBLE_256", "SSE_DOUBLE_PACKED", "SSE_DOUBLE_SCALAR" ] 
+                "intel_pmc3": {
+                    "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
+                    "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "MEM_LOAD_RETIRED_L1D_HIT" ],
+                }
+        }
+
+        self.computed = {
+            "intel_snb_imc": {
+                "membw": [ "64.0 * (a[0] + a[1])", "CAS_READS", "CAS_WRITES" ]
             },
-            "intel_ivb": {
-                "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
-                "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "LOAD_L1D_ALL" ]
+            "intel_skx_imc": {
+                "membw": [ "64.0 * (a[0] + a[1])", "CAS_READS", "CAS_WRITES" ]
             },
-        "intel_knl": {
-            "meancpiref":  ["numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED"]
-        },
-        "intel_skx": {
-            "meancpiref":  ["numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED"],
-            "flops": ["8.0*numpy.diff(a[0]) + 4.0*numpy.diff(a[1]) + 2.0*numpy.diff(a[2]) + numpy.diff(a[3])",
-                      "FP_ARITH_INST_RETIRED_512B_PACKED_DOUBLE",
-                      "FP_ARITH_INST_RETIRED_256B_PACKED_DOUBLE",
-                      "FP_ARITH_INST_RETIRED_128B_PACKED_DOUBLE",
-                      "FP_ARITH_INST_RETIRED_SCALAR_DOUBLE"]
-        },
-            "intel_pmc3": {
-                "meancpiref":  [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "INSTRUCTIONS_RETIRED" ],
-                "meancpldref": [ "numpy.diff(a[0])/numpy.diff(a[1])", "CLOCKS_UNHALTED_REF", "MEM_LOAD_RETIRED_L1D_HIT" ],
+            "mem": {
+                "mem_used_minus_cache": [ "a[0] - a[1] - a[2]", "MemUsed", "FilePages", "Slab" ]
             }
-    }
-
-    computed = {
-        "intel_snb_imc": {
-            "membw": [ "64.0 * (a[0] + a[1])", "CAS_READS", "CAS_WRITES" ]
-        },
-        "intel_skx_imc": {
-            "membw": [ "64.0 * (a[0] + a[1])", "CAS_READS", "CAS_WRITES" ]
-        },
-        "mem": {
-            "mem_used_minus_cache": [ "a[0] - a[1] - a[2]", "MemUsed", "FilePages", "Slab" ]
         }
-    }
 
-    if "intel_snb_imc" in isevent:
-        isevent["intel_snb_imc"]["membw"] = True
-    if "intel_skx_imc" in isevent:
-        isevent["intel_skx_imc"]["membw"] = True
-    if "mem" in isevent:
-        isevent["mem"]["mem_used_minus_cache"] = False
+        if "intel_snb_imc" in isevent:
+            isevent["intel_snb_imc"]["membw"] = True
+        if "intel_skx_imc" in isevent:
+            isevent["intel_skx_imc"]["membw"] = True
+        if "mem" in isevent:
+            isevent["mem"]["mem_used_minus_cache"] = False
+
+        self.indices = indices
+        self.ignorelist = ignorelist
+        self.isevent = isevent
+        self.ndatapoints = len(j.times)
+        if self.ndatapoints < 3:
+            return
 
-    ndatapoints = len(j.times)
-    if ndatapoints < 3:
-        return { "error": TOO_FEW_DATAPOINTS }
+        self.times = numpy.linspace(j.start_time, j.end_time, self.ndatapoints)
 
-    times = numpy.linspace(j.start_time, j.end_time, ndatapoints)
+        # Data for each host is normalized to ndatapoints data points using
+        # piecewise linear interpolation. The host data is then combined to 
+        # produce job-timeseries data. The (columns x ndatapoints) sum over
+        # the hosts is kept for each metric.
 
-    # Data for each host is normalized to ndatapoints data points using
-    # piecewise linear interpolation. The host data is then combined to 
-    # produce job-timeseries data.
+        self.hostdata = {}
+        self.columns = {}
 
-    hostdata = {}
+    def addhost(self, host):
+        self.addhosts([host])
 
-    for host in j.hosts.itervalues():  # for all the hosts present in the file
-        for metric in host.stats.iterkeys():
-            if metric in ignorelist:
-                continue
+    def addhosts(self, hosts):
+        """ Add the data of a list of hosts. The data of the hosts is resampled
+            together and summed over the hosts. """
+        if self.ndatapoints < 3:
+            return
 
-            if metric not in indices:
-                logging.warning('%s not in index list for %s', metric, host.name)
-                continue
+        indices = self.indices
+        grid = resample.JobGrid(hosts, self.times)
+
+        metrics = []
+        for host in hosts:
+            for metric in host.stats.iterkeys():
+                if metric in self.ignorelist:
+                    continue
 
-            for interface in indices[metric].keys() + ["all"]:
-                if metric not in hostdata:
-                    hostdata[metric] = {}
-                if interface not in hostdata[metric]:
-                    hostdata[metric][interface] = numpy.interp(times, host.times, getinterfacestats(host.stats, metric, interface, indices))
+                if metric not in indices:
+                    logging.warning('%s not in index list for %s', metric, host.name)
+                    continue
+
+                if metric not in metrics:
+                    metrics.append(metric)
+
+        for metric in metrics:
+            computed = []
+            for outname, formula in self.computed.get(metric, {}).iteritems():
+                if any(interface not in indices[metric] for interface in formula[1:]):
+                    break
+                computed.append( (outname, formulas.compile_formula(formula[0]), formula[1:]) )
+
+            hostidx, columns, data = grid.cube(metric, indices, computed)
+            if metric not in self.hostdata:
+                self.hostdata[metric] = data[0].copy()
+                self.columns[metric] = columns
+                data = data[1:]
+            for hostdata in data:
+                self.hostdata[metric] += hostdata
+
+    def result(self):
+        if self.ndatapoints < 3:
+            return { "error": TOO_FEW_DATAPOINTS }
+
+        times = self.times
+        isevent = self.isevent
+        derived = self.derived
+
+        hostdata = {}
+        for m, columns in self.columns.iteritems():
+            hostdata[m] = dict( (i, self.hostdata[m][col]) for i, col in columns.iteritems() )
+
+        results = {}
+        for m,v in hostdata.iteritems():
+            values = {}
+            for i,a in v.iteritems():
+                if i == "all":
+                    continue
+                if '.' in i:
+                    continue
+                if m == "cpu":
+                    values[i] = numpy.diff(a) / numpy.diff(hostdata[m]["all"])
+                elif isevent[m][i]:
+                    values[i] = numpy.diff(a) / numpy.diff(times)
                 else:
-                    hostdata[metric][interface] += numpy.interp(times, host.times, getinterfacestats(host.stats, metric, interface, indices))
+                    values[i] = a
+            results[m] = calculate_stats_many(values)
 
-            if metric in computed:
-                for outname, formula in computed[metric].iteritems():
+            if m in derived:
+                if 'analysis' not in results:
+                    results['analysis'] = {}
+
+                for outname, formula in derived[m].iteritems():
+                    func = formula[0]
                     a = []
                     for interface in formula[1:]:
-                        if interface in indices[metric]:
-                            a.append(getinterfacestats(host.stats, metric, interface, indices))
+                        if interface in v:
+                            a.append(v[interface])
                         else:
                             break
 
                     if len(a) != (len(formula)-1):
                         break;
 
-                    if outname not in hostdata[metric]:
-                        hostdata[metric][outname] = numpy.interp(times, host.times, eval(formula[0]))
-                    else:
-                        hostdata[metric][outname] += numpy.interp(times, host.times, eval(formula[0]))
-
-    results = {}
-    for m,v in hostdata.iteritems():
-        results[m] = {}
-        for i,a in v.iteritems():
-            if i == "all":
-                continue
-            if '.' in i:
-                continue
-            if m == "cpu":
-                results[m][i] = calculate_stats( numpy.diff(a) / numpy.diff(hostdata[m]["all"]) )
-            elif isevent[m][i]:
-                results[m][i] = calculate_stats( numpy.diff(a) / numpy.diff(times) )
-            else:
-                results[m][i] = calculate_stats( a )
-
-        if m in derived:
-            if 'analysis' not in results:
-                results['analysis'] = {}
-
-            for outname, formula in derived[m].iteritems():
-                func = formula[0]
-                a = []
-                for interface in formula[1:]:
-                    if interface in v:
-                        a.append(v[interface])
-                    else:
-                        break
-
-                if len(a) != (len(formula)-1):
-                    break;
+                    results['analysis'][outname] = calculate_stats( formulas.evaluate(func, a) )
 
-                results['analysis'][outname] = calculate_stats( eval(func) )
+        return results
 
-    return results
+def gentimedata(j, indices, ignorelist, isevent):
+    timedata = TimeData(j, indices, ignorelist, isevent)
+    hosts = j.hosts.values()
+    for i in xrange(0, len(hosts), TIMEDATA_GRID_HOSTS):
+        timedata.addhosts(hosts[i:i + TIMEDATA_GRID_HOSTS])
+    return timedata.result()
 
 def converttooutput(series, summaryDict, j):
     for l in series.keys():
+        # All of the interfaces and devices of a metric are computed together
+        values = {}
         for k in series[l].keys():
             if isinstance(series[l][k], dict):
                 for i in series[l][k].keys():
-                    v = calculate_stats(series[l][k][i])
-                    addinstmetrics(summaryDict,j.overflows, l, i, k, v)
+                    values[(k, i)] = series[l][k][i]
             else:
-                v = calculate_stats(series[l][k])
-                addmetrics(summaryDict,j.overflows, l, k, v)
+                values[(k, )] = series[l][k]
+
+        for key, v in calculate_stats_many(values).iteritems():
+            if len(key) == 2:
+                addinstmetrics(summaryDict,j.overflows, l, key[1], key[0], v)
+            else:
+                addmetrics(summaryDict,j.overflows, l, key[0], v)
 
 class LariatManager:
-    def __init__(self, lariatpath):
+    """ Finds the lariat record of a job in the daily lariat files. The files
+        are indexed by job id (see lariatindex) so only the records of the
+        jobs that are looked up are parsed. The most recently used records
+        and file indexes are kept up to the given limits. """
+    def __init__(self, lariatpath, maxrecords=LARIAT_CACHE_RECORDS, maxfiles=LARIAT_CACHE_FILES):
         self.lariatpath = lariatpath
-        self.lariatdata = dict()
-        self.filesprocessed = []
+        self.maxrecords = maxrecords
+        self.maxfiles = maxfiles
+        self.lariatdata = OrderedDict()
+        self.indexes = OrderedDict()
         self.errors = dict()
 
     def find(self, jobid, jobstarttime, jobendtime):
 
         if jobid in self.lariatdata:
-            return self.lariatdata[jobid]
-
-        for days in (0, -1, 1):
-            searchday = datetime.datetime.utcfromtimestamp(jobendtime) + datetime.timedelta(days)
+            record = self.lariatdata.pop(jobid)
+            self.lariatdata[jobid] = record
+            return record
+
+        searchdays = []
+        for jobtime in (jobendtime, jobstarttime):
+            for days in (0, -1, 1):
+                searchday = datetime.datetime.utcfromtimestamp(jobtime) + datetime.timedelta(days)
+                if searchday.date() not in [ d.date() for d in searchdays ]:
+                    searchdays.append(searchday)
+
+        result = None
+        for searchday in searchdays:
             lfilename = os.path.join(self.lariatpath, searchday.strftime('%Y'), searchday.strftime('%m'), searchday.strftime('lariatData-sgeT-%Y-%m-%d.json'))
-            self.loadlariat(lfilename)
-            if jobid in self.lariatdata:
-                return self.lariatdata[jobid]
+            record = self.loadlariat(lfilename, jobid)
+            if record == None:
+                continue
+            if result == None:
+                result = record
+            elif 'runtime' in record and 'runtime' in result and result['runtime'] < record['runtime']:
+                # Have already got a record for this job. Keep the record
+                # that has longer recorded runtime since this is probably
+                # the endofjob record.
+                result = record
+
+        if result != None:
+            self.lariatdata[jobid] = result
+            if len(self.lariatdata) > self.maxrecords:
+                self.lariatdata.popitem(last=False)
+
+        return result
+
+    def getindex(self, filename):
+        if filename in self.indexes:
+            index = self.indexes.pop(filename)
+        else:
+            index = lariatindex.get_index(filename)
+        self.indexes[filename] = index
+        if len(self.indexes) > self.maxfiles:
+            self.indexes.popitem(last=False)
+        return index
+
+    def loadlariat(self, filename, jobid):
+        """ Return the lariat record for jobid from filename or None if the job
+            is not in the file """
+        try:
+            index = self.getindex(filename)
+            if jobid not in index:
+                return None
 
-        for days in (0, -1, 1):
-            searchday = datetime.datetime.utcfromtimestamp(jobstarttime) + datetime.timedelta(days)
-            lfilename = os.path.join(self.lariatpath, searchday.strftime('%Y'), searchday.strftime('%m'), searchday.strftime('lariatData-sgeT-%Y-%m-%d.json'))
-            self.loadlariat(lfilename)
+            records = lariatindex.read_records(filename, index, jobid, object_hook=removeDotKey)
+            self.errors.pop(filename, None)
 
-            if jobid in self.lariatdata:
-                return self.lariatdata[jobid]
+        except Exception as e:
+            self.errors[filename] = "Error processing {}. Error was {}.".format(filename, e)
+            return None
 
-        return None
+        return records[0]
 
-    def loadlariat(self, filename):
 
-        if filename in self.filesprocessed:
-            # No need to reparse file. If the job data was in the file, then this search
-            # function would not have been called.
-            return
+def calculate_stats(v):
+    if isinstance(v, RunningStats):
+        return v.calculate()
+
+    if len(v) == 0:
+        return { }
+
+    v = numpy.asarray(v)
+    if v.ndim != 1 or not numpy.issubdtype(v.dtype, numpy.number):
+        return { 'error': 'TypeError' }
+
+    return calculate_stats_rows(v[numpy.newaxis, :])[0]
+
+def calculate_stats_rows(v):
+    """ Return the list of calculate_stats() of each row of the non-empty 2-D
+        array v. The statistics are computed for all of the rows at once and
+        the medians are found with a partial sort. The results are the same
+        as scipy.stats.describe(), numpy.median() and scipy.stats.tstd(). """
+
+    v = numpy.asarray(v, dtype=numpy.float64)
+    n = v.shape[1]
+
+    v_min = numpy.min(v, axis=1)
+    v_max = numpy.max(v, axis=1)
+    v_avg = numpy.mean(v, axis=1)
+
+    # Central moments
+    d = v - v_avg[:, numpy.newaxis]
+    d2 = d * d
+    s2 = numpy.sum(d2, axis=1)
+    m2 = s2 / n
+    m3 = numpy.mean(d2 * d, axis=1)
+    m4 = numpy.mean(d2 * d2, axis=1)
+    zero = (m2 == 0)
+    v_var = s2 / (n - 1)
+    v_skew = numpy.where(zero, 0.0, m3 / m2 ** 1.5)
+    v_kurt = numpy.where(zero, 0.0, m4 / m2 ** 2.0) - 3
+
+    half = n / 2
+    if n % 2:
+        v_med = numpy.partition(v, half, axis=1)[:, half]
+    else:
+        part = numpy.partition(v, (half - 1, half), axis=1)
+        v_med = (part[:, half - 1] + part[:, half]) / 2.0
+    v_med[numpy.isnan(v).any(axis=1)] = numpy.nan
+
+    results = []
+    for i in xrange(v.shape[0]):
+        res = { }
+        res['max'] = float(v_max[i])
+        res['avg'] = v_avg[i]
+        res['krt'] = float(v_kurt[i])
+        res['min'] = float(v_min[i])
+        res['skw'] = float(v_skew[i])
+        res['cnt'] = n
+        if res['min'] == res['max']:
+            res['med'] = res['min']
+            res['std'] = 0.0
+        else:
+            res['med'] = float(v_med[i])
+            if n > 2:
+                res['std'] = numpy.sqrt(m2[i] * n / (n - 1.))
 
-        try:
-            with open(filename, "rb") as fp:
+        if n > 1 and abs(v_avg[i]) > 0:
+            res['cov'] = math.sqrt(v_var[i]) / v_avg[i]
+        else:
+            res['cov'] = 0.0
 
-                # Unfortunately, the lariat data is not in valid json
-                # This workaround converts the illegal \' into valid quotes
-                content = fp.read().replace("\\'", "'")
-                lariatJson = json.loads(content, object_hook=removeDotKey)
+        results.append(res)
 
-                for k,v in lariatJson.iteritems():
-                    if k not in self.lariatdata:
-                        self.lariatdata[k] = v[0]
-                    else:
-                        # Have already got a record for this job. Keep the record
-                        # that has longer recorded runtime since this is probably
-                        # the endofjob record.
-                        if 'runtime' in v[0] and 'runtime' in self.lariatdata[k] and self.lariatdata[k]['runtime'] < v[0]['runtime']:
-                            self.lariatdata[k] = v[0]
+    return results
 
-                self.filesprocessed.append(filename)
+def calculate_stats_many(series):
+    """ Return a dict with the calculate_stats() of each of the values in the
+        dict series. Values with the same length are computed together. """
+    results = {}
+    bylength = {}
+    for key, v in series.iteritems():
+        if isinstance(v, RunningStats):
+            if v.rng is not None:
+                results[key] = v.calculate()
+                continue
+            v = v.values
+        if len(v) == 0:
+            results[key] = { }
+        else:
+            bylength.setdefault(len(v), []).append((key, v))
 
-        except Exception as e:
-            self.errors[filename] = "Error processing {}. Error was {}.".format(filename, e)
+    for group in bylength.itervalues():
+        v = numpy.array([ values for _, values in group ])
+        if v.ndim != 2 or not numpy.issubdtype(v.dtype, numpy.number):
+            for key, values in group:
+                results[key] = calculate_stats(values)
+            continue
+        for (key, _), res in zip(group, calculate_stats_rows(v)):
+            results[key] = res
 
+    return results
 
-def calculate_stats(v):
-    res = { }
+class RunningStats(object):
+    """ Values for calculate_stats() that are added one at a time. If capacity
+        is set then only that many values are kept. After that the moments are
+        accumulated with Welford's method, the min and max are tracked and the
+        median is taken from a reservoir sample of the values. """
+    __slots__ = ('capacity', 'values', 'n', 'mean', 'm2', 'm3', 'm4', 'vmin', 'vmax', 'rng')
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.values = []
+        self.n = 0
+        self.rng = None
+
+    def __len__(self):
+        return self.n
+
+    def append(self, x):
+        self.n += 1
+        if self.rng is None:
+            self.values.append(x)
+            if self.capacity is not None and self.n > self.capacity:
+                self.startmoments()
+            return
 
-    if len(v) > 0:
+        x = float(x)
+        n = self.n
+        delta = x - self.mean
+        delta_n = delta / n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * (n - 1)
+        self.mean += delta_n
+        self.m4 += term1 * delta_n2 * (n * n - 3 * n + 3) + 6 * delta_n2 * self.m2 - 4 * delta_n * self.m3
+        self.m3 += term1 * delta_n * (n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+        self.vmin = min(self.vmin, x)
+        self.vmax = max(self.vmax, x)
+        self.sample(x)
+
+    def startmoments(self):
+        v = numpy.array(self.values, dtype=numpy.float64)
+        self.mean = float(numpy.mean(v))
+        d = v - self.mean
+        self.m2 = float(numpy.sum(d ** 2))
+        self.m3 = float(numpy.sum(d ** 3))
+        self.m4 = float(numpy.sum(d ** 4))
+        self.vmin = float(numpy.min(v))
+        self.vmax = float(numpy.max(v))
+        # Fixed seed so that a job always gets the same summary
+        self.rng = random.Random(self.capacity)
+        self.values = [float(x) for x in self.values[:self.capacity]]
+        self.sample(float(v[-1]))
+
+    def sample(self, x):
+        i = self.rng.randint(0, self.n - 1)
+        if i < self.capacity:
+            self.values[i] = x
+
+    def extend(self, other):
+        """ Add the values of the RunningStats other """
+        if other.rng is None:
+            for x in other.values:
+                self.append(x)
+            return
 
-        try:
-            (
-              v_n,
-              (v_min, v_max),
-              v_avg,
-              v_var,
-              v_skew,
-              v_kurt,
-              ) = scipy.stats.describe(v)
-        except TypeError as e:
-            return { 'error': 'TypeError' }
-
-        res['max'] = float(v_max)
-        res['avg'] = v_avg
-        res['krt'] = v_kurt
-        res['min'] = float(v_min)
-        res['skw'] = v_skew
-        res['cnt'] = len(v)
+        if self.rng is None:
+            values = self.values
+            for name in self.__slots__:
+                setattr(self, name, getattr(other, name))
+            self.values = list(other.values)
+            for x in values:
+                self.append(x)
+            return
+
+        # Combine the moments of the two sets of values and draw the
+        # reservoir from both in proportion to their size
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta * delta * na * nb / n
+        m3 = self.m3 + other.m3 + delta ** 3 * na * nb * (na - nb) / (n * n) + \
+             3.0 * delta * (na * other.m2 - nb * self.m2) / n
+        m4 = self.m4 + other.m4 + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / (n ** 3) + \
+             6.0 * delta * delta * (na * na * other.m2 + nb * nb * self.m2) / (n * n) + \
+             4.0 * delta * (na * other.m3 - nb * self.m3) / n
+        self.mean += delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        fromother = int(round(1.0 * self.capacity * nb / n))
+        self.values = self.rng.sample(self.values, min(self.capacity - fromother, len(self.values))) + \
+                      self.rng.sample(other.values, min(fromother, len(other.values)))
+        self.n = n
+
+    def maximum(self):
+        if self.rng is None:
+            return numpy.max(self.values)
+        return self.vmax
+
+    def calculate(self):
+        """ Return the calculate_stats() of the values """
+        if self.rng is None:
+            return calculate_stats(self.values)
+
+        n = self.n
+        res = {}
+        res['max'] = self.vmax
+        res['avg'] = self.mean
+        res['min'] = self.vmin
+        res['cnt'] = n
+        if self.m2 > 0:
+            res['skw'] = math.sqrt(n) * self.m3 / self.m2 ** 1.5
+            res['krt'] = n * self.m4 / (self.m2 * self.m2) - 3.0
+        else:
+            res['skw'] = 0.0
+            res['krt'] = -3.0
         if res['min'] == res['max']:
             res['med'] = res['min']
             res['std'] = 0.0
         else:
-            res['med'] = float(numpy.median(v, axis=0))
-            if len(v) > 2:
-                res['std'] = scipy.stats.tstd(v)
+            res['med'] = float(numpy.median(self.values))
+            res['std'] = math.sqrt(self.m2 / (n - 1))
 
-        if len(v) > 1 and abs(v_avg) > 0:
-            res['cov'] = math.sqrt(v_var) / v_avg
+        if abs(self.mean) > 0:
+            res['cov'] = math.sqrt(self.m2 / (n - 1)) / self.mean
         else:
             res['cov'] = 0.0
 
-    return res
+        return res
+
+def mergestats(statslist, capacity):
+    """ Return a RunningStats with the values of all of the RunningStats in
+        statslist """
+    if len(statslist) == 1:
+        return statslist[0]
+    merged = RunningStats(capacity)
+    for stats in statslist:
+        merged.extend(stats)
+    return merged
 
 def addinstmetrics(summary, overflows, device, interface, instance, values):
 
@@ -378,27 +667,6 @@ def getnumhosts(acct):
             return int(acct['slots']) / 12
     return -1
 
-def getinterfacestats(hoststats, metricname, interface, indices):
-
-    ifidx = None
-    if interface != "all":
-        ifidx = indices[metricname][interface]
-
-    totals = None
-    for devstats in hoststats[metricname].itervalues():
-        if totals is None:
-            if interface == "all":
-                totals = numpy.sum(devstats, axis = 1)
-            else:
-                totals = numpy.array(devstats[:,ifidx])
-        else:
-            if interface == "all":
-                totals += numpy.sum(devstats, axis = 1)
-            else:
-                totals += numpy.array(devstats[:,ifidx])
-
-    return totals
-
 def getperinterfacemetrics():
     return [ "cpu", "mem", "sched", "intel_pmc3", "intel_uncore", "intel_hsw", "intel_hsw_cbo", "intel_hsw_hau", "intel_hsw_imc", "intel_hsw_qpi", "intel_hsw_pcu", "intel_hsw_r2pci", "intel_snb", "intel_snb_cbo", "intel_snb_imc", "intel_snb_pcu", "intel_snb_hau", "intel_snb_qpi", "intel_snb_r2pci",
              "cputhreads",
@@ -418,7 +686,34 @@ def getperinterfacemetrics():
                      "intel_ivb_pcu",
                      "intel_ivb_r2pci"]
 
-def summarize(j, lariatcache):
+def summaryid(acct):
+    """ Return the id of the summary document for the job with accounting
+        record acct """
+    uniq = str( acct['local_jobid'] if 'local_jobid' in acct else acct['id'])
+    if 'cluster' in acct:
+        uniq += "-" + acct['cluster']
+    if 'job_array_index' in acct:
+        uniq += "-" + acct['job_array_index']
+    uniq += "-" + str(acct['end_time'])
+    return uniq
+
+def summarize(j, lariatcache, sections=None):
+    """ Return the (summary, timeseries) documents for the job j. If sections
+        is set then only those top level sections of the summary ("timeseries"
+        for the timeseries document) need to be correct. The sections that are
+        expensive to generate are skipped if they are not in the list. """
+
+    wanttimeseries = sections is None or 'timeseries' in sections
+    wanttimedata = sections is None or 'timedata' in sections
+    wantanalysis = sections is None or 'analysis' in sections
+    wantprocdump = sections is None or 'procDump' in sections
+    if sections is not None and 'lariat' not in sections:
+        lariatcache = None
+
+    # The hosts of a streamed job are loaded one at a time and everything
+    # that needs the host stats is accumulated as each host goes by.
+    streaming = getattr(j, 'streaming', False)
+    capacity = STREAMING_RESERVOIR_SIZE if streaming else None
 
     summaryDict = {}
     summaryDict['Error'] = list(j.errors)
@@ -507,12 +802,24 @@ def summarize(j, lariatcache):
 
     nHosts = 0
     corederived = { "cpicore": [], "cpiref": [], "cpldref": [] }
-    nodederived = {'maxmem': [], 'maxmemminus': [], 'maxMemBytes': [], 'maxMemMinusBytes': []}
+    nodederived = {'maxmem': RunningStats(capacity), 'maxmemminus': RunningStats(capacity),
+                   'maxMemBytes': RunningStats(capacity), 'maxMemMinusBytes': RunningStats(capacity)}
     socketderived = { "membw": [] }
 
-    totaltimes = []
-    starttimes = []
-    endtimes = []
+    # Counter ratios per metric. These are only used if the metric's counters
+    # did not overflow, which is not known until every host has been seen.
+    metricderived = {}
+
+    # Per core cpu usage as a fraction of the total, for all cores and
+    # the effective cores
+    cpufraction = {}
+    cpueffective = {}
+    flops = { "SSE_DOUBLE_ALL": RunningStats(capacity), "SSE_DOUBLE_PACKED": RunningStats(capacity) }
+    mpitraff = RunningStats(capacity)
+
+    totaltimes = RunningStats(capacity)
+    starttimes = RunningStats(capacity)
+    endtimes = RunningStats(capacity)
 
     # Naming convention:
     #  metricname - the name of the metric (such as cpu, mem etc).
@@ -521,7 +828,37 @@ def summarize(j, lariatcache):
     tacc_version = []
     cpus_combined = False
 
-    for host in j.hosts.itervalues():  # for all the hosts present in the file
+    uid = int(j.acct['uid']) if 'uid' in j.acct and (isinstance(j.acct['uid'], (int, long)) or j.acct['uid'].isdigit()) else None
+    taccproc = TACCPROC
+    pl = []
+
+    streamfolds = streaming and statsOk and len(j.hosts) > 0
+    if streamfolds:
+        ttt = TimeSeriesSummary(cpus_combined)
+        ttt.start(j, indices)
+        timefold = TimeData(j, indices, ignorelist, isevent)
+        catastrophe = [] if wantanalysis else None
+
+    if streaming:
+        hosts = j.stream_hosts()
+    else:
+        hosts = j.hosts.itervalues()
+
+    for host in hosts:  # for all the hosts present in the file
+        if streamfolds:
+            if wanttimeseries:
+                ttt.addhost(j, host, indices)
+            if wanttimedata:
+                timefold.addhost(host)
+            if isinstance(catastrophe, list):
+                c = compute_catastrophe(j.view([host]))
+                if isinstance(c, dict):
+                    catastrophe = c
+                else:
+                    catastrophe.append(c)
+            if wantprocdump and len(pl) == 0:
+                pl = taccproc.getproclist(j.view([host]), uid)
+
         nHosts += 1
         nCoresPerSocket = 1
         hostwalltime = host.times[-1] - host.times[0]
@@ -559,6 +896,10 @@ def summarize(j, lariatcache):
             if metricname not in host.stats.keys():
                 continue
 
+            if metricname not in metricderived:
+                metricderived[metricname] = { "cpicore": RunningStats(capacity), "cpiref": RunningStats(capacity),
+                                              "cpldref": RunningStats(capacity), "membw": RunningStats(capacity) }
+
             for device in host.stats[metricname].keys():
                 for interface, index in indices[metricname].iteritems():
 
@@ -568,7 +909,7 @@ def summarize(j, lariatcache):
                         if metricname in perinterface:
                             # Generate per-interface values
                             if interface not in totals[metricname]:
-                                totals[metricname][interface] = []
+                                totals[metricname][interface] = RunningStats(capacity)
 
                             totals[metricname][interface].append( host.stats[metricname][device][-1,index] / hostwalltime )
                         else:
@@ -576,7 +917,7 @@ def summarize(j, lariatcache):
                             if interface not in totals[metricname]:
                                 totals[metricname][interface] = {}
                             if device not in totals[metricname][interface]:
-                                totals[metricname][interface][device] = []
+                                totals[metricname][interface][device] = RunningStats(capacity)
                             
                             totals[metricname][interface][device].append( host.stats[metricname][device][-1,index] / hostwalltime  )
                     else:
@@ -602,7 +943,7 @@ def summarize(j, lariatcache):
                                 series[metricname][interface] = {}
                                 enties[metricname][interface] = {}
                             if device not in series[metricname][interface]:
-                                series[metricname][interface][device] = data
+                                series[metricname][interface][device] = accumulator(data)
                                 enties[metricname][interface][device] = 1
                             else:
                                 series[metricname][interface][device] += data
@@ -612,28 +953,42 @@ def summarize(j, lariatcache):
                 # Special cases
                 if metricname == "cpu":
                     if "all" not in totals["cpu"]:
-                        totals["cpu"]["all"] = []
-                    totals["cpu"]["all"].append( sum( 1.0 * host.stats[metricname][device][-1,:] / hostwalltime) )
+                        totals["cpu"]["all"] = RunningStats(capacity)
+                    cpuall = sum( 1.0 * host.stats[metricname][device][-1,:] / hostwalltime)
+                    totals["cpu"]["all"].append( cpuall )
+
+                    # Effective CPUS defined as those cores where the average activity was higher
+                    # than 5%
+                    effective = 'idle' in indices['cpu'] and (host.stats[metricname][device][-1,indices['cpu']['idle']] / hostwalltime / cpuall) < 0.95
+                    for interface, index in indices['cpu'].iteritems():
+                        if isevent['cpu'][interface]:
+                            if interface not in cpufraction:
+                                cpufraction[interface] = RunningStats(capacity)
+                                cpueffective[interface] = RunningStats(capacity)
+                            fraction = host.stats[metricname][device][-1,index] / hostwalltime / cpuall
+                            cpufraction[interface].append(fraction)
+                            if effective:
+                                cpueffective[interface].append(fraction)
 
                 elif metricname == "intel_snb" or metricname == "intel_hsw" or metricname == "intel_ivb":
-                    if metricname not in j.overflows:
-                        compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_CORE', 'INSTRUCTIONS_RETIRED', corederived["cpicore"])
-                        compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'INSTRUCTIONS_RETIRED', corederived["cpiref"])
-                        compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'LOAD_L1D_ALL', corederived["cpldref"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_CORE', 'INSTRUCTIONS_RETIRED', metricderived[metricname]["cpicore"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'INSTRUCTIONS_RETIRED', metricderived[metricname]["cpiref"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'LOAD_L1D_ALL', metricderived[metricname]["cpldref"])
+
+                    if metricname == "intel_snb":
+                        compute_flops(host.stats[metricname][device], indices[metricname], isevent[metricname], flops, hostwalltime)
 
                 elif metricname == "intel_knl" or metricname == "intel_skx":
-                    if metricname not in j.overflows:
-                        compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_CORE', 'INSTRUCTIONS_RETIRED', corederived["cpicore"])
-                        compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'INSTRUCTIONS_RETIRED', corederived["cpiref"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_CORE', 'INSTRUCTIONS_RETIRED', metricderived[metricname]["cpicore"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'INSTRUCTIONS_RETIRED', metricderived[metricname]["cpiref"])
 
                 elif metricname == "intel_pmc3":
-                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_CORE', 'INSTRUCTIONS_RETIRED', corederived["cpicore"])
-                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'INSTRUCTIONS_RETIRED', corederived["cpiref"])
-                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'MEM_LOAD_RETIRED_L1D_HIT', corederived["cpldref"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_CORE', 'INSTRUCTIONS_RETIRED', metricderived[metricname]["cpicore"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'INSTRUCTIONS_RETIRED', metricderived[metricname]["cpiref"])
+                    compute_ratio(host.stats[metricname][device], indices[metricname], 'CLOCKS_UNHALTED_REF', 'MEM_LOAD_RETIRED_L1D_HIT', metricderived[metricname]["cpldref"])
 
                 elif metricname == "intel_snb_imc" or metricname == "intel_skx_imc" or metricname == "intel_hsw_imc" or metricname == "intel_ivb_imc" or metricname == "intel_knl_mc_dclk":
-                    if metricname not in j.overflows:
-                        compute_sum(host.stats[metricname][device], indices[metricname], 'CAS_READS', 'CAS_WRITES', socketderived["membw"], hostwalltime / 64.0 )
+                    compute_sum(host.stats[metricname][device], indices[metricname], 'CAS_READS', 'CAS_WRITES', metricderived[metricname]["membw"], hostwalltime / 64.0 )
 
                 elif metricname == "mem":
                     if 'MemUsed' in indices[metricname] and 'FilePages' in indices[metricname] and 'Slab' in indices[metricname]:
@@ -648,7 +1003,7 @@ def summarize(j, lariatcache):
                         else:
                             end = ndatapoints
 
-                        memstat = (host.stats[metricname][device][1:ndatapoints,muindex] - \
+                        memstat = (accumulator(host.stats[metricname][device][1:ndatapoints,muindex]) - \
                                 host.stats[metricname][device][1:ndatapoints,fpindex] - \
                                 host.stats[metricname][device][1:ndatapoints,slindex] ) / nCoresPerSocket
 
@@ -668,14 +1023,26 @@ def summarize(j, lariatcache):
             nodederived['maxMemBytes'].append(numpy.amax(hostmemory['hostused']))
             nodederived['maxMemMinusBytes'].append(numpy.amax(hostmemory['hostusedminus']))
 
+        # TODO - make this stuff configurable
+        if 'lnet' in indices and '-' in host.stats.get('lnet', {}) and 'ib_sw' in indices and 'mlx4_0/1' in host.stats.get('ib_sw', {}):
+            if 'rx_bytes' in indices['lnet'] and 'rx_bytes' in indices['ib_sw'] and isevent['lnet']['rx_bytes'] and isevent['ib_sw']['rx_bytes']:
+                mpitraff.append( host.stats['ib_sw']['mlx4_0/1'][-1,indices['ib_sw']['rx_bytes']] / hostwalltime - \
+                                 host.stats['lnet']['-'][-1,indices['lnet']['rx_bytes']] / hostwalltime )
+
     # end loop over hosts
 
+    for metricname, mderived in metricderived.iteritems():
+        if metricname == "intel_pmc3" or metricname not in j.overflows:
+            for mname, mdata in mderived.iteritems():
+                if len(mdata) > 0:
+                    (corederived if mname in corederived else socketderived)[mname].append(mdata)
+
     if 'cpu' not in totals or 'all' not in totals['cpu']:
         statsOk = False
         summaryDict['Error'].append( "No CPU information" )
 
     if 'intel_knl' in totals and 'CLOCKS_UNHALTED_REF' in totals['intel_knl']:
-        if numpy.max(totals['intel_knl']['CLOCKS_UNHALTED_REF']) > (j.end_time - j.start_time)* 1.0e9 * 10:
+        if totals['intel_knl']['CLOCKS_UNHALTED_REF'].maximum() > (j.end_time - j.start_time)* 1.0e9 * 10:
             statsOk = False
             summaryDict['Error'].append( "Corrupt H/W counters")
 
@@ -691,44 +1058,46 @@ def summarize(j, lariatcache):
     if statsOk:
 
         # cpu usage
-        totalcpus = numpy.array(totals['cpu']['all'])
-        summaryDict['cpuall'] = calculate_stats(totalcpus)
+        summaryDict['cpuall'] = calculate_stats(totals['cpu']['all'])
 
         if cpus_combined == False and (summaryDict['cpuall']['med'] > 105.0 or summaryDict['cpuall']['med'] < 90.0):
             summaryDict['Error'].append("Corrupt CPU counters")
             statsOk = False
         else:
-            # Effective CPUS defined as those cores where the average activity was higher
-            # than 5%
-            effective = (numpy.array(totals['cpu']['idle']) / totalcpus) < 0.95
-
-            for interface, cdata in totals['cpu'].iteritems():
-                if interface != "all":
-                    ncdata = numpy.array(cdata) / totalcpus
-                    v = calculate_stats(ncdata)
-                    addmetrics(summaryDict,j.overflows, "cpu", interface, v)
+            for interface, fraction in cpufraction.iteritems():
+                v = calculate_stats(fraction)
+                addmetrics(summaryDict,j.overflows, "cpu", interface, v)
 
-                    eff = calculate_stats(numpy.compress(effective, ncdata))
-                    addmetrics(summaryDict,j.overflows, "cpueff", interface, eff)
+                eff = calculate_stats(cpueffective[interface])
+                addmetrics(summaryDict,j.overflows, "cpueff", interface, eff)
 
     timeseries = None
     timedata = None
-    if statsOk:
-        ttt = TimeSeriesSummary(cpus_combined)
-        timeseries = ttt.process(j,indices)
-        timedata = gentimedata(j, indices, ignorelist, isevent)
+    if statsOk and wanttimeseries:
+        if streaming:
+            timeseries = ttt.finish(j, indices, cpus_combined)
+        else:
+            ttt = TimeSeriesSummary(cpus_combined)
+            timeseries = ttt.process(j,indices)
+    if statsOk and wanttimedata:
+        if streaming:
+            timedata = timefold.result()
+        else:
+            timedata = gentimedata(j, indices, ignorelist, isevent)
 
     if statsOk:
-        for mname, mdata in corederived.iteritems():
+        for mname, mlist in corederived.iteritems():
             # Store CPI per core
+            mdata = mergestats(mlist, capacity)
             if len(mdata) > 0:
                 summaryDict[mname] = calculate_stats(mdata)
                 if len(mdata) <= len( totals['cpu']['all'] ):
                     summaryDict[mname]['error'] = 2
                     summaryDict[mname]['error_msg'] = 'Not all cores have counters'
 
-        for mname, mdata in socketderived.iteritems():
+        for mname, mlist in socketderived.iteritems():
             # Store socket derived metrics
+            mdata = mergestats(mlist, capacity)
             if len(mdata) > 0:
                 summaryDict[mname] = calculate_stats(mdata)
 
@@ -741,11 +1110,9 @@ def summarize(j, lariatcache):
 
             if 'ERROR' not in totals['intel_snb']:
                 if 'SSE_DOUBLE_ALL' in totals['intel_snb'] and 'SIMD_DOUBLE_256' in totals['intel_snb']:
-                    flops = 4.0 * numpy.array(totals['intel_snb']['SIMD_DOUBLE_256']) + 2.0 * numpy.array(totals['intel_snb']['SSE_DOUBLE_ALL'])
-                    summaryDict['FLOPS'] = calculate_stats(flops)
+                    summaryDict['FLOPS'] = calculate_stats(flops['SSE_DOUBLE_ALL'])
                 elif 'SSE_DOUBLE_SCALAR' in totals['intel_snb'] and 'SSE_DOUBLE_PACKED' in totals['intel_snb'] and 'SIMD_DOUBLE_256' in totals['intel_snb']:
-                    flops = 4.0 * numpy.array(totals['intel_snb']['SIMD_DOUBLE_256']) + 2.0 * numpy.array(totals['intel_snb']['SSE_DOUBLE_PACKED']) + numpy.array(totals['intel_snb']['SSE_DOUBLE_SCALAR'])
-                    summaryDict['FLOPS'] = calculate_stats(flops)
+                    summaryDict['FLOPS'] = calculate_stats(flops['SSE_DOUBLE_PACKED'])
             else:
                 summaryDict['FLOPS'] = { 'error': 2, "error_msg": 'Counters were reprogrammed during job' }
 
@@ -755,8 +1122,7 @@ def summarize(j, lariatcache):
         # TODO - make this stuff configurable
         if 'lnet' in totals.keys() and 'rx_bytes' in totals['lnet'] and '-' in totals['lnet']["rx_bytes"]:
             if 'ib_sw' in totals.keys() and "rx_bytes" in totals['ib_sw'] and 'mlx4_0/1' in totals['ib_sw']["rx_bytes"]:
-                if len(totals['ib_sw']["rx_bytes"]['mlx4_0/1']) == len(totals['lnet']["rx_bytes"]['-']):
-                    mpitraff = numpy.array(totals['ib_sw']["rx_bytes"]['mlx4_0/1']) -  numpy.array(totals['lnet']["rx_bytes"]['-'])
+                if len(totals['ib_sw']["rx_bytes"]['mlx4_0/1']) == len(totals['lnet']["rx_bytes"]['-']) == len(mpitraff):
                     stats = calculate_stats(mpitraff)
                     if stats['min'] < 0.0:
                         summaryDict['mpirx'] = { 'error': 2, 'error_msg': 'lnet counts exceed ib counts' }
@@ -770,8 +1136,16 @@ def summarize(j, lariatcache):
         converttooutput(series, summaryDict, j)
         converttooutput(totals, summaryDict, j)
 
+    if statsOk and wantanalysis:
         summaryDict['analysis'] = {}
-        summaryDict['analysis']['catastrophe'] = compute_catastrophe(j)
+        if not streaming:
+            summaryDict['analysis']['catastrophe'] = compute_catastrophe(j)
+        elif isinstance(catastrophe, list) and len(catastrophe) > 0:
+            summaryDict['analysis']['catastrophe'] = numpy.array(catastrophe).min()
+        elif isinstance(catastrophe, list):
+            summaryDict['analysis']['catastrophe'] = { 'error': 'setup failed' }
+        else:
+            summaryDict['analysis']['catastrophe'] = catastrophe
 
     # add in lariat data
     if lariatcache != None:
@@ -810,21 +1184,20 @@ def summarize(j, lariatcache):
     summaryDict['summary_version'] = SUMMARY_VERSION
     summaryDict['created'] = datetime.datetime.utcnow()
 
-    uniq = str( j.acct['local_jobid'] if 'local_jobid' in j.acct else j.acct['id'])
-    if 'cluster' in j.acct:
-        uniq += "-" + j.acct['cluster']
-    if 'job_array_index' in j.acct:
-        uniq += "-" + j.acct['job_array_index']
-    uniq += "-" + str(j.acct['end_time'])
+    uniq = summaryid(j.acct)
 
     summaryDict['_id'] = uniq
 
+    if streaming:
+        # Errors found while the hosts were loaded
+        summaryDict['Error'].extend(e for e in j.errors if e not in summaryDict['Error'])
+
     if len(summaryDict['Error']) == 0:
         del summaryDict['Error']
 
     # Process procDump information from the tacc_stats file itself
-    taccproc = TaccProcDump()
-    pl = taccproc.getproclist(j, int(j.acct['uid']) if 'uid' in j.acct and (isinstance(j.acct['uid'], (int, long)) or j.acct['uid'].isdigit()) else None)
+    if not streaming and wantprocdump:
+        pl = taccproc.getproclist(j, uid)
 
     if len(pl) > 0:
         summaryDict['procDump'] = pl
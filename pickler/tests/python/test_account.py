@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+""" Unit tests for the accounting database reader and logger. The MySQL connection is
+    replaced with an in-memory sqlite database. """
+import json
+import os
+import sqlite3
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+try:
+    import MySQLdb
+except ImportError:
+    # connect() is replaced in the tests, so account only needs the names
+    # that it uses
+    MySQLdb = types.ModuleType('MySQLdb')
+    MySQLdb.connect = None
+    MySQLdb.IntegrityError = type('IntegrityError', (Exception,), {})
+    sys.modules['MySQLdb'] = MySQLdb
+
+import account
+
+class Cursor(object):
+    """ MySQLdb style cursor on a sqlite connection """
+    def __init__(self, con):
+        self.con = con
+        self.cur = con.db.cursor()
+        con.open += 1
+
+    def execute(self, query, data=()):
+        self.con.queries.append(query)
+        self.cur.execute(query.replace("%%", "%").replace("%s", "?"), data)
+
+    def executemany(self, query, data):
+        self.con.queries.append(query)
+        self.cur.executemany(query.replace("%%", "%").replace("%s", "?"), data)
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def __iter__(self):
+        return iter(self.cur)
+
+    def close(self):
+        self.con.open -= 1
+
+class Connection(object):
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.create_function("UNCOMPRESS", 1, lambda x: x)
+        self.db.execute("CREATE TABLE acct (resource_id INT, local_job_id INT, job_array_index INT, end_time_ts INT, record TEXT, process_version INT, summary_version TEXT)")
+        self.open = 0
+        self.queries = []
+        self.commits = 0
+
+    def cursor(self, cursorclass=None):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self.db.commit()
+
+def addjobs(con, jobs):
+    for jobid, index, end_time in jobs:
+        record = {'id': str(jobid), 'local_jobid': jobid, 'job_array_index': index, 'end_time': end_time}
+        con.db.execute("INSERT INTO acct VALUES (1, ?, ?, ?, ?, 0, '')", (jobid, index, end_time, json.dumps(record)))
+
+class DbAcctTest(unittest.TestCase):
+
+    def setUp(self):
+        self.con = Connection()
+        self.connect = getattr(account.mdb, 'connect', None)
+        account.mdb.connect = lambda **kwargs: self.con
+
+    def tearDown(self):
+        account.mdb.connect = self.connect
+
+    def test_pages(self):
+        jobs = [ (jobid, index, 100 + jobid // 3) for jobid in range(10) for index in (-1, 2) ]
+        addjobs(self.con, jobs)
+        dbconf = {'dbname': 'x', 'defaultsfile': 'x', 'tablename': 'acct', 'stream_page_size': 3}
+        reader = account.DbAcct(1, dbconf, 4)
+
+        seen = []
+        for record in reader.pagereader(" WHERE resource_id = %s AND process_version != %s ", (1, 4)):
+            # No query is open while the records are handed out
+            self.assertEqual(self.con.open, 0)
+            seen.append((record['local_jobid'], record['job_array_index'], record['end_time']))
+            # Jobs logged as processed meanwhile do not shift the pages
+            self.con.db.execute("UPDATE acct SET process_version = 4 WHERE local_job_id = ? AND job_array_index = ?", (record["local_jobid"], record["job_array_index"]))
+        self.assertEqual(seen, sorted(jobs, key=lambda job: (job[2], job[0], job[1])))
+        self.assertEqual(len(self.con.queries), 7)
+
+    def test_reader(self):
+        addjobs(self.con, [ (jobid, -1, 200 - jobid) for jobid in range(5) ])
+        dbconf = {'dbname': 'x', 'defaultsfile': 'x', 'tablename': 'acct', 'stream_page_size': 2}
+        reader = account.DbAcct(1, dbconf, 4)
+        self.assertEqual([ r['id'] for r in reader.reader(end_time=199) ], ['4', '3', '2'])
+
+class DbLoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.con = Connection()
+        self.connect = getattr(account.mdb, 'connect', None)
+        account.mdb.connect = lambda **kwargs: self.con
+        addjobs(self.con, [ (jobid, -1, 100) for jobid in range(5) ])
+
+    def tearDown(self):
+        account.mdb.connect = self.connect
+
+    def versions(self):
+        return [ row[0] for row in self.con.db.execute("SELECT process_version FROM acct ORDER BY local_job_id") ]
+
+    def test_batch(self):
+        logger = account.DbLogger('x', 'acct', 'x', batchsize=3, batchseconds=3600)
+        logger.logprocessed({'id': '0', 'end_time': 100}, 1, 4)
+        logger.logprocessed({'id': '1', 'end_time': 100}, 1, -1001)
+        self.assertEqual(self.versions(), [0, 0, 0, 0, 0])
+        logger.logprocessed({'id': '2', 'end_time': 100}, 1, 4)
+        self.assertEqual(self.versions(), [4, -1001, 4, 0, 0])
+        self.assertEqual(self.con.commits, 1)
+        # Only equality predicates, which every MySQL version uses the index for
+        self.assertEqual(len(self.con.queries), 1)
+        self.assertNotIn(" IN ", self.con.queries[0])
+
+        # The last version logged for a job is kept
+        logger.logprocessed({'id': '3', 'end_time': 100}, 1, -1001)
+        logger.logprocessed({'id': '3', 'end_time': 100}, 1, 4)
+        logger.flush()
+        self.assertEqual(self.versions(), [4, -1001, 4, 4, 0])
+        self.assertEqual(self.con.commits, 2)
+        logger.flush()
+        self.assertEqual(self.con.commits, 2)
+
+    def test_age(self):
+        logger = account.DbLogger('x', 'acct', 'x', batchsize=100, batchseconds=10)
+        now = [1000.0]
+        clock = account.time.time
+        account.time.time = lambda: now[0]
+        try:
+            logger.logprocessed({'id': '0', 'end_time': 100}, 1, 4)
+            now[0] += 5
+            logger.logprocessed({'id': '1', 'end_time': 100}, 1, 4)
+            self.assertEqual(self.con.commits, 0)
+            # Written once the oldest pending job has waited batchseconds
+            now[0] += 5
+            logger.logprocessed({'id': '2', 'end_time': 100}, 1, 4)
+            self.assertEqual(self.versions(), [4, 4, 4, 0, 0])
+            self.assertEqual(self.con.commits, 1)
+        finally:
+            account.time.time = clock
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+""" Unit tests for the cache of parsed archive files """
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import archivecache
+import job_stats
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+ARCHIVE = os.path.join(DATA, 'archive')
+
+ACCT = {'id': '1835740', 'uid': '809035', 'start_time': 1380663063, 'end_time': 1380671326,
+        'queue_time': 1380663063, 'nodes': 14, 'cores': 224, 'status': 'COMPLETED', 'queue': 'normal'}
+
+class BatchAcct(object):
+    name_ext = '.platform.extension'
+
+def archive_paths():
+    return sorted(glob.glob(os.path.join(ARCHIVE, '*', '*.gz')))
+
+def job_stats_of(job):
+    """ The processed stats of the hosts of job as plain data """
+    return dict((host_name, dict((type_name, dict(type_stats.iteritems())) for type_name, type_stats in host.stats.iteritems()))
+                for host_name, host in job.hosts.iteritems())
+
+class ArchiveCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertArchiveEqual(self, a, b):
+        for name in ('path', 'header', 'events', 'malformed', 'keys', 'error'):
+            self.assertEqual(getattr(a, name), getattr(b, name), name)
+        self.assertEqual(len(a.values), len(b.values))
+        for x, y in zip(a.values + a.blocks, b.values + b.blocks):
+            self.assertEqual(x.dtype, y.dtype)
+            self.assertTrue(numpy.array_equal(x, y))
+
+    def assertStatsEqual(self, a, b):
+        self.assertEqual(sorted(a.keys()), sorted(b.keys()))
+        for host_name, host_stats in a.iteritems():
+            self.assertEqual(sorted(host_stats.keys()), sorted(b[host_name].keys()))
+            for type_name, type_stats in host_stats.iteritems():
+                self.assertEqual(sorted(type_stats.keys()), sorted(b[host_name][type_name].keys()))
+                for dev_name, devstats in type_stats.iteritems():
+                    self.assertTrue(numpy.array_equal(devstats, b[host_name][type_name][dev_name]))
+
+class CacheFileTest(ArchiveCacheTestCase):
+
+    def test_round_trip(self):
+        for path in archive_paths():
+            archive = archivecache.parse_archive(path)
+            self.assertTrue(archive.keys)
+            filename = archivecache.cache_path(self.tmpdir, path)
+            archivecache.write_cache(filename, archive, os.stat(path))
+            self.assertArchiveEqual(archivecache.read_cache(filename, path, os.stat(path)), archive)
+
+    def test_stale(self):
+        path = os.path.join(self.tmpdir, 'c414-901', os.path.basename(archive_paths()[0]))
+        os.mkdir(os.path.dirname(path))
+        shutil.copy(archive_paths()[0], path)
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        archive = archivecache.load(cachedir, path)
+        filename = archivecache.cache_path(cachedir, path)
+        self.assertTrue(os.path.exists(filename))
+        self.assertArchiveEqual(archivecache.read_cache(filename, path, os.stat(path)), archive)
+
+        # The cache file is not used once the archive file has changed
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(archivecache.read_cache(filename, path, os.stat(path)), None)
+        self.assertArchiveEqual(archivecache.load(cachedir, path), archive)
+        self.assertTrue(archivecache.read_cache(filename, path, os.stat(path)) is not None)
+
+        # Nor if it cannot be read
+        with open(filename, 'w') as fp:
+            fp.write('garbage')
+        self.assertArchiveEqual(archivecache.load(cachedir, path), archive)
+        self.assertTrue(archivecache.read_cache(filename, path, os.stat(path)) is not None)
+
+    def test_job(self):
+        hosts = sorted(name.split('.')[0] for name in os.listdir(ARCHIVE))
+        acct = dict(ACCT, host_list=hosts)
+        expected = job_stats_of(job_stats.from_acct(acct, DATA, DATA, BatchAcct()))
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        # Once to fill the cache and once to read from it
+        for _ in range(2):
+            self.assertStatsEqual(job_stats_of(job_stats.from_acct(acct, DATA, DATA, BatchAcct(), cachedir)), expected)
+        self.assertEqual(len(glob.glob(os.path.join(cachedir, '*', '*.npz'))), len(archive_paths()))
+
+class ArchiveSetTest(ArchiveCacheTestCase):
+
+    def test_refs(self):
+        path, other = archive_paths()[:2]
+        archives = archivecache.ArchiveSet()
+        archives.addref(path)
+        archives.addref(path)
+        archive = archives.get(path)
+        self.assertTrue(archives.get(path) is archive)
+        # Files that are not referenced are not kept
+        archives.get(other)
+        self.assertEqual(archives.archives.keys(), [path])
+        archives.release(path)
+        self.assertTrue(archives.get(path) is archive)
+        archives.release(path)
+        self.assertEqual(archives.archives, {})
+        self.assertEqual(archives.refs, {})
+
+    def test_preload(self):
+        paths = archive_paths()
+        archives = archivecache.ArchiveSet(os.path.join(self.tmpdir, 'cache'))
+        for path in paths[1:]:
+            archives.addref(path)
+        pool = job_stats.create_gather_pool(2)
+        try:
+            archives.preload(paths + [os.path.join(self.tmpdir, 'missing.gz')], pool)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(sorted(archives.archives.keys()), paths[1:])
+        for path in paths[1:]:
+            self.assertArchiveEqual(archives.archives[path], archivecache.parse_archive(path))
+
+    def test_batch(self):
+        # The same hosts in overlapping windows share the archive files
+        hosts = sorted(name.split('.')[0] for name in os.listdir(ARCHIVE))
+        accts = [ dict(ACCT, host_list=hosts), dict(ACCT, id='1835741', host_list=hosts[1:], end_time=ACCT['end_time'] - 3600) ]
+        expected = [ job_stats_of(job_stats.from_acct(acct, DATA, DATA, BatchAcct())) for acct in accts ]
+        pool = job_stats.create_gather_pool(2)
+        try:
+            for cachedir, gather_pool in ((None, None), (os.path.join(self.tmpdir, 'cache'), pool)):
+                jobs = list(job_stats.from_accts(iter(accts), DATA, DATA, BatchAcct(), cachedir, 2, gather_pool=gather_pool))
+                self.assertEqual([ job.id for job in jobs ], ['1835740', '1835741'])
+                for job, stats in zip(jobs, expected):
+                    self.assertStatsEqual(job_stats_of(job), stats)
+        finally:
+            pool.close()
+            pool.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+""" Unit tests for the archive file lookup from the archive index """
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import job_stats
+try:
+    import archiveindex
+except ImportError:
+    archiveindex = None
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+ARCHIVE = os.path.join(DATA, 'archive')
+
+ACCT = {'id': '1835740', 'start_time': 1380630000, 'end_time': 1380640000}
+
+class StaticIndex(object):
+    """ Archive index with a fixed list of files per host """
+    def __init__(self, paths):
+        self.paths = paths
+        self.lookups = []
+
+    def get_stats_paths(self, hostname, start, end, max_duration):
+        self.lookups.append(hostname)
+        return self.paths.get(hostname, [])
+
+class BatchAcct(object):
+    name_ext = '.platform.extension'
+
+def stats_paths(archive_index, hostname='c414-901'):
+    job = job_stats.Job(ACCT, DATA, DATA, None, archive_index=archive_index)
+    return job_stats.Host(job, hostname, ARCHIVE, '.platform.extension').get_stats_paths()
+
+class HostNameTest(unittest.TestCase):
+
+    def test_archive_host_name(self):
+        self.assertEqual(job_stats.archive_host_name('c414-901', '.platform.extension'), 'c414-901.platform.extension')
+        self.assertEqual(job_stats.archive_host_name('c414-901.stampede.tacc.utexas.edu', 'platform.extension'), 'c414-901.platform.extension')
+        self.assertEqual(job_stats.archive_host_name('c414-901.platform.extension', 'platform.extension'), 'c414-901.platform.extension')
+        self.assertEqual(job_stats.archive_host_name('c414-901.stampede.tacc.utexas.edu', ''), 'c414-901')
+
+class GetStatsPathsTest(unittest.TestCase):
+
+    def test_listdir(self):
+        expected = [ (os.path.join(ARCHIVE, 'c414-901.platform.extension', '1380603606.gz'), 1380603606) ]
+        self.assertEqual(stats_paths(None), expected)
+
+    def test_index(self):
+        index = StaticIndex({'c414-901.platform.extension': [('/elsewhere/1380603606.gz', 1380603606)]})
+        self.assertEqual(stats_paths(index), [('/elsewhere/1380603606.gz', 1380603606)])
+        self.assertEqual(index.lookups, ['c414-901.platform.extension'])
+
+    def test_missing_from_index(self):
+        # The directory is listed if the index has nothing for the host
+        self.assertEqual(stats_paths(StaticIndex({})), stats_paths(None))
+
+class FromAcctsTest(unittest.TestCase):
+
+    def test_single_lookup(self):
+        # Each host's archive files are looked up once per job, also when the
+        # jobs are batched or the hosts gathered in parallel
+        hosts = sorted(name.split('.')[0] for name in os.listdir(ARCHIVE))
+        paths = dict((job_stats.archive_host_name(name, 'platform.extension'), stats_paths(None, name)) for name in hosts)
+        accts = [ dict(ACCT, id=str(i), host_list=hosts) for i in range(3) ]
+        for batch_size, workers in ((1, 1), (3, 1), (3, 2)):
+            index = StaticIndex(paths)
+            minhosts = job_stats.PARALLEL_GATHER_MIN_HOSTS
+            job_stats.PARALLEL_GATHER_MIN_HOSTS = 1
+            pool = job_stats.create_gather_pool(workers)
+            try:
+                jobs = list(job_stats.from_accts(accts, DATA, DATA, BatchAcct(), batch_size=batch_size,
+                                                 archive_index=index, gather_pool=pool))
+            finally:
+                job_stats.PARALLEL_GATHER_MIN_HOSTS = minhosts
+                if pool != None:
+                    pool.terminate()
+                    pool.join()
+            self.assertEqual([ sorted(job.hosts.keys()) for job in jobs ], [hosts] * 3)
+            self.assertEqual(sorted(index.lookups), sorted(paths.keys() * 3))
+
+@unittest.skipIf(archiveindex is None, "MySQLdb is not installed")
+class SqliteArchiveIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'index.sqlite')
+        con = sqlite3.connect(self.filename)
+        for statement in archiveindex.SQLITE_SCHEMA:
+            con.execute(statement)
+        rows = [ (1, 'c414-901.platform.extension', '/a/%d.gz' % start, start, start + 86400) for start in (0, 86400, 2 * 86400) ]
+        rows.append((2, 'c414-901.platform.extension', '/b/0.gz', 0, 86400))
+        con.executemany("INSERT INTO archive VALUES (?, ?, ?, ?, ?)", rows)
+        con.commit()
+        con.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_overlap(self):
+        index = archiveindex.SqliteArchiveIndex(1, self.filename)
+        self.assertEqual(index.get_stats_paths('c414-901.platform.extension', 90000, 100000, 86400),
+                         [('/a/86400.gz', 86400)])
+        # A file may hold records past its indexed end time
+        self.assertEqual(index.get_stats_paths('c414-901.platform.extension', 90000, 100000, 2 * 86400),
+                         [('/a/0.gz', 0), ('/a/86400.gz', 86400)])
+        self.assertEqual(index.get_stats_paths('c414-901.platform.extension', 86400 * 5, 86400 * 6, 86400), [])
+        self.assertEqual(index.get_stats_paths('c427-001.platform.extension', 0, 86400, 86400), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+""" Unit tests for blockparser and the block reader of job_stats.Host """
+import gzip
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import blockparser
+import job_stats
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+HEADER = """$tacc_stats 2.3
+$hostname h
+!cpu user,E nice,E idle,E
+!mem used free
+!proc vm rss
+
+"""
+
+# Records with the cases that have to go through the line parser
+RECORDS = """100 1
+cpu 0 1 2 3
+cpu 1 4 5 6
+mem - 7 8
+110 1
+cpu 0 11 12 13
+cpu 1 14 15 16
+mem - 17 18
+120 1
+cpu 0 21 22 23
+cpu 1 24 25 26
+cpu 2 27 28 29
+mem - 27 28
+130 1
+cpu 0 31 32
+cpu 1 34 35 36
+mem - 37 38
+140 1
+cpu 0 41  42 43
+cpu 1 44 45 46 47
+mem - 47 48
+150 1
+cpu 0 51\t52 53
+cpu 1 54 55
+mem - 57 58
+160 1
+cpu 0 61 62 63
+gone 0 1 2
+mem - 67 68
+170 1
+  cpu 0 71 72 73
+cpu 1 74 75 76
+mem - 77 78
+180 1
+cpu 0 81 82 83
+cpu 0 84 85 86
+mem - 87 88
+190 1
+cpu 0 91 92 93\r
+cpu 1 94 95 96
+mem - 97 98
+200 1
+%end 2
+cpu 0 101 102 103
+210 1
+cpu 0 111 x 113
+cpu 1 114 115 116
+mem - 117 118
+220 1
+%begin 1
+cpu 0 121 122 123
+cpu 1 124 125 126
+mem - 127 128
+230 1
+cpu 0 131 132 133
+proc a 64 65
+proc b c 66 67
+
+mem - 137 138
+cpu 1 134 135 136
+240 1
+cpu 0 141 142 143
+cpu 1 144 145 146
+mem - 147 148"""
+
+class BlockParserTest(unittest.TestCase):
+
+    def setUp(self):
+        job = job_stats.Job({'id': '1', 'start_time': 0, 'end_time': 1000}, '', '', None)
+        self.schemas = dict((type_name, job.get_schema(type_name, desc)) for type_name, desc in
+                            [('cpu', 'user,E nice,E idle,E'), ('mem', 'used free'), ('proc', 'vm rss')])
+        self.parser = blockparser.BlockParser(self.schemas)
+
+    def test_parse(self):
+        layout, values = self.parser.parse(['cpu 0 1 2 3', 'cpu 1 4 5 6', 'mem - 7 8'])
+        self.assertEqual(layout.devices, [('cpu', '0', 0, 3), ('cpu', '1', 3, 3), ('mem', '-', 6, 2)])
+        self.assertEqual(values.dtype, numpy.uint64)
+        self.assertEqual(values.tolist(), [1, 2, 3, 4, 5, 6, 7, 8])
+
+    def test_layout_cached(self):
+        layout, _ = self.parser.parse(['cpu 0 1 2 3', 'mem - 7 8'])
+        again, values = self.parser.parse(['cpu 0 11 12 13', 'mem - 17 18'])
+        self.assertIs(layout, again)
+        self.assertEqual(values.tolist(), [11, 12, 13, 17, 18])
+
+    def test_large_values(self):
+        _, values = self.parser.parse(['mem - 18446744073709551615 9007199254740993'])
+        self.assertEqual(values.tolist(), [2**64 - 1, 2**53 + 1])
+
+    def test_rejected(self):
+        for lines in [['cpu 0 1 2'],
+                      ['cpu 0 1 2 3 4'],
+                      ['cpu 0 1  2 3', 'mem - 7 8'],
+                      ['cpu 0 1 2 3 ', 'mem - 7'],
+                      ['cpu 0 1\t2 3', 'mem - 7'],
+                      ['cpu 0 1 2 3\r'],
+                      ['cpu 0 1 x 3'],
+                      ['cpu 0 -1 2 3'],
+                      ['cpu 0 1 2 3', 'cpu 0 4 5 6'],
+                      ['cpu  0 1 2 3'],
+                      ['gone 0 1 2'],
+                      ['proc a 1 2'],
+                      ['mem'],
+                      ['mem -']]:
+            self.assertIsNone(self.parser.parse(lines), lines)
+
+class ReadStatsTest(unittest.TestCase):
+    """ The block reader has to give the same results as the line reader """
+
+    def setUp(self):
+        self.blockparse = job_stats.USE_BLOCK_PARSER
+        self.readsize = job_stats.BLOCK_READ_SIZE
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        job_stats.USE_BLOCK_PARSER = self.blockparse
+        job_stats.BLOCK_READ_SIZE = self.readsize
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, path, acct, blockparse, readsize=1 << 20, times_only=False):
+        job_stats.USE_BLOCK_PARSER = blockparse
+        job_stats.BLOCK_READ_SIZE = readsize
+        job = job_stats.Job(acct, '', '', None)
+        host = job_stats.Host(job, 'h', '', '')
+        host.times_only = times_only
+        with gzip.open(path) as fp:
+            host.read_stats_file(io.BufferedReader(fp))
+        return host
+
+    def assertSameHost(self, expected, host):
+        self.assertEqual(expected.job.errors, host.job.errors)
+        self.assertEqual(expected.times, host.times)
+        self.assertEqual(expected.marks, host.marks)
+        self.assertEqual(expected.rotatetimes, host.rotatetimes)
+        self.assertEqual(expected.state, host.state)
+        self.assertEqual(expected.fileline, host.fileline)
+        self.assertEqual(sorted(expected.raw_stats), sorted(host.raw_stats))
+        for type_name, type_stats in expected.raw_stats.iteritems():
+            self.assertEqual(sorted(type_stats), sorted(host.raw_stats[type_name]))
+            for dev_name, dev_stats in type_stats.iteritems():
+                dev = host.raw_stats[type_name][dev_name]
+                self.assertTrue(numpy.array_equal(dev_stats.gettimes(), dev.gettimes()),
+                                (type_name, dev_name))
+                self.assertTrue(numpy.array_equal(dev_stats.getvalues(), dev.getvalues()), (type_name, dev_name))
+
+    def write(self, text):
+        path = os.path.join(self.tmpdir, 'stats.gz')
+        with gzip.open(path, 'wb') as fp:
+            fp.write(text)
+        return path
+
+    def test_archives(self):
+        acct = {'id': '1835740', 'start_time': 1380663063, 'end_time': 1380671326}
+        archive = os.path.join(DATA, 'archive')
+        for hostdir in sorted(os.listdir(archive)):
+            for name in sorted(os.listdir(os.path.join(archive, hostdir))):
+                if not name.endswith('.gz'):
+                    continue
+                path = os.path.join(archive, hostdir, name)
+                expected = self.read(path, acct, False)
+                self.assertTrue(expected.raw_stats)
+                for readsize in (4096, 1 << 20):
+                    self.assertSameHost(expected, self.read(path, acct, True, readsize))
+
+    def test_edge_cases(self):
+        acct = {'id': '1', 'start_time': 0, 'end_time': 1000}
+        for text in (HEADER + RECORDS, HEADER + RECORDS + '\n', HEADER + RECORDS.replace('\n', '\r\n')):
+            path = self.write(text)
+            expected = self.read(path, acct, False)
+            self.assertTrue(expected.job.errors)
+            self.assertIn('proc', expected.raw_stats)
+            for readsize in (1, 7, 64, 1 << 20):
+                self.assertSameHost(expected, self.read(path, acct, True, readsize))
+
+    def test_times_only(self):
+        acct = {'id': '1', 'start_time': 0, 'end_time': 1000}
+        path = self.write(HEADER + RECORDS)
+        expected = self.read(path, acct, False, times_only=True)
+        self.assertTrue(expected.has_stats)
+        self.assertEqual(expected.raw_stats, {})
+        for readsize in (7, 1 << 20):
+            host = self.read(path, acct, True, readsize, times_only=True)
+            self.assertTrue(host.has_stats)
+            self.assertSameHost(expected, host)
+
+    def test_done(self):
+        acct = {'id': '1', 'start_time': 0, 'end_time': 1000}
+        path = self.write(HEADER + RECORDS.replace('150 1\n', '150 1\n%end 1\n'))
+        expected = self.read(path, acct, False)
+        self.assertEqual(expected.state, job_stats.DONE)
+        for readsize in (7, 1 << 20):
+            self.assertSameHost(expected, self.read(path, acct, True, readsize))
+
+if __name__ == '__main__':
+    unittest.main()
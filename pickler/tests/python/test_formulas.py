@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+""" Unit tests for the compiled timeseries formulas """
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import formulas
+import summarize
+from formulas import MEGA, GIGA
+from timeseriessummary import TimeSeriesSummary
+
+def reference(expression, a, delta_t):
+    """ The per-row evaluation of the original implementation """
+    return eval(expression)
+
+class Job(object):
+    times = []
+
+class FormulaTest(unittest.TestCase):
+
+    def check(self, expression, ninterfaces, delta_t=None):
+        """ Compare the formula evaluated for many rows at once with the
+            formula evaluated for each row on its own """
+        rng = numpy.random.RandomState(1)
+        a = [ numpy.cumsum(rng.randint(1, 2**20, (4, 10)), axis=1).astype(numpy.float64) for _ in range(ninterfaces) ]
+        values = formulas.evaluate(expression, a, delta_t)
+        self.assertEqual(values.shape[0], 4, expression)
+        for row in range(4):
+            expected = reference(expression, [ x[row] for x in a ], delta_t)
+            self.assertTrue(numpy.allclose(values[row], expected, rtol=1e-15, atol=0), expression)
+
+    def test_compiled_once(self):
+        expression = "numpy.diff(a[0]) / delta_t"
+        self.assertTrue(formulas.compile_formula(expression) is formulas.compile_formula(expression))
+
+    def test_timeseries_formulas(self):
+        delta_t = numpy.random.RandomState(2).uniform(500, 700, 9)
+        for setlist in TimeSeriesSummary(False).metrics.itervalues():
+            for settings in setlist:
+                self.check(settings['formula'], len(settings['interfaces']), delta_t)
+
+    def test_timedata_formulas(self):
+        timedata = summarize.TimeData(Job(), {}, [], {})
+        for metrics in (timedata.derived, timedata.computed):
+            for formulalist in metrics.itervalues():
+                for formula in formulalist.itervalues():
+                    self.check(formula[0], len(formula) - 1)
+
+    def test_constants(self):
+        self.assertEqual(formulas.evaluate("a[0] / MEGA + a[1] / GIGA", [2.0 * MEGA, 4.0 * GIGA]), 6.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Unit tests for the gzipped archive record index """
+import gzip
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import gzindex
+
+ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'archive',
+                       'c414-901.platform.extension', '1380603606.gz')
+
+class GzIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.chunksize = gzindex.BUILD_CHUNK_SIZE
+        self.indexdir = gzindex.INDEX_DIR
+        gzindex.INDEX_DIR = os.path.join(self.tmpdir, 'index')
+
+    def tearDown(self):
+        gzindex.BUILD_CHUNK_SIZE = self.chunksize
+        gzindex.INDEX_DIR = self.indexdir
+        shutil.rmtree(self.tmpdir)
+
+    def test_records(self):
+        with gzip.open(ARCHIVE) as fp:
+            lines = fp.readlines()
+        index = gzindex.build_index(ARCHIVE)
+        self.assertTrue(len(index.timestamps) > 0)
+        data = "".join(lines)
+        for timestamp, offset, fileline in zip(index.timestamps, index.offsets, index.filelines):
+            self.assertEqual(data.count("\n", 0, offset), fileline)
+            self.assertEqual(float(lines[fileline].split()[0]), timestamp)
+
+    def test_chunk_size(self):
+        expected = gzindex.build_index(ARCHIVE)
+        for size in (100, 4096):
+            gzindex.BUILD_CHUNK_SIZE = size
+            index = gzindex.build_index(ARCHIVE)
+            self.assertTrue(numpy.array_equal(index.timestamps, expected.timestamps))
+            self.assertTrue(numpy.array_equal(index.offsets, expected.offsets))
+            self.assertTrue(numpy.array_equal(index.filelines, expected.filelines))
+            self.assertEqual(index.jobs, expected.jobs)
+
+    def test_seek_point(self):
+        index = gzindex.build_index(ARCHIVE)
+        self.assertEqual(index.seek_point(index.timestamps[0] - 1, "0"), None)
+        self.assertEqual(index.seek_point(index.timestamps[3] + 1, "0"),
+                         (int(index.offsets[3]), int(index.filelines[3])))
+
+    def test_sidecar(self):
+        archive = os.path.join(self.tmpdir, 'archive.gz')
+        shutil.copy(ARCHIVE, archive)
+        os.chmod(archive, 0644)
+
+        index = gzindex.get_index(archive)
+        sidecar = gzindex.index_path(archive)
+        self.assertTrue(sidecar.startswith(gzindex.INDEX_DIR))
+        self.assertFalse(os.path.exists(archive + ".idx"))
+        self.assertEqual(stat.S_IMODE(os.stat(sidecar).st_mode), 0644)
+        self.assertEqual(os.listdir(os.path.dirname(sidecar)), [os.path.basename(sidecar)])
+
+        cached = gzindex.read_index(archive, os.stat(archive))
+        self.assertTrue(numpy.array_equal(cached.offsets, index.offsets))
+        self.assertEqual(cached.jobs, index.jobs)
+
+        # A changed archive makes the sidecar stale
+        with open(archive, "ab") as fp:
+            fp.write("\0")
+        self.assertEqual(gzindex.read_index(archive, os.stat(archive)), None)
+
+    def test_no_index_dir(self):
+        # Without INDEX_DIR the sidecar is only read unless it is created
+        # explicitly, as indexarchives.py does
+        gzindex.INDEX_DIR = None
+        archive = os.path.join(self.tmpdir, 'archive.gz')
+        shutil.copy(ARCHIVE, archive)
+
+        self.assertEqual(gzindex.get_index(archive), None)
+        self.assertFalse(os.path.exists(archive + ".idx"))
+
+        index = gzindex.get_index(archive, create=True)
+        self.assertTrue(os.path.exists(archive + ".idx"))
+        cached = gzindex.get_index(archive)
+        self.assertTrue(numpy.array_equal(cached.offsets, index.offsets))
+
+    def test_write_failure(self):
+        archive = os.path.join(self.tmpdir, 'archive.gz')
+        shutil.copy(ARCHIVE, archive)
+        index = gzindex.build_index(ARCHIVE)
+        index.jobs = None
+        os.makedirs(os.path.dirname(gzindex.index_path(archive)))
+        with self.assertRaises(Exception):
+            gzindex.write_index(archive, index, os.stat(archive))
+        self.assertEqual(os.listdir(os.path.dirname(gzindex.index_path(archive))), [])
+
+if __name__ == '__main__':
+    unittest.main()
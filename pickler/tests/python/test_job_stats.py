@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+""" Unit tests for job_stats """
+import cPickle as pickle
+import os
+import random
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import job_stats
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+ACCT = {'id': '1835740', 'uid': '809035', 'start_time': 1380663063, 'end_time': 1380671326,
+        'queue_time': 1380663063, 'nodes': 14, 'cores': 224, 'status': 'COMPLETED', 'queue': 'normal'}
+
+class BatchAcct(object):
+    name_ext = '.platform.extension'
+
+def reference_overflow(v, p, width):
+    """ The per-sample overflow test of the original implementation """
+    v = numpy.uint64(v)
+    p = numpy.uint64(p)
+    return ( v - p ) % (2**width) > 2**(width-1)
+
+def rebase(type_name, desc, samples, dev_name='0'):
+    """ Run process_dev_stats on the list of (time, values) samples and
+        return the job and the rebased array """
+    job = job_stats.Job({'id': '1', 'start_time': 0, 'end_time': 1000}, '', '', None)
+    schema = job.get_schema(type_name, desc)
+    job.times = numpy.array([t for t, _ in samples], dtype=numpy.float64)
+    host = job_stats.Host(job, 'h', '', '')
+    host.rotatetimes = []
+    host.tacc_version = '2.3'
+    raw = job_stats.RawDevStats(len(schema), 2)
+    for t, values in samples:
+        raw.append(t, numpy.array(values, dtype=numpy.uint64))
+    alignment = job.align_dev_stats(host, type_name, raw)
+    return job, job.process_dev_stats(host, type_name, schema, dev_name, raw, alignment)
+
+def load_job(**kwargs):
+    """ The test job processed from the test data """
+    hosts = sorted(name.split('.')[0] for name in os.listdir(os.path.join(DATA, 'archive')))
+    return job_stats.from_acct(dict(ACCT, host_list=hosts), DATA, DATA, BatchAcct(), **kwargs)
+
+class RolledOverHalfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olderr = numpy.seterr(all='ignore')
+
+    def tearDown(self):
+        numpy.seterr(**self.olderr)
+
+    def test_matches_reference(self):
+        rng = random.Random(0)
+        widths = [32, 48, 62, 63, 64]
+        interesting = [0, 1, 3, 2**31, 2**32 - 1, 2**47, 2**48 - 3, 2**62, 2**63, 2**64 - 3, 2**64 - 1]
+        for _ in range(200):
+            rows = 8
+            v = numpy.array([[rng.choice(interesting + [rng.randint(0, 2**64 - 1)]) for _ in widths] for _ in range(rows)], dtype=numpy.uint64)
+            p = numpy.array([[rng.choice(interesting + [rng.randint(0, 2**64 - 1)]) for _ in widths] for _ in range(rows)], dtype=numpy.uint64)
+            result = job_stats.rolled_over_half(v - p, numpy.array(widths, dtype=numpy.uint64))
+            for i in range(rows):
+                for c, width in enumerate(widths):
+                    self.assertEqual(result[i, c], reference_overflow(v[i, c], p[i, c], width),
+                                     "v %d p %d width %d" % (v[i, c], p[i, c], width))
+
+    def test_float_rounding(self):
+        # 0 - 3 rounds to 2**64 in float64, so a 48 bit counter that goes
+        # from 3 to 0 is not counted as rolling more than half its range
+        diff = numpy.array([[0]], dtype=numpy.uint64) - numpy.uint64(3)
+        self.assertFalse(job_stats.rolled_over_half(diff, numpy.array([48], dtype=numpy.uint64))[0, 0])
+        self.assertTrue(job_stats.rolled_over_half(diff, numpy.array([63], dtype=numpy.uint64))[0, 0])
+        self.assertTrue(job_stats.rolled_over_half(diff, numpy.array([64], dtype=numpy.uint64))[0, 0])
+
+class RebaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olderr = numpy.seterr(all='ignore')
+        self.keep_edits = job_stats.KEEP_EDITS
+
+    def tearDown(self):
+        numpy.seterr(**self.olderr)
+        job_stats.KEEP_EDITS = self.keep_edits
+
+    def test_rollover(self):
+        job, A = rebase('intel_snb', 'CTR0,E,W=48', [(0.0, [2**48 - 10]), (600.0, [5]), (1200.0, [25])])
+        self.assertEqual(list(A[:, 0]), [0, 15, 35])
+        self.assertEqual(job.overflows, {})
+
+    def test_small_rollover_not_logged(self):
+        job, A = rebase('intel_snb', 'CTR0,E,W=48', [(0.0, [3]), (600.0, [0])])
+        self.assertEqual(job.overflows, {})
+
+    def test_overflow_logged(self):
+        job, A = rebase('intel_snb', 'CTR0,E,W=32', [(0.0, [2**31 - 8192]), (600.0, [0])])
+        self.assertEqual(job.overflows, {'intel_snb': {'0': {'CTR0': set(['h'])}}})
+
+    def test_edit_flags_order(self):
+        job_stats.KEEP_EDITS = True
+        job, A = rebase('ib_sw', 'rx,E tx,E', [(0.0, [10, 10]), (600.0, [5, 20]), (1200.0, [6, 7]), (1800.0, [2, 8])])
+        self.assertEqual(list(A[:, 0]), [0, 5, 6, 8])
+        self.assertEqual(list(A[:, 1]), [0, 10, 17, 18])
+        keys = [ (flag.split("key `")[1][:2], flag.split("time ")[1].split(",")[0]) for flag in job.edit_flags ]
+        self.assertEqual(keys, [('rx', '600'), ('rx', '1800'), ('tx', '1200')])
+
+class TotalsTest(unittest.TestCase):
+
+    def test_totals(self):
+        job = load_job()
+        for host in job.hosts.itervalues():
+            for type_name, type_stats in host.stats.iteritems():
+                if len(type_stats) == 0:
+                    continue
+                totals, alltotals = host.get_totals(type_name)
+                # The device by device sums of the original implementation
+                expected = None
+                for devstats in type_stats.itervalues():
+                    devstats = devstats.astype(numpy.uint64)
+                    expected = devstats if expected is None else expected + devstats
+                self.assertTrue(numpy.array_equal(totals, expected), type_name)
+                self.assertTrue(numpy.array_equal(alltotals, numpy.sum(expected, axis=1)), type_name)
+                self.assertTrue(host.get_totals(type_name)[0] is totals)
+            job.release_host(host)
+            self.assertEqual(host.totals, {})
+
+class LazyTypeStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processed = []
+        self.stats = job_stats.LazyTypeStats(self.process)
+        self.stats.add_pending('cpu', 1)
+        self.stats.add_pending('mem', 2)
+        self.stats['net'] = 'n'
+
+    def process(self, type_name, pending):
+        self.processed.append(type_name)
+        return (type_name, pending)
+
+    def test_lazy(self):
+        self.assertEqual(sorted(self.stats.keys()), ['cpu', 'mem', 'net'])
+        self.assertTrue('cpu' in self.stats)
+        self.assertEqual(len(self.stats), 3)
+        self.assertEqual(self.processed, [])
+        self.assertEqual(self.stats['cpu'], ('cpu', 1))
+        self.assertEqual(self.stats.get('cpu'), ('cpu', 1))
+        self.assertEqual(self.stats.get('vm', 'x'), 'x')
+        self.assertEqual(self.processed, ['cpu'])
+        self.assertEqual(sorted(self.stats.values()), sorted([('cpu', 1), ('mem', 2), 'n']))
+        self.assertEqual(sorted(self.processed), ['cpu', 'mem'])
+
+    def test_replace(self):
+        self.stats['cpu'] = 'c'
+        del self.stats['mem']
+        self.assertEqual(self.stats.pop('net'), 'n')
+        self.assertEqual(self.stats.pop('vm', None), None)
+        self.assertEqual(self.stats.setdefault('vm', 'v'), 'v')
+        self.assertEqual(dict(self.stats.items()), {'cpu': 'c', 'vm': 'v'})
+        self.assertEqual(self.processed, [])
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.stats, 2))
+        self.assertEqual(type(copy), dict)
+        self.assertEqual(copy, {'cpu': ('cpu', 1), 'mem': ('mem', 2), 'net': 'n'})
+        self.assertEqual(type(self.stats.copy()), dict)
+
+    def test_types(self):
+        job = load_job()
+        kept = load_job(types=['cpu', 'mem'])
+        self.assertEqual(sorted(kept.schemas.keys()), ['cpu', 'mem'])
+        for host_name, host in kept.hosts.iteritems():
+            self.assertEqual(sorted(host.stats.keys()), ['cpu', 'mem'])
+            # Types are listed but only processed once read. The cpu stats
+            # are read by the post processing.
+            self.assertEqual(host.stats.pending.keys(), ['mem'])
+            for type_name, type_stats in host.stats.iteritems():
+                expected = job.hosts[host_name].stats[type_name]
+                self.assertEqual(sorted(type_stats.keys()), sorted(expected.keys()))
+                for dev_name, devstats in type_stats.iteritems():
+                    self.assertTrue(numpy.array_equal(devstats, expected[dev_name]))
+            self.assertEqual(host.stats.pending, {})
+
+class CompactTypeStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.compact_stats = job_stats.COMPACT_STATS
+
+    def tearDown(self):
+        job_stats.COMPACT_STATS = self.compact_stats
+
+    def test_narrow(self):
+        type_stats = {'0': numpy.array([[0, 2**32 - 1]], dtype=numpy.uint64),
+                      '1': numpy.zeros((0, 2), dtype=numpy.uint64)}
+        result = job_stats.compact_type_stats(type_stats)
+        for dev_name, devstats in result.iteritems():
+            self.assertEqual(devstats.dtype, numpy.uint32)
+            self.assertTrue(numpy.array_equal(devstats, type_stats[dev_name]))
+
+    def test_unchanged(self):
+        wide = {'0': numpy.array([[1]], dtype=numpy.uint64), '1': numpy.array([[2**32]], dtype=numpy.uint64)}
+        mixed = {'0': numpy.array([[1]], dtype=numpy.uint64), '1': numpy.array([[1.5]])}
+        for type_stats in (wide, mixed, {}):
+            self.assertTrue(job_stats.compact_type_stats(type_stats) is type_stats)
+        job_stats.COMPACT_STATS = False
+        small = {'0': numpy.array([[1]], dtype=numpy.uint64)}
+        self.assertTrue(job_stats.compact_type_stats(small) is small)
+
+    def test_job(self):
+        compact = load_job()
+        job_stats.COMPACT_STATS = False
+        job = load_job()
+        for host_name, host in compact.hosts.iteritems():
+            for type_name, type_stats in host.stats.iteritems():
+                expected = job.hosts[host_name].stats[type_name]
+                self.assertEqual(len(set(devstats.dtype for devstats in type_stats.itervalues())), 1)
+                for dev_name, devstats in type_stats.iteritems():
+                    self.assertTrue(devstats.dtype in (numpy.uint32, expected[dev_name].dtype))
+                    self.assertTrue(numpy.array_equal(devstats, expected[dev_name]), (type_name, dev_name))
+            self.assertTrue(any(devstats.dtype == numpy.uint32 for devstats in host.stats['cpu'].itervalues()))
+
+if __name__ == '__main__':
+    unittest.main()
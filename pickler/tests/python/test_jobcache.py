@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Unit tests for the columnar job cache """
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import job_stats
+import jobcache
+import summarize
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+HOSTS = sorted(name.split('.')[0] for name in os.listdir(os.path.join(DATA, 'archive')))
+
+# Only the hosts in the test data are listed for the job so that the
+# completeness of each host is used by the summary
+ACCT = {'id': '1835740', 'uid': '809035', 'start_time': 1380663063, 'end_time': 1380671326,
+        'queue_time': 1380663063, 'nodes': len(HOSTS), 'cores': 16 * len(HOSTS), 'status': 'COMPLETED',
+        'queue': 'normal', 'host_list': HOSTS}
+
+class BatchAcct(object):
+    name_ext = '.platform.extension'
+
+def gather(accts):
+    for acct in accts:
+        yield job_stats.from_acct(acct, DATA, DATA, BatchAcct())
+
+def summary(job):
+    """ The summary documents of the job in a form that can be compared """
+    result, timeseries = summarize.summarize(job, None)
+    del result['created']
+    return json.dumps([result, timeseries], sort_keys=True)
+
+class JobCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        job = job_stats.from_acct(ACCT, DATA, DATA, BatchAcct())
+        self.assertEqual(len(job.hosts), 5)
+        path = jobcache.cache_path(self.tmpdir, ACCT)
+        jobcache.save(job, path)
+        expected = summary(job)
+
+        for mmap in (True, False):
+            loaded = jobcache.load(path, mmap)
+            self.assertEqual(loaded.hosts.keys(), job.hosts.keys())
+            self.assertEqual([ host.complete for host in loaded.hosts.itervalues() ],
+                             [ host.complete for host in job.hosts.itervalues() ])
+            self.assertEqual(summary(loaded), expected)
+
+    def test_read_key(self):
+        job = job_stats.from_acct(ACCT, DATA, DATA, BatchAcct())
+        path = jobcache.cache_path(self.tmpdir, ACCT)
+        jobcache.save(job, path)
+        values = jobcache.read_key(path, 'cpu', 'user')
+        index = job.get_schema('cpu')['user'].index
+        for host in job.hosts.itervalues():
+            for dev_name, stats in host.stats['cpu'].iteritems():
+                self.assertEqual(list(values[host.name][dev_name]), list(stats[:, index]))
+
+    def test_from_accts(self):
+        accts = [ dict(ACCT, id=str(i)) for i in range(5) ]
+        job = job_stats.from_acct(ACCT, DATA, DATA, BatchAcct())
+        for acct in (accts[1], accts[3]):
+            job.acct = acct
+            jobcache.save(job, jobcache.cache_path(self.tmpdir, acct))
+
+        gathered = []
+        def gatherbatch(batch):
+            batch = list(batch)
+            gathered.append([ acct['id'] for acct in batch ])
+            for acct in batch:
+                yield job_stats.Job(acct, DATA, DATA, BatchAcct())
+
+        jobs = jobcache.from_accts(self.tmpdir, iter(accts), gatherbatch, 2)
+        self.assertEqual([ j.acct['id'] for j in jobs ], ['1', '0', '2', '3', '4'])
+        # The misses are gathered as soon as a batch of them has been read
+        self.assertEqual(gathered, [['0', '2'], ['4']])
+
+    def test_prune(self):
+        job = job_stats.from_acct(ACCT, DATA, DATA, BatchAcct())
+        paths = []
+        for i in range(3):
+            job.acct = dict(ACCT, id=str(i))
+            paths.append(jobcache.cache_path(self.tmpdir, job.acct))
+            jobcache.save(job, paths[-1])
+        now = time.time()
+        os.utime(paths[0], (now - 100, now - 100))
+        os.utime(paths[1], (now - 100, now - 100))
+        # A job that is loaded is kept
+        list(jobcache.from_accts(self.tmpdir, [dict(ACCT, id='1')], gather))
+        self.assertEqual(jobcache.prune(self.tmpdir, 50, now), 1)
+        self.assertEqual([ os.path.isdir(path) for path in paths ], [False, True, True])
+
+if __name__ == '__main__':
+    unittest.main()
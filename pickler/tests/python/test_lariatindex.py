@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+""" Unit tests for the lariat file job index """
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import lariatindex
+
+LARIAT = """{
+ "100": [{"jobID": "100", "exec": "/bin/a", "user": "x\\'y", "runtime": 10}],
+ "101" : [ {"jobID": "101", "exec": "/bin/\\'b\\'", "runtime": 5},
+           {"jobID": "101", "runtime": 50} ],
+ "102":[],
+ "100": [{"jobID": "100", "exec": "/bin/c", "runtime": 20}]
+}
+"""
+
+class LariatIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.indexdir = lariatindex.INDEX_DIR
+        lariatindex.INDEX_DIR = os.path.join(self.tmpdir, 'index')
+        self.path = os.path.join(self.tmpdir, 'lariatData-sgeT-2013-10-01.json')
+        with open(self.path, 'wb') as fp:
+            fp.write(LARIAT)
+        os.chmod(self.path, 0644)
+
+    def tearDown(self):
+        lariatindex.INDEX_DIR = self.indexdir
+        shutil.rmtree(self.tmpdir)
+
+    def test_records(self):
+        expected = json.loads(lariatindex.fixup(LARIAT))
+        index = lariatindex.build_index(self.path)
+        self.assertEqual(sorted(index.jobids), ['100', '100', '101', '102'])
+        for jobid in expected:
+            self.assertEqual(lariatindex.read_records(self.path, index, jobid), expected[jobid])
+        self.assertFalse('103' in index)
+
+    def test_sidecar(self):
+        index = lariatindex.get_index(self.path)
+        sidecar = lariatindex.index_path(self.path)
+        self.assertTrue(sidecar.startswith(lariatindex.INDEX_DIR))
+        self.assertFalse(os.path.exists(self.path + ".idx"))
+        self.assertEqual(stat.S_IMODE(os.stat(sidecar).st_mode), 0644)
+
+        cached = lariatindex.read_index(self.path, os.stat(self.path))
+        self.assertEqual(cached.jobids, index.jobids)
+        self.assertEqual(cached.span('101'), index.span('101'))
+
+        with open(self.path, 'ab') as fp:
+            fp.write(" ")
+        self.assertEqual(lariatindex.read_index(self.path, os.stat(self.path)), None)
+
+    def test_write_failure(self):
+        index = lariatindex.build_index(self.path)
+        index.jobids = None
+        os.makedirs(os.path.dirname(lariatindex.index_path(self.path)))
+        with self.assertRaises(TypeError):
+            lariatindex.write_index(self.path, index, os.stat(self.path))
+        self.assertEqual(os.listdir(os.path.dirname(lariatindex.index_path(self.path))), [])
+
+if __name__ == '__main__':
+    unittest.main()
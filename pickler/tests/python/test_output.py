@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+""" Unit tests for the buffered MongoDB output. The client is replaced with
+    an in-memory stand-in. """
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+try:
+    import pymongo
+except ImportError:
+    # The client and ReplaceOne are replaced in the tests, so output only
+    # needs the names that it imports and the exceptions
+    class InvalidDocument(Exception):
+        pass
+
+    class BulkWriteError(Exception):
+        def __init__(self, details):
+            Exception.__init__(self, "batch op errors occurred")
+            self.details = details
+
+    pymongo = types.ModuleType('pymongo')
+    pymongo.MongoClient = None
+    pymongo.ReplaceOne = None
+    pymongo.errors = types.ModuleType('pymongo.errors')
+    pymongo.errors.InvalidDocument = InvalidDocument
+    pymongo.errors.BulkWriteError = BulkWriteError
+    sys.modules['pymongo'] = pymongo
+    sys.modules['pymongo.errors'] = pymongo.errors
+
+import output
+
+class ReplaceOne(object):
+    def __init__(self, query, doc, upsert=False):
+        self.doc = doc
+
+class Result(object):
+    acknowledged = True
+
+class Collection(object):
+    """ Stores the documents by id. Documents with "invalid" set cannot be
+        encoded and those with "fail" set are rejected by the server. """
+    def __init__(self):
+        self.docs = {}
+        self.bulkwrites = 0
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulkwrites += 1
+        docs = [ request.doc for request in requests ]
+        if any(doc.get("invalid") for doc in docs):
+            raise output.InvalidDocument("cannot encode object")
+        errors = []
+        for i, doc in enumerate(docs):
+            if doc.get("fail"):
+                errors.append({'index': i, 'errmsg': 'rejected'})
+            else:
+                self.docs[doc["_id"]] = doc
+        if errors:
+            raise output.BulkWriteError({'writeErrors': errors})
+        return Result()
+
+    def replace_one(self, query, doc, upsert=False):
+        if doc.get("invalid"):
+            raise output.InvalidDocument("cannot encode object")
+        self.docs[doc["_id"]] = doc
+
+class Database(dict):
+    def __missing__(self, name):
+        self[name] = Collection()
+        return self[name]
+
+class Client(object):
+    def __init__(self, uri):
+        self.dbs = Database()
+
+    def __getitem__(self, name):
+        return self.dbs.setdefault(name, Database())
+
+class MongoOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = output.MongoClient
+        self.replaceone = output.ReplaceOne
+        output.MongoClient = Client
+        output.ReplaceOne = ReplaceOne
+        self.out = output.MongoOutput({'uri': 'x', 'dbname': 'db', 'write_batch_size': 3, 'write_batch_seconds': 3600})
+        self.done = {}
+
+    def tearDown(self):
+        output.MongoClient = self.client
+        output.ReplaceOne = self.replaceone
+
+    def insert(self, resourcename, docid, summary=None, timeseries=None):
+        summary = dict(summary or {}, _id=docid)
+        if timeseries is not None:
+            timeseries = dict(timeseries, _id=docid)
+        self.out.insert(resourcename, summary, timeseries, lambda ok: self.done.__setitem__(docid, ok))
+
+    def test_batch(self):
+        self.insert("r", "1", timeseries={})
+        self.insert("s", "2")
+        self.assertEqual(self.done, {})
+        self.insert("r", "3", timeseries={})
+        self.assertEqual(self.done, {"1": True, "2": True, "3": True})
+        db = self.out.db
+        self.assertEqual(sorted(db["r"].docs.keys()), ["1", "3"])
+        self.assertEqual(sorted(db["timeseries-r"].docs.keys()), ["1", "3"])
+        self.assertEqual(sorted(db["s"].docs.keys()), ["2"])
+        self.assertEqual(db["r"].bulkwrites, 1)
+
+    def test_flush(self):
+        self.insert("r", "1")
+        self.out.flush()
+        self.assertEqual(self.done, {"1": True})
+        self.out.flush()
+        self.assertEqual(self.done, {"1": True})
+
+    def test_errors(self):
+        self.insert("r", "1", timeseries={})
+        self.insert("r", "2", summary={"fail": True})
+        self.insert("r", "3", timeseries={"fail": True})
+        self.insert("r", "4", timeseries={"invalid": True})
+        self.insert("r", "5", timeseries={})
+        self.out.flush()
+        # A job is only logged as written if both of its documents were
+        self.assertEqual(self.done, {"1": True, "2": False, "3": False, "4": False, "5": True})
+        self.assertEqual(sorted(self.out.db["timeseries-r"].docs.keys()), ["1", "5"])
+
+if __name__ == '__main__':
+    unittest.main()
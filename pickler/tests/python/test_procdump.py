@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+""" Unit tests for the proc entry classifier """
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import procdump
+
+COMMANDRE_V2 = re.compile("(.*)/([0-9]+)/([0-9,-]+)/([0-9,-]+)$")
+
+ENTRIES = [
+    "a.out/1234/0-15/0-1",
+    "a.out/1235/3/0",
+    "/work/bin/wrf.exe/99/0,2,4-7/0",
+    "wrf.exe/99/0,2,4-7/",
+    "wrf.exe//0/0",
+    "wrf.exe/x1/0/0",
+    "wrf.exe/1/0-a/0",
+    "bash/12/0-15/0-1",
+    "sshd/12/0-15/0-1",
+    "no_fields",
+    "a/b/c",
+    "mpirun/7/1/0/",
+    "//1/2/3",
+]
+
+def reference(dump, procstr):
+    """ The classification of the original regular expression """
+    m = COMMANDRE_V2.search(procstr)
+    if m == None or not dump.procfilter.allow(m.group(1)):
+        return None
+    return m.group(1), procdump.parsecpusallowed(m.group(3))
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_matches_regex(self):
+        dump = procdump.TaccProcDump()
+        for _ in range(2):
+            # Second time round the results come from the cache
+            for procstr in ENTRIES:
+                self.assertEqual(dump.classify_v2(procstr), reference(dump, procstr), procstr)
+
+    def test_cache_limit(self):
+        limit = procdump.CLASSIFIER_CACHE_SIZE
+        procdump.CLASSIFIER_CACHE_SIZE = 3
+        try:
+            dump = procdump.TaccProcDump()
+            for i in range(10):
+                self.assertEqual(dump.classify_v2("cmd{0}/1/{0}/0".format(i)), ("cmd%d" % i, procdump.parsecpusallowed(str(i))))
+                self.assertTrue(len(dump.entries) <= 3)
+        finally:
+            procdump.CLASSIFIER_CACHE_SIZE = limit
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Unit tests for the resampling of the host data onto the job time grid """
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import resample
+
+def reference(hosttimes, grid, values):
+    """ numpy.interp() on each column """
+    return numpy.array([ numpy.interp(grid, hosttimes, values[:, col]) for col in range(values.shape[1]) ]).T
+
+class Host(object):
+    def __init__(self, times, stats):
+        self.times = times
+        self.stats = stats
+
+    def get_totals(self, metric):
+        devstats = numpy.array(self.stats[metric].values(), dtype=numpy.float64)
+        totals = numpy.sum(devstats, axis=0)
+        return totals, numpy.sum(totals, axis=1)
+
+class HostGridTest(unittest.TestCase):
+
+    def check(self, hosttimes, grid, values):
+        result = resample.HostGrid(hosttimes, grid).interp(values)
+        self.assertTrue(numpy.array_equal(result, reference(hosttimes, grid, values)))
+
+    def test_interp(self):
+        rng = numpy.random.RandomState(1)
+        for _ in range(20):
+            hosttimes = numpy.cumsum(rng.uniform(1, 700, rng.randint(2, 50)))
+            values = rng.uniform(0, 2**40, (len(hosttimes), 3))
+            # Grid points before, after and on the samples
+            grid = numpy.sort(numpy.concatenate([ rng.uniform(hosttimes[0] - 1000, hosttimes[-1] + 1000, 40),
+                                                  hosttimes[rng.randint(0, len(hosttimes), 5)] ]))
+            self.check(hosttimes, grid, values)
+
+    def test_few_samples(self):
+        grid = numpy.linspace(0, 100, 7)
+        self.check(numpy.array([50.0]), grid, numpy.array([[3.0, 4.0]]))
+        self.check(numpy.array([10.0, 90.0]), grid, numpy.array([[3.0, 4.0], [5.0, 2.0]]))
+
+    def test_counters(self):
+        # Integer counters are interpolated as float64 like numpy.interp
+        hosttimes = numpy.array([0.0, 600.0, 1200.0, 1800.0])
+        values = numpy.array([[0, 2**63], [10, 2**63 + 4096], [15, 2**64 - 1], [31, 2**64 - 1]], dtype=numpy.uint64)
+        self.check(hosttimes, numpy.linspace(-100, 1900, 11), values.astype(numpy.float64))
+        self.assertTrue(numpy.array_equal(resample.HostGrid(hosttimes, [300.0]).interp(values),
+                                          resample.HostGrid(hosttimes, [300.0]).interp(values.astype(numpy.float64))))
+
+class JobGridTest(unittest.TestCase):
+
+    def test_cube(self):
+        rng = numpy.random.RandomState(2)
+        grid = numpy.linspace(0, 3000, 20)
+        hosts = []
+        for i in range(3):
+            times = numpy.cumsum(rng.uniform(300, 700, 8))
+            stats = { "cpu": dict((str(dev), rng.randint(0, 2**20, (8, 2)).astype(numpy.float64)) for dev in range(4)) }
+            hosts.append(Host(times, stats))
+        hosts.append(Host(numpy.arange(8) * 600.0, {}))
+        indices = { "cpu": { "user": 0, "system": 1 } }
+        computed = [ ("double", lambda a: 2 * a[0], ["user"]) ]
+
+        jobgrid = resample.JobGrid(hosts, grid)
+        hostidx, columns, data = jobgrid.cube("cpu", indices, computed)
+        self.assertEqual(hostidx, [0, 1, 2])
+        self.assertEqual(columns, { "user": 0, "system": 1, "all": 2, "double": 3 })
+        for row, host in enumerate(hosts[:3]):
+            totals, alltotals = host.get_totals("cpu")
+            for name, col in (("user", 0), ("system", 1)):
+                self.assertTrue(numpy.array_equal(data[row, columns[name]], numpy.interp(grid, host.times, totals[:, col])))
+            self.assertTrue(numpy.array_equal(data[row, columns["all"]], numpy.interp(grid, host.times, alltotals)))
+            self.assertTrue(numpy.array_equal(data[row, columns["double"]], numpy.interp(grid, host.times, 2 * totals[:, 0])))
+
+            devices = jobgrid.devices(row, "cpu")
+            for devname, devstats in host.stats["cpu"].iteritems():
+                self.assertTrue(numpy.array_equal(devices[devname][0], numpy.interp(grid, host.times, devstats[:, 0])))
+                self.assertTrue(numpy.array_equal(devices[devname][-1], numpy.interp(grid, host.times, numpy.sum(devstats, axis=1))))
+
+if __name__ == '__main__':
+    unittest.main()
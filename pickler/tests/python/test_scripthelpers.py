@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+""" Unit tests for the read ahead and background write helpers """
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import scripthelpers
+
+class Alarm(Exception):
+    pass
+
+def alarm(signum, _):
+    raise Alarm()
+
+class SignalTestCase(unittest.TestCase):
+    """ Delivers SIGALRM while the main thread waits, the handler raises """
+
+    def setUp(self):
+        self.interval = scripthelpers.POLL_SECONDS
+        scripthelpers.POLL_SECONDS = 0.05
+        self.handler = signal.signal(signal.SIGALRM, alarm)
+
+    def tearDown(self):
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, self.handler)
+        scripthelpers.POLL_SECONDS = self.interval
+
+class PrefetchTest(SignalTestCase):
+
+    def test_items(self):
+        self.assertEqual(list(scripthelpers.prefetch(iter(range(20)), 3)), range(20))
+        self.assertEqual(list(scripthelpers.prefetch([], 3)), [])
+
+    def test_error(self):
+        def items():
+            yield 1
+            raise ValueError("bad record")
+        reader = scripthelpers.prefetch(items(), 3)
+        self.assertEqual(next(reader), 1)
+        self.assertRaises(ValueError, next, reader)
+
+    def test_close(self):
+        read = []
+        def items():
+            for i in range(100):
+                read.append(i)
+                yield i
+        reader = scripthelpers.prefetch(items(), 2)
+        self.assertEqual(next(reader), 0)
+        reader.close()
+        time.sleep(0.2)
+        # The thread stops once the queue is full
+        self.assertTrue(len(read) < 10)
+
+    def test_signal(self):
+        release = threading.Event()
+        def items():
+            release.wait()
+            yield 1
+        signal.alarm(1)
+        start = time.time()
+        try:
+            self.assertRaises(Alarm, next, scripthelpers.prefetch(items(), 1))
+        finally:
+            release.set()
+        self.assertTrue(time.time() - start < 5)
+
+class WriterTest(SignalTestCase):
+
+    def test_order(self):
+        for size in (0, 2):
+            done = []
+            writer = scripthelpers.Writer(size)
+            for i in range(10):
+                writer.submit(done.append, i)
+            writer.close()
+            self.assertEqual(done, range(10))
+
+    def test_error(self):
+        def fail():
+            raise ValueError("write failed")
+        writer = scripthelpers.Writer(2)
+        writer.submit(fail)
+        self.assertRaises(ValueError, writer.close)
+
+    def test_signal(self):
+        release = threading.Event()
+        writer = scripthelpers.Writer(1)
+        writer.submit(release.wait)
+        signal.alarm(1)
+        start = time.time()
+        try:
+            self.assertRaises(Alarm, writer.close)
+        finally:
+            release.set()
+        self.assertTrue(time.time() - start < 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+""" Unit tests for the summary statistics """
+import math
+import os
+import sys
+import unittest
+import warnings
+
+import numpy
+import scipy.stats
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import summarize
+
+def reference(v):
+    """ The calculate_stats() of the original implementation """
+    res = { }
+
+    if len(v) > 0:
+        (v_n, (v_min, v_max), v_avg, v_var, v_skew, v_kurt) = scipy.stats.describe(v)
+
+        res['max'] = float(v_max)
+        res['avg'] = v_avg
+        res['krt'] = v_kurt
+        res['min'] = float(v_min)
+        res['skw'] = v_skew
+        res['cnt'] = len(v)
+        if res['min'] == res['max']:
+            res['med'] = res['min']
+            res['std'] = 0.0
+        else:
+            res['med'] = float(numpy.median(v, axis=0))
+            if len(v) > 2:
+                res['std'] = scipy.stats.tstd(v)
+
+        if len(v) > 1 and abs(v_avg) > 0:
+            res['cov'] = math.sqrt(v_var) / v_avg
+        else:
+            res['cov'] = 0.0
+
+    return res
+
+class StatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.olderr = numpy.seterr(all='ignore')
+        warnings.simplefilter("ignore", RuntimeWarning)
+
+    def tearDown(self):
+        numpy.seterr(**self.olderr)
+        warnings.resetwarnings()
+
+    def assertStats(self, result, expected, rtol=1e-9, msg=None):
+        self.assertEqual(sorted(result.keys()), sorted(expected.keys()), msg)
+        for key, value in expected.iteritems():
+            if isinstance(value, float) and math.isnan(value):
+                self.assertTrue(math.isnan(result[key]), (key, msg))
+            else:
+                self.assertTrue(abs(result[key] - value) <= rtol * max(abs(value), 1e-300), (key, result[key], value, msg))
+
+SERIES = [
+    [1.0, 2.0, 3.0, 4.0, 100.0],
+    [5.0, 5.0, 5.0],
+    [7.0],
+    [3.0, -1.0],
+    [0.0, 0.0, 1.0, -1.0],
+    [float(x) for x in range(1, 50)],
+    [1.0, float('nan'), 3.0],
+]
+
+class CalculateStatsTest(StatsTestCase):
+
+    def test_series(self):
+        rng = numpy.random.RandomState(1)
+        series = SERIES + [ list(rng.lognormal(3, 2, n)) for n in (3, 10, 101, 1000) ]
+        for v in series:
+            self.assertStats(summarize.calculate_stats(v), reference(v), msg=v[:5])
+        self.assertEqual(summarize.calculate_stats([]), {})
+
+    def test_integers(self):
+        v = [ 2**40 + i * i for i in range(20) ]
+        self.assertStats(summarize.calculate_stats(numpy.array(v, dtype=numpy.uint64)), reference(numpy.array(v, dtype=numpy.float64)))
+
+    def test_rows(self):
+        rng = numpy.random.RandomState(2)
+        v = rng.uniform(-10, 1000, (6, 15))
+        v[2] = 4.0
+        for row, res in zip(v, summarize.calculate_stats_rows(v)):
+            self.assertStats(res, reference(row))
+
+    def test_many(self):
+        series = dict(enumerate(SERIES))
+        series['empty'] = []
+        running = summarize.RunningStats()
+        for x in SERIES[0]:
+            running.append(x)
+        series['running'] = running
+        results = summarize.calculate_stats_many(series)
+        self.assertEqual(results['empty'], {})
+        self.assertStats(results['running'], reference(SERIES[0]))
+        for i, v in enumerate(SERIES):
+            self.assertStats(results[i], reference(v), msg=v)
+
+class RunningStatsTest(StatsTestCase):
+
+    def running(self, values, capacity):
+        stats = summarize.RunningStats(capacity)
+        for x in values:
+            stats.append(x)
+        return stats
+
+    def assertMoments(self, result, expected, medtol):
+        """ The moments are exact up to rounding, the median is estimated
+            from the sample """
+        self.assertEqual(sorted(result.keys()), sorted(expected.keys()))
+        for key in ('min', 'max', 'cnt'):
+            self.assertEqual(result[key], expected[key])
+        for key in ('avg', 'std', 'cov', 'skw', 'krt'):
+            self.assertTrue(abs(result[key] - expected[key]) <= 1e-8 * max(abs(expected[key]), 1.0), (key, result[key], expected[key]))
+        self.assertTrue(abs(result['med'] - expected['med']) <= medtol, (result['med'], expected['med']))
+
+    def test_below_capacity(self):
+        v = list(numpy.random.RandomState(3).lognormal(3, 1, 50))
+        stats = self.running(v, 50)
+        self.assertEqual(len(stats), 50)
+        self.assertEqual(stats.maximum(), max(v))
+        self.assertEqual(stats.calculate(), summarize.calculate_stats(v))
+        self.assertEqual(self.running([], None).calculate(), {})
+
+    def test_above_capacity(self):
+        v = numpy.random.RandomState(4).normal(100, 10, 5000)
+        stats = self.running(v, 500)
+        self.assertEqual(len(stats), 5000)
+        self.assertEqual(len(stats.values), 500)
+        self.assertEqual(stats.maximum(), numpy.max(v))
+        self.assertMoments(stats.calculate(), reference(v), 2.0)
+        # The sample is reproducible
+        self.assertEqual(self.running(v, 500).calculate(), stats.calculate())
+
+    def test_constant(self):
+        res = self.running([3.0] * 20, 5).calculate()
+        self.assertEqual((res['min'], res['max'], res['med'], res['std']), (3.0, 3.0, 3.0, 0.0))
+
+    def test_extend(self):
+        rng = numpy.random.RandomState(5)
+        parts = [ rng.normal(50, 5, n) for n in (10, 700, 30, 1500) ]
+        merged = summarize.mergestats([ self.running(v, 400) for v in parts ], 400)
+        v = numpy.concatenate(parts)
+        self.assertEqual(len(merged), len(v))
+        self.assertTrue(len(merged.values) <= 400)
+        self.assertMoments(merged.calculate(), reference(v), 2.0)
+
+        # Below capacity the values are kept as they are
+        small = summarize.mergestats([ self.running(v, 100) for v in (parts[0], parts[2]) ], 100)
+        self.assertEqual(small.calculate(), summarize.calculate_stats(list(parts[0]) + list(parts[2])))
+
+        single = self.running(parts[0], 400)
+        self.assertTrue(summarize.mergestats([single], 400) is single)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+""" Tests of the job summaries generated from the test data """
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import job_stats
+import summarize
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+ARCHIVE = os.path.join(DATA, 'archive')
+# The summary of the test job from the original implementation with the
+# per-device series of the first host copied (SUMMARY_VERSION 0.9.38) and
+# without (0.9.37)
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '1835740_summary.json')
+REFERENCE_0_9_37 = os.path.join(os.path.dirname(os.path.abspath(__file__)), '1835740_summary-0.9.37.json')
+
+# The timedata that 0.9.37 computed from the first host's stats after the
+# other hosts had been added to them
+ALIASED_0_9_37 = [('timedata', 'block'), ('timedata', 'ps'), ('timedata', 'vfs')]
+
+ACCT = {'id': '1835740', 'uid': '809035', 'start_time': 1380663063, 'end_time': 1380671326,
+        'queue_time': 1380663063, 'nodes': 14, 'cores': 224, 'status': 'COMPLETED', 'queue': 'normal'}
+
+class BatchAcct(object):
+    name_ext = '.platform.extension'
+
+def summary(acct, stats_home, stream_min_hosts=0):
+    """ The summary documents of the job in a form that can be compared """
+    job = job_stats.from_acct(acct, stats_home, stats_home, BatchAcct(), stream_min_hosts=stream_min_hosts)
+    streaming = job.streaming
+    result, timeseries = summarize.summarize(job, None)
+    del result['created']
+    return streaming, json.dumps([result, timeseries], sort_keys=True)
+
+def differences(result, reference):
+    """ The (key, subkey) of the documents in result that do not match
+        reference, apart from summary_version """
+    diff = []
+    for doc, ref in zip(result, reference):
+        for key in sorted(set(doc.keys()) | set(ref.keys())):
+            if key == 'summary_version':
+                continue
+            a, b = doc.get(key), ref.get(key)
+            if json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True):
+                continue
+            if isinstance(a, dict) and isinstance(b, dict):
+                diff.extend((key, sub) for sub in sorted(set(a.keys()) | set(b.keys()))
+                            if json.dumps(a.get(sub), sort_keys=True) != json.dumps(b.get(sub), sort_keys=True))
+            else:
+                diff.append((key, None))
+    return diff
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, acct, stats_home):
+        streaming, expected = summary(acct, stats_home)
+        self.assertFalse(streaming)
+        streaming, streamed = summary(acct, stats_home, 1)
+        self.assertTrue(streaming)
+        self.assertEqual(streamed, expected)
+
+    def test_hosts(self):
+        hosts = sorted(name.split('.')[0] for name in os.listdir(ARCHIVE))
+        self.check(dict(ACCT, host_list=hosts), DATA)
+
+    def manyhosts(self):
+        """ The hosts of the test data repeated under other names """
+        names = sorted(os.listdir(ARCHIVE))
+        os.mkdir(os.path.join(self.tmpdir, 'archive'))
+        hosts = []
+        for i in range(70):
+            hosts.append("h%03d" % i)
+            os.symlink(os.path.join(ARCHIVE, names[i % len(names)]),
+                       os.path.join(self.tmpdir, 'archive', hosts[-1] + BatchAcct.name_ext))
+        return hosts
+
+    def test_many_hosts(self):
+        # Jobs with more than 64 hosts only output the min, max and median
+        # hosts.
+        self.check(dict(ACCT, host_list=self.manyhosts()), self.tmpdir)
+
+    def test_many_hosts_reload(self):
+        # Only the hosts whose device data is output are loaded again
+        hosts = self.manyhosts()
+        loads = []
+        load_host = job_stats.Job.load_host
+        def counting_load_host(job, host):
+            loads.append(host.name)
+            return load_host(job, host)
+        job_stats.Job.load_host = counting_load_host
+        try:
+            streaming, result = summary(dict(ACCT, host_list=hosts), self.tmpdir, 1)
+        finally:
+            job_stats.Job.load_host = load_host
+        self.assertTrue(streaming)
+
+        timeseries = json.loads(result)[1]
+        output = set()
+        for key, value in timeseries.iteritems():
+            if isinstance(value, dict) and 'hosts' in value:
+                output.update(timeseries['hosts'][idx] for idx, data in value['hosts'].iteritems() if 'dev' in data)
+        self.assertTrue(output)
+        self.assertLess(len(output), len(hosts))
+        self.assertEqual(sorted(set(loads)), hosts)
+        reloaded = [name for name in loads if loads.count(name) > 1]
+        self.assertEqual(set(reloaded), output)
+        self.assertEqual(len(reloaded), 2 * len(output))
+
+class ReferenceTest(unittest.TestCase):
+    """ The regular and the streamed summaries are compared with the
+        reference summaries """
+
+    def setUp(self):
+        hosts = sorted(name.split('.')[0] for name in os.listdir(ARCHIVE))
+        self.results = []
+        for stream_min_hosts in (0, 1):
+            streaming, result = summary(dict(ACCT, host_list=hosts), DATA, stream_min_hosts)
+            self.assertEqual(streaming, stream_min_hosts > 0)
+            self.results.append(json.loads(result))
+
+    def test_summary(self):
+        with open(REFERENCE) as fp:
+            expected = json.load(fp)
+        for result in self.results:
+            self.assertEqual(len(result), len(expected))
+            self.assertEqual(result[0]['summary_version'], summarize.SUMMARY_VERSION)
+            self.assertEqual(differences(result, expected), [])
+
+    def test_summary_0_9_37(self):
+        with open(REFERENCE_0_9_37) as fp:
+            expected = json.load(fp)
+        for result in self.results:
+            self.assertEqual(differences(result, expected), ALIASED_0_9_37)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+""" Unit tests for the work queue that hands out jobs to the workers """
+import os
+import sys
+import unittest
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import workqueue
+
+def makeaccts(count):
+    return [ {'id': str(i), 'nodes': 1 + i % 3, 'start_time': 0, 'end_time': 10 + i} for i in range(count) ]
+
+class WorkQueueTest(unittest.TestCase):
+
+    def test_cost_order(self):
+        queue = workqueue.WorkQueue(lambda resourcename: makeaccts(10))
+        costs = []
+        while True:
+            lease = queue.lease(0, "r", 0)
+            if not lease:
+                break
+            costs.append(workqueue.estimated_cost(lease[1]))
+        self.assertEqual(len(costs), 10)
+        self.assertEqual(costs, sorted(costs, reverse=True))
+
+    def test_own_leases(self):
+        queue = workqueue.WorkQueue(lambda resourcename: makeaccts(2))
+        first = queue.lease(0, "r", 0)
+        second = queue.lease(0, "r", 0)
+        # The requester holds all of the remaining leases
+        self.assertEqual(queue.lease(0, "r", 0), None)
+        # Another worker waits for them
+        self.assertEqual(queue.lease(1, "r", 0), False)
+        queue.complete(first[0])
+        queue.complete(second[0])
+        self.assertEqual(queue.lease(1, "r", 0), None)
+
+    def test_expire(self):
+        queue = workqueue.WorkQueue(lambda resourcename: makeaccts(1), lease_timeout=10, max_attempts=2)
+        first = queue.lease(0, "r", 0)
+        queue.expire(5)
+        self.assertEqual(queue.lease(1, "r", 5), False)
+        queue.expire(11)
+        second = queue.lease(1, "r", 11)
+        self.assertEqual(second[1], first[1])
+        # The late completion of the expired lease is ignored
+        queue.complete(first[0])
+        self.assertEqual(queue.lease(2, "r", 11), False)
+        # The job is given up on after max_attempts
+        queue.expire(100)
+        self.assertEqual(queue.lease(2, "r", 100), None)
+
+class CoordinatorTest(unittest.TestCase):
+
+    def test_exit_releases_leases(self):
+        coordinator = workqueue.Coordinator(workqueue.WorkQueue(lambda resourcename: makeaccts(2)))
+        replies = coordinator.dispatch(0, ("lease", "r"), 0)
+        self.assertEqual(replies[0][0], 0)
+        self.assertEqual(replies[0][1][0], "job")
+        replies = coordinator.dispatch(1, ("lease", "r"), 0)
+        self.assertEqual(replies[0][1][0], "job")
+        # Worker 1 waits on the lease of worker 0
+        self.assertEqual(coordinator.dispatch(1, ("lease", "r"), 0), [])
+        # Worker 0 exits without completing its job, which goes to worker 1
+        replies = coordinator.dispatch(0, ("exit",), 0)
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(replies[0][0], 1)
+        self.assertEqual(replies[0][1][0], "job")
+        self.assertEqual(coordinator.exited, set([0]))
+
+class ClientTest(unittest.TestCase):
+
+    def test_transport(self):
+        coordinator = workqueue.Coordinator(workqueue.WorkQueue(lambda resourcename: makeaccts(3)))
+        pending = []
+
+        def send(message):
+            pending.extend(reply for _, reply in coordinator.dispatch(0, message, 0))
+
+        client = workqueue.WorkQueueClient(send, lambda: pending.pop(0))
+        done = []
+        for acct in client.accts("r"):
+            done.append(acct['id'])
+            client.complete(acct)
+        self.assertEqual(sorted(done), ['0', '1', '2'])
+        self.assertEqual(coordinator.workqueue.leases, {})
+        client.close()
+        self.assertEqual(coordinator.exited, set([0]))
+
+def worker(client, out, crash, requests):
+    count = 0
+    try:
+        for acct in client.accts("r"):
+            count += 1
+            if crash and count == 2:
+                # Die holding the lease. The queues are flushed first since
+                # os._exit() would drop the unsent items, or kill the feeder
+                # thread while it holds the shared lock of the requests queue
+                for queue in (out, requests):
+                    queue.close()
+                    queue.join_thread()
+                os._exit(1)
+            out.put(acct['id'])
+            client.complete(acct)
+    finally:
+        client.close()
+
+class ServeProcessesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.interval = workqueue.POLL_INTERVAL
+        workqueue.POLL_INTERVAL = 0.05
+
+    def tearDown(self):
+        workqueue.POLL_INTERVAL = self.interval
+
+    def test_workers(self):
+        coordinator = workqueue.Coordinator(workqueue.WorkQueue(lambda resourcename: makeaccts(30)))
+        requests = Queue()
+        replies = [ Queue() for _ in range(3) ]
+        out = Queue()
+        procs = [ Process(target=worker, args=(workqueue.ProcessClient(i, requests, replies[i]), out, i == 1, requests)) for i in range(3) ]
+        for proc in procs:
+            proc.start()
+        workqueue.serve_processes(coordinator, requests, replies, procs)
+        for proc in procs:
+            proc.join()
+
+        done = []
+        while len(done) < 30 and not out.empty():
+            done.append(out.get())
+        # The job of the worker that died is summarized by another one
+        self.assertEqual(sorted(done, key=int), [ str(i) for i in range(30) ])
+        self.assertEqual(coordinator.workqueue.leases, {})
+
+if __name__ == '__main__':
+    unittest.main()
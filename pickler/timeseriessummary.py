@@ -2,6 +2,9 @@
 import job_stats
 import numpy
 import itertools
+import formulas
+import resample
+from formulas import MEGA, GIGA
 
 # Stupid python incompatiblities
 from sys import version as python_version
@@ -12,45 +15,6 @@ else:
 
 TIMESERIES_VERSION = 4
 
-MEGA = 1024.0 * 1024.0
-GIGA = MEGA * 1024.0
-
-def getallstats(j, times, host, metricname, interface, indices):
-
-    ifidx = None
-    if interface != "all":
-        ifidx = indices[metricname][interface]
-
-    result = {}
-    for devname, devstats in host.stats[metricname].iteritems():
-        if interface == "all":
-            result[devname] = numpy.interp(times, host.times, numpy.sum(devstats, axis = 1))
-        else:
-            result[devname] = numpy.interp(times, host.times, numpy.array(devstats[:,ifidx]))
-
-    return result
-
-def getinterfacestats(hoststats, metricname, interface, indices):
-
-    ifidx = None
-    if interface != "all":
-        ifidx = indices[metricname][interface]
-
-    totals = None
-    for devstats in hoststats[metricname].itervalues():
-        if totals is None:
-            if interface == "all":
-                totals = numpy.sum(devstats, axis = 1)
-            else:
-                totals = numpy.array(devstats[:,ifidx])
-        else:
-            if interface == "all":
-                totals += numpy.sum(devstats, axis = 1)
-            else:
-                totals += numpy.array(devstats[:,ifidx])
-
-    return totals
-
 def nativefloatlist(numpyarray):
     return numpyarray.tolist()
 
@@ -151,7 +115,7 @@ class TimeSeriesSummary(object):
             } ],
             "memused_minus_diskcache": [ {
                 "metric": "mem",
-                "formula": "numpy.array(a[0] - a[1] - a[2])[1:] / GIGA",
+                "formula": "numpy.array(a[0] - a[1] - a[2])[..., 1:] / GIGA",
                 "interfaces": ["MemUsed", 'FilePages', "Slab"]
             } ], 
             "lnet": [ {
@@ -178,6 +142,7 @@ class TimeSeriesSummary(object):
             self.metrics['cpuuser'][0]['devicebased'] = False
 
         self.times = computesubsamples(j.times, numpy.diff(j.times))
+        self.grid = resample.JobGrid(j.hosts.values(), self.times)
 
         if len(j.hosts) > 64:
             return self.getminmaxmed(j, indices)
@@ -211,41 +176,54 @@ class TimeSeriesSummary(object):
 
         return outdata
 
-    def getvalues(self, metric, formula, interfaces, j, host, indices):
-        if metric not in host.stats:
-            return None
-
-        a = []
+    def gethostvalues(self, metric, formula, interfaces, grid, indices):
+        """ Return the (hosts x times) values of formula for the hosts of the
+            JobGrid grid or None if any of the hosts does not have the data """
+        for host in grid.hosts:
+            if metric not in host.stats:
+                return None
         for interface in interfaces:
             if interface != "all" and interface not in indices[metric]:
                 return None
-            a.append( numpy.interp(self.times, host.times, getinterfacestats(host.stats, metric, interface, indices) ) )
 
-        delta_t = numpy.diff(self.times)
+        hostidx, columns, data = grid.cube(metric, indices)
+        a = [ data[:, columns[interface], :] for interface in interfaces ]
 
-        return eval(formula)
+        return formulas.evaluate(formula, a, numpy.diff(self.times))
 
-    def getdevicevalues(self, metric, formula, interfaces, j, host, indices):
-        if metric not in host.stats:
+    def getdevicearray(self, metric, formula, interfaces, grid, hostidx, indices):
+        """ Return the device names and the (devices x times) values of
+            formula for a host of the JobGrid grid or None if the host does
+            not have the data """
+        if metric not in grid.hosts[hostidx].stats:
             return None
 
-        devs = []
         for interface in interfaces:
             if interface != "all" and interface not in indices[metric]:
                 return None
-            devs.append( getallstats(j, self.times, host, metric, interface, indices) )
 
-        delta_t = numpy.diff(self.times)
+        devs = grid.devices(hostidx, metric)
+        devlist = devs.keys()
+        a = []
+        for interface in interfaces:
+            col = -1 if interface == "all" else indices[metric][interface]
+            a.append( numpy.array([ devs[devname][col] for devname in devlist ]) )
+
+        return devlist, formulas.evaluate(formula, a, numpy.diff(self.times))
+
+    def getdevicevalues(self, metric, formula, interfaces, grid, hostidx, indices):
+        devices = self.getdevicearray(metric, formula, interfaces, grid, hostidx, indices)
+        if devices is None:
+            return None
+        return self.devicevalues(metric, *devices)
 
+    def devicevalues(self, metric, devlist, values):
+        """ Return the device data output for the values from getdevicearray() """
         res = {}
         devnames = {}
 
-        for devname in devs[0].iterkeys():
-            a = []
-            for ifidx, interface in enumerate(interfaces):
-                a.append(devs[ifidx][devname])
-            
-            res[str(devname)] = eval(formula).tolist()
+        for devidx, devname in enumerate(devlist):
+            res[str(devname)] = values[devidx].tolist()
             devnames[str(devname)] = metric + str(devname)
 
         return res, devnames
@@ -254,15 +232,15 @@ class TimeSeriesSummary(object):
 
         results = { "hosts": {}, "times": self.times[1:].tolist() }
 
-        for hostidx, host in enumerate(j.hosts.itervalues()):
-            data = self.getvalues(settings['metric'], settings['formula'], settings['interfaces'], j, host, indices)
-            if data is None:
-                return None
+        d = self.gethostvalues(settings['metric'], settings['formula'], settings['interfaces'], self.grid, indices)
+        if d is None:
+            return None
 
+        for hostidx, data in enumerate(d):
             results['hosts'][str(hostidx)] = {}
 
             if ('devicebased' in settings) and (settings['devicebased'] == True):
-                devicedata, devnames = self.getdevicevalues(settings['metric'], settings['formula'], settings['interfaces'], j, host, indices)
+                devicedata, devnames = self.getdevicevalues(settings['metric'], settings['formula'], settings['interfaces'], self.grid, hostidx, indices)
                 results['hosts'][str(hostidx)]["dev"] = devicedata
                 results['hosts'][str(hostidx)]["names"] = devnames
 
@@ -272,13 +250,30 @@ class TimeSeriesSummary(object):
 
     def get_minmaxmed_data(self, j, indices, settings):
 
-        d = numpy.zeros( (len(j.hosts), len(self.times) - 1) )
+        d = self.gethostvalues(settings['metric'], settings['formula'], settings['interfaces'], self.grid, indices)
+        if d is None:
+            return None
 
-        for hostidx, host in enumerate(j.hosts.itervalues()):
-            data = self.getvalues(settings['metric'], settings['formula'], settings['interfaces'], j, host, indices)
-            if data is None:
-                return None
-            d[hostidx,:] = data
+        def getdevices(hostidx):
+            return self.getdevicevalues(settings['metric'], settings['formula'], settings['interfaces'], self.grid, hostidx, indices)
+
+        return self.collateminmaxmed(d, settings, getdevices)
+
+    @staticmethod
+    def minmaxmedhosts(sortarr):
+        """ Return the indices of the hosts that are output for the
+            argsort() sortarr of the (hosts x times) data """
+        # Ensure head node is always in list
+        uniqhosts = Counter( [ 0 ] )
+        uniqhosts.update(sortarr[0, :])
+        uniqhosts.update(sortarr[-1, :])
+        uniqhosts.update(sortarr[sortarr.shape[0] / 2, :])
+        return uniqhosts
+
+    def collateminmaxmed(self, d, settings, getdevices):
+        """ Return the min, max and median host data from the (hosts x times)
+            array d. getdevices(hostidx) returns the device data for a host or
+            None if it is not available. """
 
         sortarr = numpy.argsort(d, axis=0)
 
@@ -290,26 +285,147 @@ class TimeSeriesSummary(object):
             "hosts": {}
         }
 
-        # Ensure head node is always in list
-        uniqhosts = Counter( [ 0 ] )
-        uniqhosts.update(sortarr[0, :])
-        uniqhosts.update(sortarr[-1, :])
-        uniqhosts.update(sortarr[sortarr.shape[0] / 2, :])
+        uniqhosts = self.minmaxmedhosts(sortarr)
 
-        for hostidx, host in enumerate(j.hosts.itervalues()):
+        for hostidx in xrange(d.shape[0]):
             if hostidx not in uniqhosts.keys():
                 continue
 
             results['hosts'][str(hostidx)] = {}
             if ('devicebased' in settings) and (settings['devicebased'] == True):
-                devicedata, devnames = self.getdevicevalues(settings['metric'], settings['formula'], settings['interfaces'], j, host, indices)
-                results['hosts'][str(hostidx)]["dev"] = devicedata
-                results['hosts'][str(hostidx)]["names"] = devnames
+                devices = getdevices(hostidx)
+                if devices is not None:
+                    devicedata, devnames = devices
+                    results['hosts'][str(hostidx)]["dev"] = devicedata
+                    results['hosts'][str(hostidx)]["names"] = devnames
 
             results['hosts'][str(hostidx)]["all"] = d[hostidx].tolist()
 
         return results
 
+    def start(self, j, indices):
+        """ Set up the summary of a streamed job. The hosts are added one at
+            a time with addhost() and the summary is returned by finish() """
+
+        if 'cores' in j.acct and 1.0 * j.acct['cores'] / len(j.hosts) > 32:
+            self.metrics['cpuuser'][0]['devicebased'] = False
+
+        self.times = computesubsamples(j.times, numpy.diff(j.times))
+
+        # Jobs with many hosts only output the device data of the min, max
+        # and median hosts, which are only known at the end. Only the host
+        # values are kept for them and the hosts that are output are loaded
+        # again by finish().
+        self.allhosts = len(j.hosts) <= 64
+        self.hostnames = []
+        self.hostdata = {}
+        self.devicedata = {}
+        self.invalid = set()
+
+    def addhost(self, j, host, indices):
+        """ Add the data of one host of a streamed job """
+
+        self.hostnames.append(host.name)
+        grid = resample.JobGrid([host], self.times)
+        for outmetric, setlist in self.metrics.iteritems():
+            for setidx, settings in enumerate(setlist):
+                key = (outmetric, setidx)
+                if key in self.invalid:
+                    continue
+
+                data = self.gethostvalues(settings['metric'], settings['formula'], settings['interfaces'], grid, indices)
+                if data is None:
+                    # Settings are only used if every host has the data
+                    self.invalid.add(key)
+                    self.hostdata.pop(key, None)
+                    self.devicedata.pop(key, None)
+                    continue
+
+                self.hostdata.setdefault(key, []).append(data[0])
+                if self.allhosts and ('devicebased' in settings) and (settings['devicebased'] == True):
+                    devices = self.getdevicearray(settings['metric'], settings['formula'], settings['interfaces'], grid, 0, indices)
+                    self.devicedata.setdefault(key, []).append(devices)
+
+    def finish(self, j, indices, cpus_combined):
+        """ Return the summary of a streamed job """
+
+        if cpus_combined:
+            self.metrics['cpuuser'][0]['devicebased'] = False
+
+        for hostidx, hostname in enumerate(self.hostnames):
+            self.hostmap[str(hostidx)] = hostname
+
+        # The first settings of each metric that every host has data for
+        chosen = []
+        for outmetric, setlist in self.metrics.iteritems():
+            for setidx, settings in enumerate(setlist):
+                key = (outmetric, setidx)
+                if key not in self.invalid:
+                    chosen.append((outmetric, key, settings))
+                    break
+
+        hostvalues = {}
+        if not self.allhosts:
+            wanted = {}
+            for outmetric, key, settings in chosen:
+                d = numpy.zeros( (len(self.hostdata.get(key, [])), len(self.times) - 1) )
+                for hostidx, data in enumerate(self.hostdata.get(key, [])):
+                    d[hostidx,:] = data
+                hostvalues[key] = d
+                if ('devicebased' in settings) and (settings['devicebased'] == True) and d.shape[0] > 0:
+                    for hostidx in self.minmaxmedhosts(numpy.argsort(d, axis=0)):
+                        wanted.setdefault(hostidx, []).append(key)
+            self.devicedata = self.loaddevices(j, indices, wanted)
+
+        outdata = { "version": TIMESERIES_VERSION,  "hosts": self.hostmap }
+        for outmetric, key, settings in chosen:
+            devicebased = ('devicebased' in settings) and (settings['devicebased'] == True)
+
+            def getdevices(hostidx):
+                devices = self.devicedata[key][hostidx]
+                if devices is None:
+                    return None
+                return self.devicevalues(settings['metric'], *devices)
+
+            if self.allhosts:
+                results = { "hosts": {}, "times": self.times[1:].tolist() }
+                for hostidx, data in enumerate(self.hostdata.get(key, [])):
+                    results['hosts'][str(hostidx)] = {}
+                    if devicebased:
+                        devicedata, devnames = getdevices(hostidx)
+                        results['hosts'][str(hostidx)]["dev"] = devicedata
+                        results['hosts'][str(hostidx)]["names"] = devnames
+                    results['hosts'][str(hostidx)]["all"] = data.tolist()
+            else:
+                results = self.collateminmaxmed(hostvalues[key], settings, getdevices)
+
+            outdata[outmetric] = results
+
+        return outdata
+
+    def loaddevices(self, j, indices, wanted):
+        """ Return the device arrays of the hosts of a streamed job that are
+            output, indexed by settings key and host index. wanted maps the
+            index of each of these hosts to the keys of the settings that
+            need it. Each host is loaded once and released straight after. """
+        devicedata = {}
+        for hostidx in sorted(wanted):
+            host = j.hosts[self.hostnames[hostidx]]
+            loaded = host.stats is None
+            if loaded and not j.load_host(host):
+                devices = dict((key, None) for key in wanted[hostidx])
+            else:
+                grid = resample.JobGrid([host], self.times)
+                devices = {}
+                for key in wanted[hostidx]:
+                    settings = self.metrics[key[0]][key[1]]
+                    devices[key] = self.getdevicearray(settings['metric'], settings['formula'], settings['interfaces'], grid, 0, indices)
+                if loaded:
+                    j.release_host(host)
+            for key, value in devices.iteritems():
+                devicedata.setdefault(key, {})[hostidx] = value
+        return devicedata
+
     def gettimeseries(self, j, indices):
 
         for hostidx, host in enumerate(j.hosts.itervalues()):
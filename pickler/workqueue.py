@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+""" Work queue that hands out the jobs to summarize to worker processes.
+
+    The coordinator reads the accounting records of a resource the first time
+    that a worker asks for a job of that resource and leases them out one at
+    a time in order of estimated cost (nodes x walltime), largest first, so
+    that the long running jobs are started early and the workers that draw
+    short jobs keep taking more until the queue is empty. A lease that is not
+    completed within the lease timeout, or whose worker exits, is put back on
+    the queue and the job is retried by another worker up to max_attempts
+    times.
+
+    The coordinator runs in the parent process of the multiprocessing workers
+    (serve_processes()) or on MPI rank 0 (serve_mpi()). The workers use a
+    ProcessClient or MPIClient to get their jobs. """
+import bisect
+import logging
+import Queue
+import time
+
+# Seconds after which the job of a lease that has not been completed is
+# given to another worker
+LEASE_TIMEOUT = 6 * 3600
+
+# Number of times a job is handed out before it is given up on
+MAX_ATTEMPTS = 2
+
+# Seconds between the checks for expired leases and exited workers
+POLL_INTERVAL = 1.0
+
+def estimated_cost(acct):
+    """ Return the estimated cost of summarizing a job: nodes x walltime """
+    nodes = acct.get('nodes') or 1
+    return max(nodes, 1) * max(acct['end_time'] - acct['start_time'], 1)
+
+class WorkQueue(object):
+    """ Pending jobs and outstanding leases for each resource. loader is called
+        with the resource name and returns the accounting records of the
+        jobs to summarize. """
+
+    def __init__(self, loader, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.loader = loader
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        # The pending [cost, -order, attempts, acct] for each resource sorted
+        # so that the largest job is last
+        self.pending = {}
+        # leaseid: (worker, resourcename, item, expires)
+        self.leases = {}
+        self.nextlease = 0
+
+    def load(self, resourcename):
+        if resourcename not in self.pending:
+            items = [ [estimated_cost(acct), -order, 0, acct] for order, acct in enumerate(self.loader(resourcename)) ]
+            items.sort(key=lambda item: item[:2])
+            self.pending[resourcename] = items
+            logging.info("Work queue loaded %s jobs for %s", len(items), resourcename)
+
+    def lease(self, worker, resourcename, now):
+        """ Return (leaseid, acct) for the next job of the resource, None if all
+            of the jobs of the resource are done or leased to the requesting
+            worker, or False if some of the jobs left are leased to other
+            workers (they may yet be requeued) """
+        self.load(resourcename)
+        queue = self.pending[resourcename]
+        if queue:
+            item = queue.pop()
+            item[2] += 1
+            leaseid = self.nextlease
+            self.nextlease += 1
+            self.leases[leaseid] = (worker, resourcename, item, now + self.lease_timeout)
+            return leaseid, item[3]
+
+        if any(lease[0] != worker and lease[1] == resourcename for lease in self.leases.itervalues()):
+            return False
+        return None
+
+    def complete(self, leaseid):
+        """ Mark the job of a lease as done. Leases that have expired and been
+            requeued are ignored. """
+        self.leases.pop(leaseid, None)
+
+    def requeue(self, leaseid, reason):
+        worker, resourcename, item, _ = self.leases.pop(leaseid)
+        acct = item[3]
+        if item[2] >= self.max_attempts:
+            logging.error("Work queue giving up on %s job %s after %s attempts (%s)", resourcename, acct['id'], item[2], reason)
+            return
+        logging.warning("Work queue requeued %s job %s from worker %s (%s)", resourcename, acct['id'], worker, reason)
+        keys = [ i[:2] for i in self.pending[resourcename] ]
+        self.pending[resourcename].insert(bisect.bisect_left(keys, item[:2]), item)
+
+    def expire(self, now):
+        """ Requeue the jobs whose leases have timed out """
+        for leaseid, lease in self.leases.items():
+            if lease[3] < now:
+                self.requeue(leaseid, "lease timed out")
+
+    def release(self, worker):
+        """ Requeue the jobs leased to a worker that has exited """
+        for leaseid, lease in self.leases.items():
+            if lease[0] == worker:
+                self.requeue(leaseid, "worker exited")
+
+class Coordinator(object):
+    """ Handles the messages from the workers. The messages are ("lease",
+        resourcename), answered with ("job", leaseid, acct) or ("done",),
+        ("complete", leaseid) and ("exit",). A lease request that has to wait
+        for the leases of other workers is answered once they are completed
+        or requeued. """
+
+    def __init__(self, workqueue):
+        self.workqueue = workqueue
+        self.waiting = {}
+        self.exited = set()
+
+    def dispatch(self, worker, message, now):
+        """ Handle a message and return the list of (worker, reply) to send """
+        if message[0] == "lease":
+            self.waiting[worker] = message[1]
+        elif message[0] == "complete":
+            self.workqueue.complete(message[1])
+        elif message[0] == "exit":
+            return self.workerexited(worker, now)
+        return self.replies(now)
+
+    def workerexited(self, worker, now):
+        """ Handle a worker that exited, the jobs that it still holds leases
+            for are requeued """
+        self.exited.add(worker)
+        self.waiting.pop(worker, None)
+        self.workqueue.release(worker)
+        return self.replies(now)
+
+    def tick(self, now):
+        self.workqueue.expire(now)
+        return self.replies(now)
+
+    def replies(self, now):
+        result = []
+        for worker, resourcename in self.waiting.items():
+            lease = self.workqueue.lease(worker, resourcename, now)
+            if lease == False:
+                continue
+            del self.waiting[worker]
+            if lease == None:
+                result.append((worker, ("done",)))
+            else:
+                result.append((worker, ("job", lease[0], lease[1])))
+        return result
+
+class WorkQueueClient(object):
+    """ Worker side of the work queue. send is called with each message for
+        the coordinator and receive returns the coordinator's next reply. """
+
+    def __init__(self, send, receive):
+        self.send = send
+        self.receive = receive
+        self.leases = {}
+
+    def request(self, message):
+        self.send(message)
+        return self.receive()
+
+    def accts(self, resourcename):
+        """ Generator that yields the accounting records of the jobs of the
+            resource leased to this worker until there are none left """
+        while True:
+            reply = self.request(("lease", resourcename))
+            if reply[0] == "done":
+                return
+            self.leases[reply[2]['id']] = reply[1]
+            yield reply[2]
+
+    def complete(self, acct):
+        """ Tell the coordinator that the job has been summarized """
+        leaseid = self.leases.pop(acct['id'], None)
+        if leaseid != None:
+            self.send(("complete", leaseid))
+
+    def completing(self, jobs):
+        """ Yield the jobs and complete each one when the next is asked for.
+            A job whose processing raises an exception stays leased, so it is
+            requeued when the worker exits. """
+        for job in jobs:
+            yield job
+            self.complete(job.acct)
+
+    def close(self):
+        self.send(("exit",))
+
+class ProcessClient(WorkQueueClient):
+    """ Client for a multiprocessing worker, see serve_processes() """
+
+    def __init__(self, worker, requests, replies):
+        WorkQueueClient.__init__(self, lambda message: requests.put((worker, message)), lambda: getreply(replies))
+
+def getreply(replies):
+    """ Wait for the next reply on the replies queue. The wait is timed so
+        that a signal handler runs while the reply is awaited. """
+    while True:
+        try:
+            return replies.get(timeout=POLL_INTERVAL)
+        except Queue.Empty:
+            pass
+
+class MPIClient(WorkQueueClient):
+    """ Client for an MPI worker, see serve_mpi() """
+
+    def __init__(self, comm):
+        WorkQueueClient.__init__(self, lambda message: comm.send(message, dest=0), lambda: comm.recv(source=0))
+
+def serve_processes(coordinator, requests, replies, procs):
+    """ Run the coordinator for the multiprocessing.Process workers procs
+        until they have all exited. The workers send (worker index, message)
+        on the requests queue and get their replies on replies[worker]. """
+    while len(coordinator.exited) < len(procs):
+        now = time.time()
+        try:
+            worker, message = requests.get(timeout=POLL_INTERVAL)
+            sends = coordinator.dispatch(worker, message, now)
+        except Queue.Empty:
+            sends = []
+
+        for worker, proc in enumerate(procs):
+            if worker not in coordinator.exited and not proc.is_alive() and requests.empty():
+                sends += coordinator.workerexited(worker, now)
+        sends += coordinator.tick(now)
+
+        for worker, reply in sends:
+            replies[worker].put(reply)
+
+def serve_mpi(coordinator, comm):
+    """ Run the coordinator on MPI rank 0 for the workers on the other ranks
+        until they have all exited """
+    from mpi4py import MPI
+
+    nworkers = comm.Get_size() - 1
+    status = MPI.Status()
+    while len(coordinator.exited) < nworkers:
+        now = time.time()
+        sends = []
+        if comm.Iprobe(source=MPI.ANY_SOURCE, status=status):
+            message = comm.recv(source=status.Get_source())
+            sends += coordinator.dispatch(status.Get_source(), message, now)
+        else:
+            time.sleep(min(POLL_INTERVAL, 0.05))
+        sends += coordinator.tick(now)
+
+        for worker, reply in sends:
+            comm.send(reply, dest=worker)